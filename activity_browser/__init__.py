@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 
 PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
-from .app import Application, run_activity_browser
+from .app import LazyApplicationModule, run_activity_browser
+
+# ``Application`` is only imported when it is used
+sys.modules[__name__].__class__ = LazyApplicationModule
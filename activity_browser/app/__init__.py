@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 import sys
 import traceback
-
-from PyQt5 import QtWidgets
-
-from .application import Application
+import types
 
 
 def run_activity_browser():
+    from PyQt5 import QtWidgets
+    from .application import Application
+
     qapp = QtWidgets.QApplication(sys.argv)
     application = Application()
     application.show()
@@ -18,3 +18,20 @@ def run_activity_browser():
     sys.excepthook = exception_hook
 
     sys.exit(qapp.exec_())
+
+
+class LazyApplicationModule(types.ModuleType):
+    """Module type that imports the Qt ``Application`` when it is first accessed.
+
+    The headless parts of the package (e.g. ``app.bwutils.batch``) thus also work without a
+    display. A module level ``__getattr__`` would need Python 3.7.
+    """
+    def __getattr__(self, name):
+        if name == 'Application':
+            from .application import Application
+            setattr(self, name, Application)
+            return Application
+        raise AttributeError("module {!r} has no attribute {!r}".format(self.__name__, name))
+
+
+sys.modules[__name__].__class__ = LazyApplicationModule
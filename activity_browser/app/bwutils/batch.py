@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import sys
+import traceback
+
+import brightway2 as bw
+import pandas as pd
+
+from .multilca import MLCA
+
+
+FORMATS = ('csv', 'parquet', 'hdf5')
+ENGINES = {'parquet': ('pyarrow', 'fastparquet'), 'hdf5': ('tables',)}
+
+
+def method_label(method):
+    return ', '.join(method)
+
+
+def result_frames(mlca, limit=5):
+    """Return the scores and the top contributions of an ``MLCA`` as long-format DataFrames.
+
+    Scores have one row per functional unit and method. Contributions have one row for each of
+    the ``limit`` largest process and elementary flow contributions of every functional unit and
+    method, plus the rest, with their absolute value and their share of the score.
+    """
+    func_units = [(i, next(iter(fu.keys())), next(iter(fu.values())))
+                  for i, fu in enumerate(mlca.func_units)]
+    scores = pd.DataFrame([
+        (mlca.cs_name, i, key[0], key[1], amount, method_label(method), mlca.results[i, col])
+        for i, key, amount in func_units for col, method in enumerate(mlca.methods)
+    ], columns=['calculation_setup', 'functional_unit', 'database', 'code', 'amount', 'method',
+                'score'])
+
+    rows = []
+    for col, method in enumerate(mlca.methods):
+        mlca.contribution_method(method)
+        for kind, store, rev_dict in (
+                ('process', mlca.process_contributions, mlca.rev_activity_dict),
+                ('elementary flow', mlca.elementary_flow_contributions, mlca.rev_biosphere_dict)):
+            totals = store.totals(col)
+            for (i, _, _), top, total in zip(func_units, store.top_array(col, limit), totals):
+                entries = [rev_dict[index] + (value,)
+                           for index, value in zip(top['index'], top['value']) if index >= 0]
+                entries.append(('Rest', '', top['rest']))
+                rows.extend(
+                    (mlca.cs_name, i, method_label(method), kind, rank, database, code, value,
+                     value / total if total else 0.)
+                    for rank, (database, code, value) in enumerate(entries)
+                )
+    contributions = pd.DataFrame(rows, columns=[
+        'calculation_setup', 'functional_unit', 'method', 'type', 'rank', 'database', 'code',
+        'contribution', 'share'])
+    return scores, contributions
+
+
+def calculate_setup(cs_name, limit=5, **kwargs):
+    """Calculate a calculation setup and return its result frames; ``kwargs`` are passed to
+    ``MLCA``."""
+    return result_frames(MLCA(cs_name, **kwargs), limit)
+
+
+def run_batch(cs_names, processes=1, limit=5, **kwargs):
+    """Calculate calculation setups, spread over ``processes`` worker processes.
+
+    Yields ``(cs_name, scores, contributions, error)`` per calculation setup, in the given order.
+    A failing calculation setup does not stop the others; its frames are None and ``error`` is
+    the formatted traceback.
+    """
+    tasks = [(cs_name, limit, kwargs) for cs_name in cs_names]
+    if processes > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(processes, len(tasks)), initializer=_init_worker,
+                                  initargs=(bw.projects.current,)) as pool:
+            for task, result in zip(tasks, pool.imap(_calculate_task, tasks)):
+                yield (task[0],) + result
+    else:
+        for task in tasks:
+            yield (task[0],) + _calculate_task(task)
+
+
+def missing_engine(fmt):
+    """Return an error message if no package to write ``fmt`` is installed, else None."""
+    engines = ENGINES.get(fmt, ())
+    if engines and not any(importlib.util.find_spec(engine) for engine in engines):
+        return "Writing {} requires one of the packages: {}".format(fmt, ', '.join(engines))
+
+
+def write_results(scores, contributions, output, fmt='csv'):
+    """Write the result frames to ``output``: a directory for 'csv' and 'parquet', a file for
+    'hdf5'.
+
+    Parquet needs pyarrow or fastparquet and HDF5 needs pytables to be installed.
+    """
+    if fmt == 'hdf5':
+        directory = os.path.dirname(os.path.abspath(output))
+        os.makedirs(directory, exist_ok=True)
+        scores.to_hdf(output, key='scores', mode='w', format='table')
+        contributions.to_hdf(output, key='contributions', mode='a', format='table')
+        return [output]
+    os.makedirs(output, exist_ok=True)
+    paths = [os.path.join(output, '{}.{}'.format(name, fmt))
+             for name in ('scores', 'contributions')]
+    for frame, path in zip((scores, contributions), paths):
+        if fmt == 'csv':
+            frame.to_csv(path, index=False)
+        elif fmt == 'parquet':
+            frame.to_parquet(path, index=False)
+        else:
+            raise ValueError("Unknown format {}, choose one of {}".format(fmt, FORMATS))
+    return paths
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='activity-browser-batch',
+        description='Calculate calculation setups without the graphical user interface and write '
+                    'their scores and top contributions to files.')
+    parser.add_argument('calculation_setups', nargs='*', metavar='SETUP',
+                        help='names of the calculation setups to calculate')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='calculate all calculation setups of the project')
+    parser.add_argument('-p', '--project', default=None,
+                        help='brightway2 project (default: the current project)')
+    parser.add_argument('-o', '--output', default='lca_results',
+                        help="output directory, or file for hdf5 (default: 'lca_results')")
+    parser.add_argument('-f', '--format', choices=FORMATS, default='csv',
+                        help="output format (default: 'csv')")
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('-n', '--limit', type=int, default=5,
+                        help='number of top contributions per functional unit and method '
+                             '(default: 5)')
+    parser.add_argument('--cutoff', type=float, default=1e-4,
+                        help='relative cutoff of stored contributions (default: 1e-4)')
+    parser.add_argument('--batch-size', type=int, default=MLCA.BATCH_SIZE,
+                        help='functional units solved at once (default: {})'.format(
+                            MLCA.BATCH_SIZE))
+    args = parser.parse_args(argv)
+    if not args.calculation_setups and not args.all:
+        parser.error('give the names of calculation setups or --all')
+    return args
+
+
+def run_batch_lca(argv=None):
+    """Console entry point of ``activity-browser-batch``; returns the exit code."""
+    args = parse_arguments(argv)
+    if args.project:
+        if args.project not in bw.projects:
+            print("Project {} does not exist.".format(args.project), file=sys.stderr)
+            return 2
+        bw.projects.set_current(args.project)
+    if missing_engine(args.format):
+        print(missing_engine(args.format), file=sys.stderr)
+        return 2
+    cs_names = sorted(bw.calculation_setups) if args.all else args.calculation_setups
+    unknown = [cs_name for cs_name in cs_names if cs_name not in bw.calculation_setups]
+    if unknown:
+        print("Unknown calculation setups: {}".format(', '.join(unknown)), file=sys.stderr)
+        return 2
+
+    scores, contributions, failed = [], [], []
+    results = run_batch(cs_names, processes=args.processes, limit=args.limit,
+                        batch_size=args.batch_size, contribution_cutoff=args.cutoff or None)
+    for done, (cs_name, cs_scores, cs_contributions, error) in enumerate(results, 1):
+        if error:
+            failed.append(cs_name)
+            print("[{}/{}] {} failed:\n{}".format(done, len(cs_names), cs_name, error),
+                  file=sys.stderr)
+            continue
+        scores.append(cs_scores)
+        contributions.append(cs_contributions)
+        print("[{}/{}] {}".format(done, len(cs_names), cs_name))
+
+    if scores:
+        paths = write_results(pd.concat(scores, ignore_index=True),
+                              pd.concat(contributions, ignore_index=True), args.output, args.format)
+        print("Results written to {}".format(', '.join(paths)))
+    return 1 if failed else 0
+
+
+def main():
+    sys.exit(run_batch_lca())
+
+
+def _init_worker(project):
+    if bw.projects.current != project:
+        bw.projects.set_current(project)
+
+
+def _calculate_task(task):
+    cs_name, limit, kwargs = task
+    try:
+        return calculate_setup(cs_name, limit, **kwargs) + (None,)
+    except Exception:
+        return None, None, traceback.format_exc()
+
+
+if __name__ == '__main__':
+    main()
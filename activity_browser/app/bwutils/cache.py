@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+
+import numpy as np
+import brightway2 as bw
+
+from .contributions import ContributionStore
+from .multilca import MLCA
+
+
+class ResultCache(object):
+    """On-disk cache of ``MLCA`` results, stored in the directory of the current project.
+
+    Every entry is keyed by a hash of the ``inv`` and ``ia`` of a calculation setup, the
+    contribution options and the modification times of all involved databases (including the
+    databases they depend on) and LCIA methods. An entry therefore never returns outdated
+    results, even if the data was changed outside of the Activity Browser.
+
+    The scores, the contribution stores and the matrix indices are saved in a compressed
+    ``.npz`` file; the supply arrays and inventories are not cached. The index of all entries
+    is kept next to them in ``index.json``, so that the entries depending on a changed
+    database can be removed with ``invalidate_database``. A changed LCIA method only changes
+    the key; the outdated entry is replaced when its calculation setup is saved again, as only
+    the latest entry of every calculation setup is kept. Contributions are cached with the
+    precision they were calculated with, which is part of the key.
+    """
+    DIRECTORY = 'AB_result_cache'
+
+    @property
+    def directory(self):
+        return os.path.join(bw.projects.dir, self.DIRECTORY)
+
+    @property
+    def index_file(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def load_index(self):
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'r') as infile:
+                return json.load(infile)
+        return {}
+
+    def write_index(self, index):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.index_file, 'w') as outfile:
+            json.dump(index, outfile, indent=4, sort_keys=True)
+
+    def entry_file(self, key):
+        return os.path.join(self.directory, '{}.npz'.format(key))
+
+    @staticmethod
+    def involved_databases(func_units):
+        """Return the databases of the functional units and, recursively, their dependencies."""
+        found = set()
+        todo = {key[0] for func_unit in func_units for key in func_unit}
+        while todo:
+            name = todo.pop()
+            if name in found or name not in bw.databases:
+                continue
+            found.add(name)
+            todo.update(bw.databases[name].get('depends', []))
+        return sorted(found)
+
+    @staticmethod
+    def method_timestamp(method):
+        filepath = bw.Method(method).filepath_processed()
+        return bw.methods[method].get(
+            'modified', os.path.getmtime(filepath) if os.path.isfile(filepath) else None)
+
+    def fingerprint(self, cs_name, contribution_limit=None, contribution_cutoff=1e-4,
+                    contribution_dtype=np.float64):
+        """Return the cache key and the involved databases and methods of a calculation setup."""
+        cs = bw.calculation_setups[cs_name]
+        databases = self.involved_databases(cs['inv'])
+        methods = [tuple(method) for method in cs['ia']]
+        content = json.dumps({
+            'inv': [sorted([list(key), amount] for key, amount in func_unit.items())
+                    for func_unit in cs['inv']],
+            'ia': methods,
+            'databases': [[name, bw.databases[name].get('modified')] for name in databases],
+            'methods': [[method, self.method_timestamp(method)] for method in methods],
+            'contribution_limit': contribution_limit,
+            'contribution_cutoff': contribution_cutoff,
+            'contribution_dtype': np.dtype(contribution_dtype).name,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest(), databases, methods
+
+    def load(self, cs_name, contribution_limit=None, contribution_cutoff=1e-4,
+             contribution_dtype=np.float64, contribution_directory=None):
+        """Return the cached ``MLCA`` of a calculation setup, or None if it is not (or no longer)
+        cached."""
+        if cs_name not in bw.calculation_setups:
+            return None
+        key, _, _ = self.fingerprint(
+            cs_name, contribution_limit, contribution_cutoff, contribution_dtype)
+        if key not in self.load_index() or not os.path.isfile(self.entry_file(key)):
+            return None
+        cs = bw.calculation_setups[cs_name]
+        mlca = MLCA.__new__(MLCA)
+        mlca.cs_name = cs_name
+        mlca.func_units = cs['inv']
+        mlca.methods = cs['ia']
+        mlca.method_dict = {m: i for i, m in enumerate(mlca.methods)}
+        mlca.batch_size = MLCA.BATCH_SIZE
+        mlca.contribution_limit = contribution_limit
+        mlca.contribution_cutoff = contribution_cutoff
+        mlca.contribution_dtype = np.dtype(contribution_dtype)
+        mlca.contribution_directory = contribution_directory
+        with np.load(self.entry_file(key)) as data:
+            mlca.results = data['results']
+            mlca.rev_activity_dict = self.reverse_dict(data['activities'])
+            mlca.rev_product_dict = self.reverse_dict(data['products'])
+            mlca.rev_biosphere_dict = self.reverse_dict(data['biosphere'])
+            mlca.process_contributions = self.load_store(
+                data, 'process', len(mlca.methods), len(data['activities']), mlca)
+            mlca.elementary_flow_contributions = self.load_store(
+                data, 'biosphere', len(mlca.methods), len(data['biosphere']), mlca)
+        return mlca
+
+    def save(self, mlca):
+        """Store the results of a calculated ``MLCA``, replacing older entries of its calculation
+        setup."""
+        key, databases, methods = self.fingerprint(
+            mlca.cs_name, mlca.contribution_limit, mlca.contribution_cutoff,
+            mlca.contribution_dtype)
+        arrays = {
+            'results': mlca.results,
+            'activities': self.key_array(mlca.rev_activity_dict),
+            'products': self.key_array(mlca.rev_product_dict),
+            'biosphere': self.key_array(mlca.rev_biosphere_dict),
+        }
+        arrays.update(self.store_arrays(mlca.process_contributions, 'process'))
+        arrays.update(self.store_arrays(mlca.elementary_flow_contributions, 'biosphere'))
+        os.makedirs(self.directory, exist_ok=True)
+        np.savez_compressed(self.entry_file(key), **arrays)
+
+        index = self.load_index()
+        self.remove(index, [k for k, entry in index.items()
+                            if entry['calculation_setup'] == mlca.cs_name and k != key])
+        index[key] = {
+            'calculation_setup': mlca.cs_name,
+            'databases': databases,
+            'methods': [list(method) for method in methods],
+        }
+        self.write_index(index)
+
+    def invalidate_database(self, name):
+        """Remove all entries that depend on the database ``name``."""
+        index = self.load_index()
+        self.remove(index, [k for k, entry in index.items() if name in entry['databases']])
+
+    def invalidate_calculation_setup(self, cs_name):
+        """Remove the entries of the calculation setup ``cs_name``."""
+        index = self.load_index()
+        self.remove(index, [k for k, entry in index.items()
+                            if entry['calculation_setup'] == cs_name])
+
+    def clear(self):
+        index = self.load_index()
+        self.remove(index, list(index))
+
+    def remove(self, index, keys):
+        if not keys:
+            return
+        for key in keys:
+            index.pop(key, None)
+            if os.path.isfile(self.entry_file(key)):
+                os.remove(self.entry_file(key))
+        self.write_index(index)
+
+    @staticmethod
+    def key_array(rev_dict):
+        """Return the keys of a reversed matrix dictionary as (index x 2) string array."""
+        return np.array([rev_dict[i] for i in range(len(rev_dict))], dtype=str).reshape(-1, 2)
+
+    @staticmethod
+    def reverse_dict(keys):
+        return {i: tuple(key) for i, key in enumerate(keys.tolist())}
+
+    @staticmethod
+    def store_arrays(store, prefix):
+        arrays = {}
+        for method in range(len(store)):
+            matrix = store.matrix(method)
+            arrays.update({
+                '{}_{}_data'.format(prefix, method): matrix.data,
+                '{}_{}_indices'.format(prefix, method): matrix.indices,
+                '{}_{}_indptr'.format(prefix, method): matrix.indptr,
+                '{}_{}_totals'.format(prefix, method): store.totals(method),
+            })
+        return arrays
+
+    @staticmethod
+    def load_store(data, prefix, n_methods, size, mlca):
+        store = ContributionStore(
+            n_methods, size, limit=mlca.contribution_limit, cutoff=mlca.contribution_cutoff,
+            dtype=mlca.contribution_dtype, directory=mlca.contribution_directory)
+        for method in range(n_methods):
+            name = '{}_{}_'.format(prefix, method)
+            rows = (data[name + 'data'], data[name + 'indices'], data[name + 'indptr'])
+            store.insert(method, rows, data[name + 'totals'])
+        return store
+
+
+result_cache = ResultCache()
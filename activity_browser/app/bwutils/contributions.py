@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+from scipy import sparse
+
+
+def broadcast_multiply(vector, matrix):
+    """Multiply the sparse (1 x n) ``vector`` elementwise with every row of the dense (k x n)
+    ``matrix``.
+
+    Only the columns in which ``vector`` is non-zero are computed. Returns a (k x n) CSR matrix.
+    """
+    vector = sparse.csr_matrix(vector)
+    indices, data = vector.indices, vector.data
+    values = matrix[:, indices] * data
+    rows = matrix.shape[0]
+    return sparse.csr_matrix(
+        (values.ravel(), np.tile(indices, rows), np.arange(rows + 1) * len(indices)),
+        shape=matrix.shape
+    )
+
+
+def membership_matrix(labels):
+    """Return the sorted groups of ``labels`` and the sparse (labels x groups) matrix that sums
+    them."""
+    groups, columns = np.unique(np.asarray(labels, dtype=object).astype(str), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(labels)), (np.arange(len(labels)), columns)), shape=(len(labels), len(groups)))
+    return list(groups), matrix
+
+
+def top_dtype(limit):
+    """Structured dtype of the top ``limit`` contributions (and the rest) of one row."""
+    return np.dtype([
+        ('index', np.int64, (limit,)),
+        ('value', np.float64, (limit,)),
+        ('rest', np.float64),
+    ])
+
+
+class ContributionStore(object):
+    """Sparse storage of contribution results for many functional units and LCIA methods.
+
+    Instead of a dense (functional units x methods x activities) array, the contributions of
+    each LCIA method are stored in a CSR matrix with one row per functional unit and one column
+    per technosphere (or biosphere) index. Only non-zero entries are kept. Rows can be reduced
+    further to the ``limit`` largest (absolute) contributions and/or to the contributions that
+    are at least ``cutoff`` times the summed absolute contributions of that row.
+
+    The sum of every row is stored before reducing it, so the 'Rest' of a contribution
+    analysis remains exact.
+
+    Rows are added per method with ``append``, either one functional unit at a time or in blocks,
+    or taken over from another store with ``extend``.
+
+    The contributions are stored with the given ``dtype``; float32 halves the memory of a store,
+    while the totals are always kept as float64. With a ``directory`` the data and column indices
+    of every method are appended to files in a new subdirectory of it instead of being kept in
+    memory, and ``matrix`` returns CSR matrices backed by ``numpy.memmap`` views of these files.
+    The subdirectory is removed together with the store.
+    """
+    def __init__(self, n_methods, size, limit=None, cutoff=None, dtype=np.float64, directory=None):
+        self.size = size
+        self.limit = limit
+        self.cutoff = cutoff
+        self.dtype = np.dtype(dtype)
+        self.directory = directory
+        self.path = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.path = tempfile.mkdtemp(prefix='contributions_', dir=directory)
+            weakref.finalize(self, shutil.rmtree, self.path, True)
+        self._blocks = [[] for _ in range(n_methods)]
+        self._totals = [[] for _ in range(n_methods)]
+        self._mapped = {}
+        self._generations = [0] * n_methods
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @property
+    def nbytes(self):
+        """Memory used by the stored contributions; memory-mapped data and indices are not
+        counted."""
+        return sum(self.method_nbytes(method) for method in range(len(self)))
+
+    def method_nbytes(self, method):
+        """Memory used by the stored contributions of a method."""
+        if self.path is not None:
+            return sum(counts.nbytes for counts in self._blocks[method])
+        return sum(block.data.nbytes + block.indices.nbytes + block.indptr.nbytes
+                   for block in self._blocks[method])
+
+    def append(self, method, rows):
+        """Add one (1-d) or several (2-d, dense or sparse) rows of contributions for a method."""
+        if sparse.issparse(rows):
+            rows = sparse.csr_matrix(rows, dtype=np.float64)
+        else:
+            rows = sparse.csr_matrix(np.atleast_2d(np.asarray(rows, dtype=np.float64)))
+        if rows.shape[1] != self.size:
+            raise ValueError("Expected rows of length {}, got {}".format(self.size, rows.shape[1]))
+        self._totals[method].append(np.asarray(rows.sum(axis=1)).ravel())
+        self.store(method, self.reduce(rows))
+
+    def insert(self, method, rows, totals):
+        """Add already reduced (sparse or (data, indices, indptr)) rows with their unreduced
+        totals."""
+        rows = sparse.csr_matrix(rows, shape=(len(totals), self.size))
+        self._totals[method].append(np.asarray(totals, dtype=np.float64))
+        self.store(method, rows)
+
+    def store(self, method, rows):
+        """Keep a block of reduced rows, converted to the ``dtype`` of the store."""
+        self._mapped.pop(method, None)
+        if self.path is None:
+            self._blocks[method].append(sparse.csr_matrix(
+                (rows.data.astype(self.dtype, copy=False), rows.indices, rows.indptr),
+                shape=rows.shape))
+            return
+        for name, array in (('data', rows.data.astype(self.dtype, copy=False)),
+                            ('indices', rows.indices.astype(np.int32, copy=False))):
+            with open(self.filepath(method, name), 'ab') as outfile:
+                outfile.write(array.tobytes())
+        self._blocks[method].append(np.diff(rows.indptr))
+
+    def clear(self, method):
+        """Remove the contributions of a method; its rows can be added again with ``append``."""
+        self._mapped.pop(method, None)
+        self._blocks[method] = []
+        self._totals[method] = []
+        if self.path is not None:
+            for name in ('data', 'indices'):
+                try:
+                    os.remove(self.filepath(method, name))
+                except OSError:
+                    pass  # missing, or still mapped on Windows
+            self._generations[method] += 1
+
+    def filepath(self, method, name):
+        filename = '{}_{}_{}.bin'.format(method, self._generations[method], name)
+        return os.path.join(self.path, filename)
+
+    def extend(self, other):
+        """Append the rows of another store with the same methods and size."""
+        for method in range(len(self)):
+            if self.path is None and other.path is None and self.dtype == other.dtype:
+                self._blocks[method].extend(other._blocks[method])
+                self._totals[method].extend(other._totals[method])
+            elif other._blocks[method]:
+                self.insert(method, other.matrix(method), other.totals(method))
+
+    def take(self, rows, methods):
+        """Return a new store with the given rows of the given methods, in the given order."""
+        store = ContributionStore(len(methods), self.size, limit=self.limit, cutoff=self.cutoff,
+                                  dtype=self.dtype, directory=self.directory)
+        for new, method in enumerate(methods):
+            if self._blocks[method]:
+                store.insert(new, self.matrix(method)[rows], self.totals(method)[rows])
+        return store
+
+    def copy(self):
+        """Return a new store with the same contributions."""
+        return self.take(slice(None), range(len(self)))
+
+    def add_methods(self, count):
+        """Add ``count`` methods without contributions; their rows are added with ``append``."""
+        self._blocks.extend([] for _ in range(count))
+        self._totals.extend([] for _ in range(count))
+        self._generations.extend([0] * count)
+
+    def reduce(self, rows):
+        """Remove zeros and, if requested, contributions below the cutoff or outside the top
+        ``limit``."""
+        rows.sum_duplicates()
+        rows.eliminate_zeros()
+        if self.cutoff:
+            abs_totals = np.asarray(abs(rows).sum(axis=1)).ravel()
+            row_of_entry = np.repeat(np.arange(rows.shape[0]), np.diff(rows.indptr))
+            rows.data[np.abs(rows.data) < self.cutoff * abs_totals[row_of_entry]] = 0
+            rows.eliminate_zeros()
+        if self.limit is not None:
+            for i in range(rows.shape[0]):
+                start, end = rows.indptr[i], rows.indptr[i + 1]
+                if end - start > self.limit:
+                    row_data = rows.data[start:end]
+                    smallest = np.argsort(np.abs(row_data))[:end - start - self.limit]
+                    row_data[smallest] = 0
+            rows.eliminate_zeros()
+        return rows
+
+    def matrix(self, method):
+        """Return the (functional units x size) CSR matrix of contributions for a method."""
+        blocks = self._blocks[method]
+        if not blocks:
+            return sparse.csr_matrix((0, self.size), dtype=self.dtype)
+        if self.path is not None:
+            return self.mapped_matrix(method)
+        if len(blocks) > 1:
+            blocks[:] = [sparse.vstack(blocks, format='csr')]
+            self._totals[method][:] = [np.concatenate(self._totals[method])]
+        return blocks[0]
+
+    def mapped_matrix(self, method):
+        """Return the CSR matrix of a method from its memory-mapped data and indices."""
+        if method not in self._mapped:
+            counts = self._blocks[method]
+            if len(counts) > 1:
+                counts[:] = [np.concatenate(counts)]
+                self._totals[method][:] = [np.concatenate(self._totals[method])]
+            indptr = np.concatenate(([0], np.cumsum(counts[0])))
+            arrays = [
+                np.memmap(self.filepath(method, name), dtype=dtype, mode='r', shape=(indptr[-1],))
+                if indptr[-1] else np.zeros(0, dtype=dtype)
+                for name, dtype in (('data', self.dtype), ('indices', np.int32))
+            ]
+            self._mapped[method] = sparse.csr_matrix(
+                (arrays[0], arrays[1], indptr), shape=(len(counts[0]), self.size))
+        return self._mapped[method]
+
+    def totals(self, method):
+        """Return the summed (unreduced) contributions of every functional unit for a method."""
+        self.matrix(method)
+        totals = self._totals[method]
+        return totals[0] if totals else np.zeros(0)
+
+    def top_array(self, method, limit=5):
+        """Return the ``limit`` largest absolute contributions of every row of a method at once.
+
+        The result is a structured array with one record per row: the ``index`` and ``value`` of
+        the top contributions (sorted by absolute value, padded with index -1 and value 0) and the
+        ``rest`` of the row total. The stored entries of all rows are laid out in a padded
+        (rows x largest row) array, on which ``np.argpartition`` selects the top of every row.
+        """
+        matrix = self.matrix(method)
+        rows = matrix.shape[0]
+        counts = np.diff(matrix.indptr)
+        width = max(counts.max() if rows else 0, limit)
+        row_of_entry = np.repeat(np.arange(rows), counts)
+        col_of_entry = np.arange(matrix.nnz) - np.repeat(matrix.indptr[:-1], counts)
+        magnitude = np.full((rows, width), -1.0)
+        magnitude[row_of_entry, col_of_entry] = np.abs(matrix.data)
+        entry = np.full((rows, width), -1)  # -1 points to the padding appended below
+        entry[row_of_entry, col_of_entry] = np.arange(matrix.nnz)
+
+        top = np.argpartition(-magnitude, limit - 1, axis=1)[:, :limit]
+        order = np.argsort(-np.take_along_axis(magnitude, top, axis=1), axis=1, kind='stable')
+        top_entries = np.take_along_axis(entry, np.take_along_axis(top, order, axis=1), axis=1)
+
+        result = np.zeros(rows, dtype=top_dtype(limit))
+        result['index'] = np.append(matrix.indices, -1)[top_entries]
+        result['value'] = np.append(matrix.data, 0.)[top_entries]
+        result['rest'] = self.totals(method) - result['value'].sum(axis=1)
+        return result
+
+    def to_dense(self, method):
+        """Return the contributions of a method as a dense (functional units x size) array."""
+        return self.matrix(method).toarray()
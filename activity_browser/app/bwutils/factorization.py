@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import brightway2 as bw
+import numpy as np
+from scipy.sparse.linalg import splu
+
+
+class FactorizedSystem(object):
+    """The technosphere, biosphere and factorized technosphere of a set of databases.
+
+    The matrices are built and the technosphere is factorized once; ``lca`` hands out new
+    ``LCA`` objects for any demand (and method) in these databases that share them. The
+    solver accepts a single demand vector as well as a matrix of demand vectors.
+    """
+    SHARED = (
+        'bio_params', 'tech_params', 'biosphere_dict', 'activity_dict', 'product_dict',
+        '_biosphere_dict', '_activity_dict', '_product_dict', '_fixed',
+        'biosphere_matrix', 'technosphere_matrix', 'solver',
+    )
+
+    def __init__(self, lca):
+        lca.load_lci_data()
+        lca.solver = splu(lca.technosphere_matrix.tocsc()).solve
+        self.database_filepath = lca.database_filepath
+        self.demand = lca.demand
+        self.shared = {attr: getattr(lca, attr) for attr in self.SHARED if hasattr(lca, attr)}
+        self.scores = {}
+
+    def lca(self, demand, method=None):
+        """Return an ``LCA`` with the shared matrices and solver, and the demand array of
+        ``demand``.
+
+        If a ``method`` is given its characterization matrix is loaded as well. The shared
+        matrices must not be modified.
+        """
+        lca = bw.LCA(demand, method)
+        lca.__dict__.update(self.shared)
+        lca.build_demand_array()
+        if method:
+            lca.load_lcia_data()
+        return lca
+
+    def unit_scores(self, method):
+        """Return the direct score of one unit of every activity and the cumulative score of one
+        unit of every product for ``method``.
+
+        The cumulative scores of all products follow from a single solve of the transposed
+        technosphere; both arrays are memoized per method (and processed method file).
+        """
+        filepath = bw.Method(method).filepath_processed()
+        key = (tuple(method), os.path.getmtime(filepath) if os.path.isfile(filepath) else None)
+        if key not in self.scores:
+            lca = self.lca(self.demand, method)
+            direct = np.asarray(
+                (lca.characterization_matrix * lca.biosphere_matrix).sum(axis=0)).ravel()
+            self.scores[key] = direct, self.shared['solver'](direct, trans='T')
+        return self.scores[key]
+
+
+class FactorizedSystems(object):
+    """Project-level service that builds and factorizes the matrices of each set of databases once.
+
+    Systems are keyed by the processed arrays (and their modification times) of the databases
+    a demand depends on, so every database state is factorized only once. Systems that use a
+    changed database are removed with ``invalidate``; ``clear`` removes all of them, e.g. when
+    another project is selected.
+    """
+    def __init__(self):
+        self.systems = {}
+        self.lock = threading.Lock()
+
+    def get(self, demand):
+        """Return the ``FactorizedSystem`` of the databases ``demand`` depends on."""
+        lca = bw.LCA(demand)
+        key = tuple(sorted(
+            (filepath, os.path.getmtime(filepath)) for filepath in lca.database_filepath))
+        with self.lock:
+            if key not in self.systems:
+                self.systems[key] = FactorizedSystem(lca)
+            return self.systems[key]
+
+    def lca(self, demand, method=None):
+        """Return an ``LCA`` for ``demand`` (and ``method``) that shares a factorized system."""
+        return self.get(demand).lca(demand, method)
+
+    def invalidate(self, name):
+        """Remove the systems that include the database ``name``."""
+        filepath = bw.Database(name).filepath_processed()
+        with self.lock:
+            for key in [key for key in self.systems if filepath in dict(key)]:
+                del self.systems[key]
+
+    def clear(self):
+        with self.lock:
+            self.systems.clear()
+
+
+factorized_systems = FactorizedSystems()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import brightway2 as bw
+from bw2calc.matrices import TechnosphereBiosphereMatrixBuilder as TBMBuilder
+from scipy import stats
+from scipy.sparse.linalg import splu
+
+from .factorization import factorized_systems
+from .montecarlo import PercentileNumberGenerator, SparsePattern, sobol
+
+
+KINDS = ('technosphere', 'biosphere', 'characterization')
+
+
+class SobolGSA(object):
+    """Variance-based global sensitivity analysis of one functional unit and LCIA method.
+
+    Estimates the first-order and total Sobol indices of the uncertain exchanges and
+    characterization factors with the Saltelli design: ``N`` rows of two independent percentile
+    matrices A and B, and for every parameter the matrix AB_i, which is A with the column of
+    that parameter taken from B. The indices follow from the N * (k + 2) scores with the
+    estimators of Saltelli (first order) and Jansen (total).
+
+    The parameters are first screened with the linearized model at the static amounts: the
+    variance contribution of a parameter is approximated by (derivative * spread) ** 2, where the
+    derivatives of all parameters follow from one solve and one adjoint solve. The parameters
+    that explain ``screening`` of the linearized variance are kept, at most ``max_parameters``;
+    all other parameters keep their static amount.
+
+    Only the rows A and B need their own factorization of the technosphere. The scores of the
+    AB_i rows are derived from those of A: biosphere and characterization parameters only change
+    the characterized inventory, and a technosphere parameter changes one matrix entry, which the
+    Sherman-Morrison formula handles with the factorization of A. Rows are evaluated in chunks,
+    which can be spread over a pool of worker processes.
+    """
+    CHUNK_SIZE = 20
+    SAMPLING = ('random', 'sobol')
+
+    def __init__(self, cs_name, func_unit=0, method=None, screening=0.99, max_parameters=50,
+                 parameters=None):
+        try:
+            cs = bw.calculation_setups[cs_name]
+        except KeyError:
+            raise ValueError(
+                "{} is not a known `calculation_setup`.".format(cs_name)
+            )
+        self.cs_name = cs_name
+        self.func_unit = func_unit
+        self.method = tuple(method or cs['ia'][0])
+        self.lca = factorized_systems.lca(cs['inv'][func_unit], self.method)
+        self.params = {
+            'technosphere': self.lca.tech_params,
+            'biosphere': self.lca.bio_params,
+            'characterization': self.lca.cf_params,
+        }
+        self.tech_pattern = SparsePattern(
+            self.lca.tech_params['row'], self.lca.tech_params['col'],
+            self.lca.technosphere_matrix.shape)
+        self.bio_pattern = SparsePattern(
+            self.lca.bio_params['row'], self.lca.bio_params['col'], self.lca.biosphere_matrix.shape)
+        self.n_bio = self.lca.biosphere_matrix.shape[0]
+        if parameters is None:
+            parameters = self.screen(screening, max_parameters)
+        self.parameters = parameters
+        self.generators = {
+            kind: PercentileNumberGenerator(self.params[kind][parameters[kind]]) for kind in KINDS}
+
+    @property
+    def dimensions(self):
+        return sum(len(self.parameters[kind]) for kind in KINDS)
+
+    def spreads(self, params):
+        """Return half the distance between the 16th and 84th percentile of every parameter."""
+        generator = PercentileNumberGenerator(params)
+        percentiles = np.tile(stats.norm.cdf([-1., 1.]), (generator.dimensions, 1))
+        values = generator.values(percentiles)
+        return np.abs(values[:, 1] - values[:, 0]) / 2
+
+    def screen(self, share=0.99, max_parameters=50):
+        """Return the indices of the parameters that explain ``share`` of the linearized
+        variance."""
+        supply = self.lca.solver(self.lca.demand_array)
+        factors = self.lca.characterization_matrix.diagonal()
+        inventory = self.lca.biosphere_matrix * supply
+        adjoint = self.lca.solver(self.lca.biosphere_matrix.T * factors, trans='T')
+        tech, bio, cf = (self.params[kind] for kind in KINDS)
+        derivatives = {
+            'technosphere': adjoint[tech['row']] * supply[tech['col']],
+            'biosphere': factors[bio['row']] * supply[bio['col']],
+            'characterization': inventory[cf['row']],
+        }
+        importance = np.nan_to_num(np.concatenate([
+            (derivatives[kind] * self.spreads(self.params[kind])) ** 2 for kind in KINDS]))
+        kind_of = np.repeat(np.arange(len(KINDS)), [len(self.params[kind]) for kind in KINDS])
+        offsets = np.cumsum([0] + [len(self.params[kind]) for kind in KINDS])
+        order = np.argsort(-importance, kind='stable')
+        order = order[importance[order] > 0]
+        if len(order):
+            explained = np.cumsum(importance[order]) / importance[order].sum()
+            order = order[:min(np.searchsorted(explained, share) + 1, max_parameters)]
+        return {kind: np.sort(order[kind_of[order] == i] - offsets[i]).astype(int)
+                for i, kind in enumerate(KINDS)}
+
+    def values(self, percentiles):
+        """Return the technosphere, biosphere and characterization amounts of every sample.
+
+        ``percentiles`` has one row per screened parameter and one column per sample; the other
+        parameters keep their static amount.
+        """
+        amounts, start = {}, 0
+        for kind in KINDS:
+            indices = self.parameters[kind]
+            amount = np.tile(self.params[kind]['amount'][:, None], (1, percentiles.shape[1]))
+            amount[indices] = self.generators[kind].values(percentiles[start:start + len(indices)])
+            amounts[kind] = amount
+            start += len(indices)
+        return amounts
+
+    def evaluate(self, a, b):
+        """Return the scores of the rows A, B and AB_i of (parameters x samples) percentiles ``a``
+        and ``b``.
+
+        The scores of AB_i are returned as (parameters x samples) array.
+        """
+        values_a, values_b = self.values(a), self.values(b)
+        tech = self.params['technosphere']
+        tech_idx, bio_idx, cf_idx = (self.parameters[kind] for kind in KINDS)
+        rows, cols = tech['row'][tech_idx], tech['col'][tech_idx]
+        unique_rows, row_column = np.unique(rows, return_inverse=True)
+        unit_vectors = np.zeros((self.lca.technosphere_matrix.shape[0], len(unique_rows)))
+        unit_vectors[unique_rows, np.arange(len(unique_rows))] = 1
+        cf_rows = self.params['characterization']['row']
+        bio = self.params['biosphere']
+
+        scores_a, scores_b = np.zeros(a.shape[1]), np.zeros(a.shape[1])
+        scores_ab = np.zeros((self.dimensions, a.shape[1]))
+        for n in range(a.shape[1]):
+            for values, scores in ((values_b, scores_b), (values_a, scores_a)):
+                signed = TBMBuilder.fix_supply_use(tech, values['technosphere'][:, n].copy())
+                lu = splu(self.tech_pattern.matrix(signed).tocsc())
+                biosphere = self.bio_pattern.matrix(values['biosphere'][:, n])
+                factors = np.bincount(cf_rows, weights=values['characterization'][:, n],
+                                      minlength=self.n_bio)
+                supply = lu.solve(self.lca.demand_array)
+                inventory = biosphere * supply
+                scores[n] = factors.dot(inventory)
+            # AB_i rows: changes of the A row (the last factorized) by single parameters of B
+            signed_a = TBMBuilder.fix_supply_use(
+                tech[tech_idx], values_a['technosphere'][tech_idx, n])
+            signed_b = TBMBuilder.fix_supply_use(
+                tech[tech_idx], values_b['technosphere'][tech_idx, n])
+            delta = signed_b - signed_a
+            adjoint = lu.solve(biosphere.T * factors, trans='T')
+            inverse = lu.solve(unit_vectors)[cols, row_column] if len(tech_idx) else np.zeros(0)
+            tech_scores = scores_a[n] - delta * adjoint[rows] * supply[cols] / (1 + delta * inverse)
+            bio_scores = scores_a[n] + (
+                factors[bio['row'][bio_idx]] * supply[bio['col'][bio_idx]] *
+                (values_b['biosphere'][bio_idx, n] - values_a['biosphere'][bio_idx, n]))
+            cf_scores = scores_a[n] + inventory[cf_rows[cf_idx]] * (
+                values_b['characterization'][cf_idx, n] - values_a['characterization'][cf_idx, n])
+            scores_ab[:, n] = np.concatenate([tech_scores, bio_scores, cf_scores])
+        return scores_a, scores_b, scores_ab
+
+    def design(self, samples, seed=None, sampling='sobol'):
+        """Return the percentile matrices A and B as (parameters x samples) arrays."""
+        if sampling not in self.SAMPLING:
+            raise ValueError(
+                "Unknown sampling {}, choose one of {}".format(sampling, self.SAMPLING))
+        rng = np.random.default_rng(seed)
+        if sampling == 'sobol':
+            percentiles = sobol(2 * self.dimensions, samples, rng)
+        else:
+            percentiles = rng.random((2 * self.dimensions, samples))
+        return percentiles[:self.dimensions], percentiles[self.dimensions:]
+
+    def chunks(self, a, b, processes=1, chunk_size=CHUNK_SIZE):
+        """Evaluate the samples in chunks and yield the scores of each chunk, in order."""
+        tasks = [(a[:, start:start + chunk_size], b[:, start:start + chunk_size])
+                 for start in range(0, a.shape[1], chunk_size)]
+        if processes > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(min(processes, len(tasks)), initializer=_init_worker,
+                                      initargs=(bw.projects.current, self.cs_name, self.func_unit,
+                                                self.method, self.parameters)) as pool:
+                for scores in pool.imap(_evaluate_chunk, tasks):
+                    yield scores
+        else:
+            for task in tasks:
+                yield self.evaluate(*task)
+
+    def calculate(self, samples, seed=None, sampling='sobol', processes=1, progress=None):
+        """Return the Sobol indices of the screened parameters as DataFrame, sorted by total index.
+
+        ``progress(done, samples)`` is called after every chunk.
+        """
+        a, b = self.design(samples, seed, sampling)
+        scores_a, scores_b, scores_ab = [], [], []
+        for chunk in self.chunks(a, b, processes):
+            for scores, chunk_scores in zip((scores_a, scores_b, scores_ab), chunk):
+                scores.append(chunk_scores)
+            if progress is not None:
+                progress(sum(len(s) for s in scores_a), samples)
+        first, total = self.sobol_indices(
+            np.concatenate(scores_a), np.concatenate(scores_b), np.hstack(scores_ab))
+        return self.results_frame(first, total)
+
+    @staticmethod
+    def sobol_indices(scores_a, scores_b, scores_ab):
+        """Return the first-order and total indices of every parameter from the scores of A, B and
+        AB_i."""
+        variance = np.var(np.concatenate([scores_a, scores_b]))
+        if not variance:
+            return np.zeros(len(scores_ab)), np.zeros(len(scores_ab))
+        # centering does not change the estimates, but reduces their variance a lot
+        mean = np.mean(np.concatenate([scores_a, scores_b]))
+        scores_a, scores_b, scores_ab = scores_a - mean, scores_b - mean, scores_ab - mean
+        first = np.mean(scores_b * (scores_ab - scores_a), axis=1) / variance
+        total = 0.5 * np.mean((scores_a - scores_ab) ** 2, axis=1) / variance
+        return first, total
+
+    def results_frame(self, first, total):
+        rev_activity, rev_product, rev_biosphere = self.lca.reverse_dict()
+        records = []
+        for kind in KINDS:
+            params = self.params[kind][self.parameters[kind]]
+            for param in params:
+                if kind == 'technosphere':
+                    source, target = rev_product[param['row']], rev_activity[param['col']]
+                elif kind == 'biosphere':
+                    source, target = rev_biosphere[param['row']], rev_activity[param['col']]
+                else:
+                    source, target = rev_biosphere[param['row']], self.method
+                records.append((kind, source, target, param['amount'], param['uncertainty_type']))
+        frame = pd.DataFrame(
+            records, columns=['type', 'input', 'output', 'amount', 'uncertainty type'])
+        frame['first order'] = first
+        frame['total'] = total
+        return frame.sort_values('total', ascending=False).reset_index(drop=True)
+
+
+_worker_gsa = None
+
+
+def _init_worker(project, cs_name, func_unit, method, parameters):
+    """Build the sparsity patterns of the screened model once per worker process."""
+    global _worker_gsa
+    if bw.projects.current != project:
+        bw.projects.set_current(project)
+    _worker_gsa = SobolGSA(cs_name, func_unit, method, parameters=parameters)
+
+
+def _evaluate_chunk(task):
+    return _worker_gsa.evaluate(*task)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from bw2data.backends.peewee import ActivityDataset
+
+
+MAX_VARIABLES = 900  # stays below the limit of variables of an SQLite query
+
+
+def get_activities_data(keys):
+    """Return the data dictionaries of many activities, with one query per database.
+
+    A few activities of a database are selected by their codes, many are picked from all
+    activities of the database.
+    """
+    keys = set(keys)
+    data = {}
+    for database in {key[0] for key in keys}:
+        codes = [key[1] for key in keys if key[0] == database]
+        query = ActivityDataset.select(ActivityDataset.code, ActivityDataset.data).where(
+            ActivityDataset.database == database)
+        if len(codes) <= MAX_VARIABLES:
+            query = query.where(ActivityDataset.code.in_(codes))
+        for code, activity_data in query.tuples():
+            if (database, code) in keys:
+                data[(database, code)] = activity_data
+    return data
+
+
+def database_snapshot(name, kind='process'):
+    """Return the keys, names, reference products and locations of the activities of type
+    ``kind`` in a database as columns, ordered by name.
+
+    The columns are read from the activity table itself, so the data dictionaries of the
+    activities are not unpickled; units are only stored in the data and can be added with
+    ``activity_metadata``.
+    """
+    query = ActivityDataset.select(
+        ActivityDataset.code, ActivityDataset.name, ActivityDataset.product,
+        ActivityDataset.location).where(
+        (ActivityDataset.database == name) & (ActivityDataset.type == kind)).order_by(
+        ActivityDataset.name)
+    codes, names, products, locations = list(zip(*query.tuples())) or ((), (), (), ())
+    return {
+        'key': [(name, code) for code in codes],
+        'name': list(names),
+        'reference product': list(products),
+        'location': list(locations),
+    }
+
+
+class ActivityMetadata(object):
+    """Project-level cache of the name, location, unit and reference product of activities.
+
+    ``load`` fetches all activities that are not cached yet with ``get_activities_data``, so
+    that code showing many activities, like the tooltips and colours of the Sankey diagram,
+    needs one query per database instead of one per activity. The activities of a changed
+    database are removed with ``invalidate``; ``clear`` removes all of them, e.g. when another
+    project is selected.
+    """
+    FIELDS = ('name', 'location', 'unit', 'reference product')
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def load(self, keys):
+        keys = {tuple(key) for key in keys}
+        with self.lock:
+            missing = keys.difference(self.data)
+        if not missing:
+            return
+        found = get_activities_data(missing)
+        with self.lock:
+            for key in missing:
+                activity_data = found.get(key, {})
+                self.data[key] = {field: activity_data[field] for field in self.FIELDS
+                                  if field in activity_data}
+
+    def get(self, key):
+        """Return the cached fields of activity ``key``, loading it if needed."""
+        key = tuple(key)
+        if key not in self.data:
+            self.load([key])
+        return self.data[key]
+
+    def invalidate(self, name):
+        """Remove the activities of the database ``name``."""
+        with self.lock:
+            for key in [key for key in self.data if key[0] == name]:
+                del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+activity_metadata = ActivityMetadata()
+
+
+def isic_classification(data):
+    """Return the ISIC class of an activity, e.g. '3510:Electric power generation, ...'."""
+    for system, value in data.get('classifications', []):
+        if system.startswith('ISIC'):
+            return value
+    return 'unclassified'
+
+
+GROUP_LABELS = {
+    'location': lambda key, data: data.get('location') or 'unknown',
+    'product': lambda key, data: data.get('reference product') or data.get('name', 'unknown'),
+    'database': lambda key, data: key[0],
+    'ISIC': lambda key, data: isic_classification(data),
+}
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import warnings
+
+import numpy as np
+import brightway2 as bw
+from bw2calc.matrices import TechnosphereBiosphereMatrixBuilder as TBMBuilder
+from scipy import sparse, stats
+from scipy.sparse.linalg import splu
+from stats_arrays import uncertainty_choices
+from stats_arrays.random import MCRandomNumberGenerator
+
+
+SOBOL_MAX_DIMENSIONS = 21201  # of scipy.stats.qmc.Sobol
+
+
+class SparsePattern(object):
+    """The fixed sparsity pattern of a matrix that is built from a parameter array.
+
+    The row and column indices are sorted once; ``matrix`` only sums the sampled values of
+    duplicate entries into the data of a new CSR matrix with the same structure.
+    """
+    def __init__(self, rows, cols, shape):
+        linear = rows.astype(np.int64) * shape[1] + cols
+        unique, self.inverse = np.unique(linear, return_inverse=True)
+        self.shape = shape
+        self.indices = (unique % shape[1]).astype(np.int32)
+        self.indptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(unique // shape[1], minlength=shape[0])))).astype(np.int32)
+
+    def matrix(self, values):
+        data = np.bincount(self.inverse, weights=values, minlength=len(self.indices))
+        return sparse.csr_matrix((data, self.indices, self.indptr), shape=self.shape)
+
+
+def import_qmc():
+    """Return ``scipy.stats.qmc``, which is only imported when Sobol sampling is used."""
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError("Sobol sampling requires scipy.stats.qmc, which was added in scipy 1.7. "
+                          "Update scipy or choose another sampling.")
+    return qmc
+
+
+def sobol(dimensions, samples, rng, start=0):
+    """Return points ``start`` to ``start + samples`` of a scrambled Sobol sequence as
+    (dimensions x samples) array.
+
+    The scrambling is drawn from ``rng``, so the same ``rng`` state gives the same sequence. Its
+    balance properties hold for blocks of a power of 2 points that start at a multiple of the
+    block size.
+    """
+    qmc = import_qmc()
+    if not dimensions:
+        return np.zeros((0, samples))
+    if dimensions > SOBOL_MAX_DIMENSIONS:
+        raise ValueError("Sobol sampling supports at most {} dimensions, got {}".format(
+            SOBOL_MAX_DIMENSIONS, dimensions))
+    engine = qmc.Sobol(dimensions, scramble=True, seed=rng)
+    if start:
+        engine.fast_forward(start)
+    return engine.random(samples).T
+
+
+class LatinHypercubeBlock(object):
+    """Consecutive points of a latin hypercube design of ``samples`` points in [0, 1).
+
+    ``strata`` holds the (dimensions x points) strata of the points in the block; the strata of
+    every dimension are permuted once for the whole design, so all blocks together have exactly
+    one point in each stratum of every dimension. ``percentiles`` places the points randomly
+    within their strata.
+    """
+    def __init__(self, strata, samples):
+        self.strata = strata
+        self.samples = samples
+
+    def percentiles(self, rng):
+        return (self.strata + rng.random(self.strata.shape)) / self.samples
+
+
+class SobolBlock(object):
+    """Points ``start`` to ``start + samples`` of the scrambled Sobol sequence that is drawn
+    from ``seed``."""
+    def __init__(self, dimensions, start, samples, seed):
+        self.dimensions = dimensions
+        self.start = start
+        self.samples = samples
+        self.seed = seed
+
+    def percentiles(self, rng):
+        return sobol(self.dimensions, self.samples, np.random.default_rng(self.seed), self.start)
+
+
+class PercentileNumberGenerator(object):
+    """Turn percentiles (e.g. of a Latin hypercube or Sobol design) into values of a parameter
+    array.
+
+    Only the parameters with an uncertainty distribution take a dimension of the design; the others
+    always return their ``loc``. Parameters with a ``minimum`` or ``maximum`` are sampled from the
+    truncated distribution.
+    """
+    def __init__(self, params):
+        self.params = params
+        self.uncertain = np.where(params['uncertainty_type'] > 1)[0]
+        self.groups = []
+        lower, upper = np.zeros(len(params)), np.ones(len(params))
+        for uncertainty_type in np.unique(params['uncertainty_type']):
+            distribution = uncertainty_choices[uncertainty_type]
+            rows = np.where(params['uncertainty_type'] == uncertainty_type)[0]
+            self.groups.append((distribution, rows))
+            for bounds, field in ((lower, 'minimum'), (upper, 'maximum')):
+                bounded = rows[np.isfinite(params[field][rows])]
+                if uncertainty_type > 1 and len(bounded):
+                    try:
+                        bounds[bounded] = distribution.cdf(
+                            params[bounded], params[field][bounded].reshape(-1, 1)).ravel()
+                    except NotImplementedError:
+                        pass
+        self.lower, self.upper = lower, upper
+
+    @property
+    def dimensions(self):
+        return len(self.uncertain)
+
+    def values(self, percentiles):
+        """Return (parameters x samples) values for (dimensions x samples) ``percentiles``."""
+        full = np.full((len(self.params), percentiles.shape[1]), 0.5)
+        full[self.uncertain] = percentiles
+        full = self.lower[:, None] + full * (self.upper - self.lower)[:, None]
+        values = np.zeros(full.shape)
+        for distribution, rows in self.groups:
+            values[rows] = distribution.ppf(self.params[rows], full[rows])
+        return values
+
+
+class RunningStatistics(object):
+    """Running mean, variance, minimum and maximum of samples of a fixed shape.
+
+    Samples are added in batches with ``update``; batches are combined with the parallel
+    variant of Welford's algorithm, so no samples need to be kept.
+    """
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+
+    def update(self, samples):
+        """Add a batch of samples with shape (samples, *shape)."""
+        n = samples.shape[0]
+        if not n:
+            return
+        mean = samples.mean(axis=0)
+        m2 = ((samples - mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.minimum = np.minimum(self.minimum, samples.min(axis=0))
+        self.maximum = np.maximum(self.maximum, samples.max(axis=0))
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.full(self.m2.shape, np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def standard_error(self):
+        return self.std / np.sqrt(self.count) if self.count else self.std
+
+    def confidence_interval(self, confidence=0.95):
+        """Return the half-width of the (normal approximation) confidence interval of the means."""
+        return stats.norm.ppf(0.5 + confidence / 2) * self.standard_error
+
+    def converged(self, tolerance, confidence=0.95):
+        """Whether the confidence interval of every mean is within ``tolerance`` times that mean."""
+        if self.count < 2:
+            return False
+        return bool(np.all(
+            self.confidence_interval(confidence) <= tolerance * np.abs(self.mean)))
+
+    def copy(self):
+        other = RunningStatistics(self.mean.shape)
+        other.count = self.count
+        other.mean, other.m2 = self.mean.copy(), self.m2.copy()
+        other.minimum, other.maximum = self.minimum.copy(), self.maximum.copy()
+        return other
+
+
+class MonteCarloMLCA(object):
+    """Monte Carlo uncertainty analysis of all functional units and LCIA methods of a calculation
+    setup.
+
+    Every iteration samples the technosphere, biosphere and characterization factors once
+    and returns the (functional units x methods) scores, solved for all functional units at
+    once. The sparsity patterns of the matrices are built once and reused in every iteration.
+
+    Iterations are calculated in chunks. Each chunk has its own random number generators,
+    seeded from a ``numpy.random.SeedSequence`` spawned from ``seed``, so the samples are
+    independent between chunks and the same whether the chunks are calculated in this
+    process or in a pool of worker processes.
+
+    ``sampling`` is one of ``SAMPLING``. With 'latin hypercube' or 'sobol' one design over all
+    uncertain parameters is drawn for the whole analysis, and every chunk takes the next block of
+    its points (see ``designs``). The parameter values are taken from the points with the percent
+    point functions of their distributions. Sobol sequences support at most
+    ``SOBOL_MAX_DIMENSIONS`` uncertain parameters; with more, latin hypercube sampling is used
+    instead and ``notice`` says so. With a ``tolerance``, ``calculate`` stops once the
+    confidence interval of every mean is within that fraction of the mean.
+    """
+    CHUNK_SIZE = 64  # a power of 2, for the balance of Sobol sequences
+    SAMPLING = ('random', 'latin hypercube', 'sobol')
+    notice = None
+
+    def __init__(self, cs_name, sampling='random'):
+        if sampling not in self.SAMPLING:
+            raise ValueError(
+                "Unknown sampling {}, choose one of {}".format(sampling, self.SAMPLING))
+        if sampling == 'sobol':
+            import_qmc()
+        self.sampling = sampling
+        try:
+            cs = bw.calculation_setups[cs_name]
+        except KeyError:
+            raise ValueError(
+                "{} is not a known `calculation_setup`.".format(cs_name)
+            )
+        self.cs_name = cs_name
+        self.func_units = cs['inv']
+        self.methods = cs['ia']
+        self.lca = bw.LCA(demand={key: 1 for fu in self.func_units for key in fu})
+        self.lca.load_lci_data()
+        self.tech_params, self.bio_params = self.lca.tech_params, self.lca.bio_params
+        self.tech_pattern = SparsePattern(
+            self.tech_params['row'], self.tech_params['col'], self.lca.technosphere_matrix.shape)
+        self.bio_pattern = SparsePattern(
+            self.bio_params['row'], self.bio_params['col'], self.lca.biosphere_matrix.shape)
+        self.cf_params = []
+        for method in self.methods:
+            self.lca.switch_method(method)
+            self.cf_params.append(self.lca.cf_params)
+        self.params = [self.tech_params, self.bio_params] + self.cf_params
+        self.generators = None
+        if sampling != 'random':
+            self.generators = [PercentileNumberGenerator(p) for p in self.params]
+        if sampling == 'sobol' and self.dimensions > SOBOL_MAX_DIMENSIONS:
+            self.notice = (
+                "Sobol sampling supports at most {} uncertain parameters, this calculation setup "
+                "has {}. Latin hypercube sampling is used instead.".format(
+                    SOBOL_MAX_DIMENSIONS, self.dimensions))
+            warnings.warn(self.notice)
+            self.sampling = 'latin hypercube'
+        self.demand = np.zeros((len(self.lca.product_dict), len(self.func_units)))
+        for col, func_unit in enumerate(self.func_units):
+            for key, amount in func_unit.items():
+                self.demand[self.lca.product_dict[key], col] = amount
+
+    @property
+    def shape(self):
+        return len(self.func_units), len(self.methods)
+
+    @property
+    def dimensions(self):
+        """The number of uncertain parameters, i.e. the dimensions of a latin hypercube or Sobol
+        design."""
+        if self.generators is None:
+            return sum(int(np.sum(p['uncertainty_type'] > 1)) for p in self.params)
+        return sum(g.dimensions for g in self.generators)
+
+    def designs(self, sizes, seed_sequence):
+        """Return the blocks of one latin hypercube or Sobol design for chunks of ``sizes``
+        iterations, or None for every chunk with random sampling.
+
+        The strata of the latin hypercube design take (dimensions x iterations) 32-bit
+        integers. The points of the Sobol sequence are only generated for the chunks; its balance
+        properties hold for every chunk but a shorter last one, and for every number of
+        iterations that is a power of 2.
+        """
+        if self.sampling == 'random':
+            return [None] * len(sizes)
+        starts = [sum(sizes[:i]) for i in range(len(sizes))]
+        iterations = sum(sizes)
+        if self.sampling == 'sobol':
+            # entropy instead of the SeedSequence, which the scrambling would spawn from
+            seed = seed_sequence.generate_state(4)
+            return [SobolBlock(self.dimensions, start, size, seed)
+                    for start, size in zip(starts, sizes)]
+        rng = np.random.default_rng(seed_sequence)
+        strata = np.argsort(rng.random((self.dimensions, iterations)), axis=1).astype(np.int32)
+        return [LatinHypercubeBlock(strata[:, start:start + size], iterations)
+                for start, size in zip(starts, sizes)]
+
+    def parameter_samples(self, iterations, seed_sequence, design=None):
+        """Yield the sampled values of the technosphere, biosphere and every method's CFs per
+        iteration.
+
+        With latin hypercube or Sobol sampling, ``design`` is the block of the design for these
+        iterations.
+        """
+        if self.sampling == 'random':
+            seeds = seed_sequence.generate_state(len(self.params))
+            rngs = [MCRandomNumberGenerator(p, seed=int(s)) for p, s in zip(self.params, seeds)]
+            for _ in range(iterations):
+                yield [rng.next() for rng in rngs]
+            return
+        percentiles = design.percentiles(np.random.default_rng(seed_sequence))
+        offsets = np.cumsum([0] + [g.dimensions for g in self.generators])
+        values = [g.values(percentiles[start:stop])
+                  for g, start, stop in zip(self.generators, offsets[:-1], offsets[1:])]
+        for i in range(iterations):
+            yield [v[:, i] for v in values]
+
+    def sample(self, iterations, seed_sequence, design=None):
+        """Return the scores of ``iterations`` iterations as (iterations x functional units x
+        methods) array."""
+        n_bio = self.lca.biosphere_matrix.shape[0]
+        results = np.zeros((iterations,) + self.shape)
+        samples = self.parameter_samples(iterations, seed_sequence, design)
+        for i, (tech_values, bio_values, *cf_values) in enumerate(samples):
+            technosphere = self.tech_pattern.matrix(
+                TBMBuilder.fix_supply_use(self.tech_params, tech_values.copy()))
+            biosphere = self.bio_pattern.matrix(bio_values)
+            characterization = np.vstack([
+                np.bincount(params['row'], weights=values, minlength=n_bio)
+                for params, values in zip(self.cf_params, cf_values)
+            ])
+            supply = splu(technosphere.tocsc()).solve(self.demand)
+            results[i] = (characterization @ (biosphere * supply)).T
+        return results
+
+    def chunks(self, iterations, seed=None, processes=1, chunk_size=CHUNK_SIZE):
+        """Calculate ``iterations`` iterations and yield the samples of each chunk, in order."""
+        sizes = [min(chunk_size, iterations - start) for start in range(0, iterations, chunk_size)]
+        seed_sequence = np.random.SeedSequence(seed)
+        chunk_seeds = seed_sequence.spawn(len(sizes))
+        tasks = list(zip(sizes, chunk_seeds, self.designs(sizes, seed_sequence.spawn(1)[0])))
+        if processes > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(min(processes, len(tasks)), initializer=_init_worker,
+                                      initargs=(bw.projects.current, self.cs_name,
+                                                self.sampling)) as pool:
+                for samples in pool.imap(_sample_chunk, tasks):
+                    yield samples
+        else:
+            for task in tasks:
+                yield self.sample(*task)
+
+    def calculate(self, iterations, seed=None, processes=1, chunk_size=CHUNK_SIZE,
+                  tolerance=None, confidence=0.95):
+        """Return the ``RunningStatistics`` of at most ``iterations`` iterations.
+
+        With a ``tolerance`` the calculation stops after the first chunk at which the statistics
+        have converged.
+        """
+        statistics = RunningStatistics(self.shape)
+        chunks = self.chunks(iterations, seed, processes, chunk_size)
+        for samples in chunks:
+            statistics.update(samples)
+            if tolerance and statistics.converged(tolerance, confidence):
+                chunks.close()
+                break
+        return statistics
+
+
+_worker_mc = None
+
+
+def _init_worker(project, cs_name, sampling):
+    """Build the sparsity patterns of a calculation setup once per worker process."""
+    global _worker_mc
+    if bw.projects.current != project:
+        bw.projects.set_current(project)
+    _worker_mc = MonteCarloMLCA(cs_name, sampling)
+
+
+def _sample_chunk(task):
+    return _worker_mc.sample(*task)
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
+import collections
+import copy
+import multiprocessing
+import os
+import tempfile
+
 import numpy as np
 import brightway2 as bw
-from bw2analyzer import ContributionAnalysis
+from scipy import sparse
 
-ca = ContributionAnalysis()
+from .contributions import ContributionStore, broadcast_multiply, membership_matrix
+from .factorization import factorized_systems
+from .metadata import GROUP_LABELS, get_activities_data
 
 
 class MLCA(object):
@@ -17,90 +25,439 @@ class MLCA(object):
 
     Class adapted from bw2calc.multi_lca.MultiLCA to include also CONTRIBUTION ANALYSIS.
 
+    Process and elementary flow contributions are kept in a sparse ``ContributionStore``.
+    By default all contributions of at least ``contribution_cutoff`` times the summed (absolute)
+    contributions of a functional unit are kept; ``contribution_limit`` additionally keeps only the
+    largest contributions per functional unit and method. Pass ``contribution_cutoff=None``
+    to keep all non-zero contributions.
+
+    The matrices and the factorized technosphere are taken from the project-level
+    ``factorized_systems``, so they are shared with other calculations on the same databases
+    and only built again after a database changed. The demand vectors of ``batch_size`` functional
+    units are combined into one demand matrix and solved in a single operation, which yields
+    `self.supply_arrays` (technosphere x functional units). ``batch_size=1`` solves one
+    functional unit at a time.
+
+    The characterization factors of all methods are stacked into `self.characterization_matrix`
+    (methods x biosphere), so that the scores of all functional units and methods follow from
+    one sparse matrix product with the inventories. Contributions are computed from the
+    characterized biosphere matrix and the supply arrays directly; no characterized inventory
+    matrix is built.
+
+    With ``processes > 1`` the functional units are split into shards of whole batches, which
+    are calculated in a pool of worker processes. Every worker builds and factorizes the
+    technosphere once. Because each batch is solved and characterized exactly as in a serial
+    calculation with the same ``batch_size``, the merged results are bit-identical to it.
+
+    An optional ``progress`` callable is called as ``progress(done, total)`` with the number of
+    calculated (functional unit, method) combinations. Exceptions raised by it abort the
+    calculation.
+
+    ``update`` brings the results up to date after functional units or methods were added to,
+    removed from or reordered in the calculation setup. Only new functional units are solved
+    and only new methods characterize the stored inventories; the rest is sliced.
+
+    Process contributions can be aggregated by any of the ``GROUPINGS`` (location, product,
+    database or ISIC sector). The sparse membership matrix of a grouping, which maps technosphere
+    indices to groups, is built once; every aggregation is then one sparse matrix product.
+
+    Contributions are stored as ``contribution_dtype`` (float64 or float32). With a
+    ``contribution_directory`` they are written to memory-mapped files in that directory instead
+    of being kept in memory (see ``ContributionStore``); ``storage_directory`` returns the
+    directory of each of the ``STORAGE`` options.
+
+    With ``lazy=True`` only the scores are calculated up front. The contributions of a method
+    are computed from the kept supply arrays and inventories the first time they are needed, e.g.
+    by ``top_process_contributions``, and kept in a least recently used cache. Once the
+    contributions of the cached methods take more than ``contribution_memory`` bytes, the least
+    recently used methods are cleared again; the method that was asked for last is always kept.
+
     """
-    def __init__(self, cs_name):
+    BATCH_SIZE = 100
+    GROUPINGS = tuple(GROUP_LABELS)
+    PRECISIONS = ('float64', 'float32')
+    STORAGE = ('memory', 'temporary directory', 'project directory')
+    CONTRIBUTION_DIRECTORY = 'AB_contributions'
+    progress = None
+    group_matrices = None
+    contribution_dtype = np.dtype(np.float64)
+    contribution_directory = None
+    lazy = False
+    contribution_memory = None
+    computed_methods = None
+    processes = 1
+
+    def __init__(self, cs_name, batch_size=BATCH_SIZE, contribution_limit=None,
+                 contribution_cutoff=1e-4, processes=1, progress=None,
+                 contribution_dtype=np.float64, contribution_directory=None,
+                 lazy=False, contribution_memory=None):
+        self.progress = progress
+        self.contribution_dtype = np.dtype(contribution_dtype)
+        self.contribution_directory = contribution_directory
+        self.lazy = lazy
+        self.contribution_memory = contribution_memory
+        self.processes = processes
+        self.setup(cs_name, batch_size, contribution_limit, contribution_cutoff)
+        if processes > 1:
+            self.calculate_parallel(processes)
+        else:
+            self.calculate()
+
+    def setup(self, cs_name, batch_size=BATCH_SIZE, contribution_limit=None,
+              contribution_cutoff=1e-4):
+        """Load the calculation setup, build the matrices and stack the characterization factors."""
         try:
             cs = bw.calculation_setups[cs_name]
         except KeyError:
             raise ValueError(
                 "{} is not a known `calculation_setup`.".format(cs_name)
             )
+        self.cs_name = cs_name
         self.func_units = cs['inv']
         self.methods = cs['ia']
         self.method_dict = {m: i for i, m in enumerate(self.methods)}
-        self.lca = bw.LCA(demand=self.all, method=self.methods[0])
-        self.lca.lci(factorize=True)
-        self.method_matrices = []
-        self.results = np.zeros((len(self.func_units), len(self.methods)))
-
-        # contribution matrices
-        self.process_contributions = np.zeros(
-            (len(self.func_units), len(self.methods), self.lca.technosphere_matrix.shape[0]))
-        self.elementary_flow_contributions = np.zeros(
-            (len(self.func_units), len(self.methods), self.lca.biosphere_matrix.shape[0]))
+        self.batch_size = batch_size
+        self.contribution_limit = contribution_limit
+        self.contribution_cutoff = contribution_cutoff
+        self.computed_methods = collections.OrderedDict()
+        self.group_matrices = None
+        self.system = factorized_systems.get(self.all)
+        self.lca = self.system.lca(self.all)
         (self.rev_activity_dict, self.rev_product_dict,
          self.rev_biosphere_dict) = self.lca.reverse_dict()
 
-        for method in self.methods:
+        self.method_matrices, self.characterization_matrix = self.load_methods(self.methods)
+        self.characterized_biosphere = (
+            self.characterization_matrix * self.lca.biosphere_matrix).tocsr()
+
+    def load_methods(self, methods):
+        """Return the characterization matrices of `methods` and their factors stacked as
+        (methods x biosphere)."""
+        matrices = []
+        for method in methods:
             self.lca.switch_method(method)
-            self.method_matrices.append(self.lca.characterization_matrix)
-
-        for row, func_unit in enumerate(self.func_units):
-            self.lca.redo_lci(func_unit)
-            for col, cf_matrix in enumerate(self.method_matrices):
-                self.lca.characterization_matrix = cf_matrix
-                self.lca.lcia_calculation()
-                self.results[row, col] = self.lca.score
-                self.process_contributions[row, col] = self.lca.characterized_inventory.sum(axis=0)
-                self.elementary_flow_contributions[row, col] = np.array(
-                    self.lca.characterized_inventory.sum(axis=1)).ravel()
+            matrices.append(self.lca.characterization_matrix)
+        stacked = sparse.vstack(
+            [sparse.csr_matrix(cf_matrix.diagonal()) for cf_matrix in matrices], format='csr'
+        ) if matrices else sparse.csr_matrix((0, self.lca.biosphere_matrix.shape[0]))
+        return matrices, stacked
+
+    @classmethod
+    def storage_directory(cls, storage):
+        """Return the contribution directory of a ``STORAGE`` option; None keeps contributions in
+        memory."""
+        if storage == 'temporary directory':
+            return tempfile.gettempdir()
+        if storage == 'project directory':
+            return os.path.join(bw.projects.dir, cls.CONTRIBUTION_DIRECTORY)
+        return None
+
+    def contribution_stores(self):
+        """Return new (empty) process and elementary flow contribution stores."""
+        return tuple(
+            ContributionStore(len(self.methods), size, limit=self.contribution_limit,
+                              cutoff=self.contribution_cutoff, dtype=self.contribution_dtype,
+                              directory=self.contribution_directory)
+            for size in (self.lca.technosphere_matrix.shape[0], self.lca.biosphere_matrix.shape[0])
+        )
+
+    def calculate(self):
+        """Calculate scores and contributions of all functional units in this process."""
+        self.merge([self.calculate_shard(0, len(self.func_units))])
+
+    def calculate_parallel(self, processes):
+        """Calculate shards of functional units in a pool of ``processes`` worker processes."""
+        batches = list(range(0, len(self.func_units), self.batch_size))
+        shards = [
+            (batches[b[0]], min(batches[b[-1]] + self.batch_size, len(self.func_units)))
+            for b in np.array_split(np.arange(len(batches)), processes) if len(b)
+        ]
+        initargs = (bw.projects.current, self.cs_name, self.batch_size,
+                    self.contribution_limit, self.contribution_cutoff, self.lazy)
+        results = []
+        with multiprocessing.Pool(min(processes, len(shards)), initializer=_init_worker,
+                                  initargs=initargs) as pool:
+            for shard, result in zip(shards, pool.imap(_calculate_shard, shards)):
+                results.append(result)
+                self.report_progress(shard[1] * len(self.methods))
+        self.merge(results)
+
+    def report_progress(self, done):
+        if self.progress is not None:
+            self.progress(done, len(self.func_units) * len(self.methods))
+
+    def calculate_shard(self, start, stop):
+        """Solve and characterize the functional units ``start:stop`` batch by batch.
+
+        Returns the supply arrays, inventories, scores, and the process and elementary flow
+        contribution stores of the shard. The stores remain empty if the MLCA is ``lazy``.
+        """
+        func_units = self.func_units[start:stop]
+        supply = np.zeros((len(self.lca.activity_dict), len(func_units)))
+        inventories = np.zeros((len(self.lca.biosphere_dict), len(func_units)))
+        scores = np.zeros((len(func_units), len(self.methods)))
+        process_contributions, elementary_flow_contributions = self.contribution_stores()
+        for offset in range(0, len(func_units), self.batch_size):
+            batch = slice(offset, offset + self.batch_size)
+            supply[:, batch] = self.solve_func_units(func_units[batch])
+            inventories[:, batch] = self.lca.biosphere_matrix * supply[:, batch]
+            scores[batch] = (self.characterized_biosphere * supply[:, batch]).T
+            if self.lazy:
+                self.report_progress((start + offset + len(func_units[batch])) * len(self.methods))
+                continue
+            for col in range(len(self.methods)):
+                process_contributions.append(col, broadcast_multiply(
+                    self.characterized_biosphere[col], supply[:, batch].T))
+                elementary_flow_contributions.append(col, broadcast_multiply(
+                    self.characterization_matrix[col], inventories[:, batch].T))
+                self.report_progress(
+                    (start + offset) * len(self.methods) +
+                    (col + 1) * len(func_units[batch]))
+        return supply, inventories, scores, process_contributions, elementary_flow_contributions
+
+    def merge(self, shards):
+        """Combine the calculated shards, in order, into the results of this MLCA."""
+        supply, inventories, scores, process_stores, ef_stores = zip(*shards)
+        self.supply_arrays = np.hstack(supply)
+        self.inventories = np.hstack(inventories)
+        self.results = np.vstack(scores)
+        if len(shards) == 1 and self.has_storage(process_stores[0]):
+            # the stores of a shard calculated in this process can be taken over as they are
+            self.process_contributions = process_stores[0]
+            self.elementary_flow_contributions = ef_stores[0]
+            return
+        self.process_contributions, self.elementary_flow_contributions = self.contribution_stores()
+        for process_store, ef_store in zip(process_stores, ef_stores):
+            self.process_contributions.extend(process_store)
+            self.elementary_flow_contributions.extend(ef_store)
+
+    def has_storage(self, store):
+        """Whether a contribution store has the dtype and directory of this MLCA."""
+        return (store.dtype == self.contribution_dtype and
+                store.directory == self.contribution_directory)
+
+    def update(self):
+        """Update the results to the current functional units and methods of the calculation setup.
+
+        Everything is calculated again if the databases changed since the last calculation, or if
+        no supply arrays are available (e.g. for results loaded from the result cache).
+        """
+        cs = bw.calculation_setups[self.cs_name]
+        demand = {key: 1 for func_unit in cs['inv'] for key in func_unit}
+        if (getattr(self, 'supply_arrays', None) is None or
+                factorized_systems.get(demand) is not self.system):
+            self.setup(self.cs_name, self.batch_size, self.contribution_limit,
+                       self.contribution_cutoff)
+            if self.processes > 1:
+                self.calculate_parallel(self.processes)
+            else:
+                self.calculate()
+            return self
+
+        self.lca = self.system.lca(demand)
+        if self.lazy:
+            # contributions are computed again for the methods that are asked for
+            self.computed_methods = collections.OrderedDict()
+            (self.process_contributions,
+             self.elementary_flow_contributions) = self.contribution_stores()
+        kept_func_units = self.match(self.func_units, cs['inv'])
+        kept_methods = self.match(self.methods, cs['ia'])
+        old_func_units = np.array([i for i in kept_func_units if i is not None], dtype=int)
+        old_methods = np.array([i for i in kept_methods if i is not None], dtype=int)
+        new_methods = [m for m, i in zip(cs['ia'], kept_methods) if i is None]
+
+        # Slice the functional units and methods that are kept
+        supply = self.supply_arrays[:, old_func_units]
+        inventories = self.inventories[:, old_func_units]
+        scores = self.results[np.ix_(old_func_units, old_methods)]
+        process_contributions = self.process_contributions.take(old_func_units, old_methods)
+        elementary_flow_contributions = self.elementary_flow_contributions.take(
+            old_func_units, old_methods)
+
+        # Characterize the stored inventories with the new methods
+        new_matrices, new_factors = self.load_methods(new_methods)
+        self.methods = [self.methods[i] for i in old_methods] + new_methods
+        self.method_matrices = [self.method_matrices[i] for i in old_methods] + new_matrices
+        self.characterization_matrix = sparse.vstack(
+            [self.characterization_matrix[old_methods], new_factors], format='csr')
+        self.characterized_biosphere = (
+            self.characterization_matrix * self.lca.biosphere_matrix).tocsr()
+        new_columns = list(range(len(old_methods), len(self.methods)))
+        scores = np.hstack([scores, (self.characterized_biosphere[new_columns] * supply).T])
+        process_contributions.add_methods(len(new_methods))
+        elementary_flow_contributions.add_methods(len(new_methods))
+        if not self.lazy:
+            for col in new_columns:
+                process_contributions.append(col, broadcast_multiply(
+                    self.characterized_biosphere[col], supply.T))
+                elementary_flow_contributions.append(col, broadcast_multiply(
+                    self.characterization_matrix[col], inventories.T))
+
+        # Solve the new functional units for all methods
+        self.func_units = [self.func_units[i] for i in old_func_units] + [
+            fu for fu, i in zip(cs['inv'], kept_func_units) if i is None]
+        self.merge([
+            (supply, inventories, scores, process_contributions, elementary_flow_contributions),
+            self.calculate_shard(len(old_func_units), len(self.func_units)),
+        ])
+
+        # Restore the order of the calculation setup
+        fu_order = np.array(self.match(self.func_units, cs['inv']), dtype=int)
+        method_order = np.array(self.match(self.methods, cs['ia']), dtype=int)
+        self.supply_arrays = self.supply_arrays[:, fu_order]
+        self.inventories = self.inventories[:, fu_order]
+        self.results = self.results[np.ix_(fu_order, method_order)]
+        self.process_contributions = self.process_contributions.take(fu_order, method_order)
+        self.elementary_flow_contributions = self.elementary_flow_contributions.take(
+            fu_order, method_order)
+        self.method_matrices = [self.method_matrices[i] for i in method_order]
+        self.characterization_matrix = self.characterization_matrix[method_order]
+        self.characterized_biosphere = self.characterized_biosphere[method_order]
+        self.func_units, self.methods = cs['inv'], cs['ia']
+        self.method_dict = {m: i for i, m in enumerate(self.methods)}
+        return self
+
+    def copy(self):
+        """Return a copy that can be updated while this MLCA is still in use.
+
+        The factorized system and the result arrays are shared, as they are only ever replaced;
+        the contribution stores and the caches are copied.
+        """
+        mlca = copy.copy(self)
+        mlca.process_contributions = self.process_contributions.copy()
+        mlca.elementary_flow_contributions = self.elementary_flow_contributions.copy()
+        if self.group_matrices is not None:
+            mlca.group_matrices = dict(self.group_matrices)
+        if self.computed_methods is not None:
+            mlca.computed_methods = self.computed_methods.copy()
+        return mlca
+
+    @staticmethod
+    def match(old, new):
+        """Return for each item of `new` the index of an equal item in `old`, or None."""
+        unused = list(range(len(old)))
+        indices = []
+        for item in new:
+            index = next((i for i in unused if old[i] == item), None)
+            if index is not None:
+                unused.remove(index)
+            indices.append(index)
+        return indices
 
     @property
     def all(self):
         """Get all possible databases by merging all functional units"""
         return {key: 1 for func_unit in self.func_units for key in func_unit}
 
+    def demand_matrix(self, func_units):
+        """Build a (products x functional units) matrix with the demand vector of every
+        functional unit."""
+        demand = np.zeros((len(self.lca.product_dict), len(func_units)))
+        for col, func_unit in enumerate(func_units):
+            for key, amount in func_unit.items():
+                demand[self.lca.product_dict[key], col] = amount
+        return demand
+
+    def solve_func_units(self, func_units):
+        """Solve the demand of all `func_units` against the factorized technosphere, in batches."""
+        supply = np.zeros((len(self.lca.activity_dict), len(func_units)))
+        for start in range(0, len(func_units), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            supply[:, batch] = self.lca.solver(self.demand_matrix(func_units[batch]))
+        return supply
+
     @property
     def results_normalized(self):
         return self.results / self.results.max(axis=0)
 
     # CONTRIBUTION ANALYSIS
+    def contribution_method(self, method_name=None):
+        """Return the index of a method (by default the first), computing its contributions if
+        needed."""
+        method = self.method_dict[method_name] if method_name else 0
+        if self.lazy:
+            self.compute_contributions(method)
+        return method
+
+    def compute_contributions(self, method):
+        """Compute the contributions of a method from the supply arrays and inventories, unless
+        cached."""
+        if method in self.computed_methods:
+            self.computed_methods.move_to_end(method)
+            return
+        for offset in range(0, len(self.func_units), self.batch_size):
+            batch = slice(offset, offset + self.batch_size)
+            self.process_contributions.append(method, broadcast_multiply(
+                self.characterized_biosphere[method], self.supply_arrays[:, batch].T))
+            self.elementary_flow_contributions.append(method, broadcast_multiply(
+                self.characterization_matrix[method], self.inventories[:, batch].T))
+        self.computed_methods[method] = (self.process_contributions.method_nbytes(method) +
+                                         self.elementary_flow_contributions.method_nbytes(method))
+        while (self.contribution_memory is not None and len(self.computed_methods) > 1 and
+               sum(self.computed_methods.values()) > self.contribution_memory):
+            evicted, _ = self.computed_methods.popitem(last=False)
+            self.process_contributions.clear(evicted)
+            self.elementary_flow_contributions.clear(evicted)
+
     def top_process_contributions(self, method_name=None, limit=5, relative=True):
-        if method_name:
-            method = self.method_dict[method_name]
-        else:
-            method = 0
-        contribution_array = self.process_contributions[:, method, :]
-        if relative:
-            fu_scores = contribution_array.sum(axis=1)
-            contribution_array = contribution_array / fu_scores[:, np.newaxis]
-        topcontribution_dict = {}
-        for col, fu in enumerate(self.func_units):
-            top_contribution = ca.sort_array(contribution_array[col, :], limit=limit)
-            cont_per_fu = {}
-            cont_per_fu.update(
-                {('Rest', ''): contribution_array[col, :].sum() - top_contribution[:, 0].sum()})
-            for value, index in top_contribution:
-                cont_per_fu.update({self.rev_activity_dict[index]: value})
-            topcontribution_dict.update({next(iter(fu.keys())): cont_per_fu})
-        return topcontribution_dict
+        return self._top_contributions(self.process_contributions, self.rev_activity_dict,
+                                       self.contribution_method(method_name), limit, relative)
 
     def top_elementary_flow_contributions(self, method_name=None, limit=5, relative=True):
-        if method_name:
-            method = self.method_dict[method_name]
-        else:
-            method = 0
-        contribution_array = self.elementary_flow_contributions[:, method, :]
-        if relative:
-            fu_scores = contribution_array.sum(axis=1)
-            contribution_array = contribution_array / fu_scores[:, np.newaxis]
+        return self._top_contributions(self.elementary_flow_contributions, self.rev_biosphere_dict,
+                                       self.contribution_method(method_name), limit, relative)
+
+    def group_matrix(self, grouping):
+        """Return the groups and the (technosphere x groups) membership matrix of a grouping."""
+        if self.group_matrices is None:
+            self.group_matrices = {}
+        if grouping not in self.group_matrices:
+            keys = [self.rev_activity_dict[i] for i in range(len(self.rev_activity_dict))]
+            data = get_activities_data(keys)
+            self.group_matrices[grouping] = membership_matrix(
+                [GROUP_LABELS[grouping](key, data.get(key, {})) for key in keys])
+        return self.group_matrices[grouping]
+
+    def grouped_contributions(self, grouping, method_name=None):
+        """Return the groups and the (functional units x groups) process contributions of a
+        grouping."""
+        method = self.contribution_method(method_name)
+        groups, matrix = self.group_matrix(grouping)
+        return groups, self.process_contributions.matrix(method) * matrix
+
+    def top_grouped_contributions(self, grouping, method_name=None, limit=5, relative=True):
+        method = self.contribution_method(method_name)
+        groups, contributions = self.grouped_contributions(grouping, method_name)
+        store = ContributionStore(1, len(groups))
+        store.insert(0, contributions, self.process_contributions.totals(method))
+        return self._top_contributions(store, dict(enumerate(groups)), 0, limit, relative)
+
+    def _top_contributions(self, store, rev_dict, method, limit, relative):
+        top = store.top_array(method, limit=limit)
+        scale = store.totals(method) if relative else np.ones(len(top))
         topcontribution_dict = {}
-        for col, fu in enumerate(self.func_units):
-            top_contribution = ca.sort_array(contribution_array[col, :], limit=limit)
-            cont_per_fu = {}
-            cont_per_fu.update(
-                {('Rest', ''): contribution_array[col, :].sum() - top_contribution[:, 0].sum()})
-            for value, index in top_contribution:
-                cont_per_fu.update({self.rev_biosphere_dict[index]: value})
+        for fu, row, row_scale in zip(self.func_units, top, scale):
+            cont_per_fu = {('Rest', ''): row['rest'] / row_scale}
+            cont_per_fu.update({
+                rev_dict[index]: value / row_scale
+                for index, value in zip(row['index'], row['value']) if index >= 0
+            })
             topcontribution_dict.update({next(iter(fu.keys())): cont_per_fu})
         return topcontribution_dict
+
+
+_worker_mlca = None
+
+
+def _init_worker(project, cs_name, batch_size, contribution_limit, contribution_cutoff, lazy):
+    """Build and factorize the matrices of a calculation setup once per worker process."""
+    global _worker_mlca
+    if bw.projects.current != project:
+        bw.projects.set_current(project)
+    _worker_mlca = MLCA.__new__(MLCA)
+    _worker_mlca.lazy = lazy
+    _worker_mlca.setup(cs_name, batch_size, contribution_limit, contribution_cutoff)
+
+
+def _calculate_shard(shard):
+    return _worker_mlca.calculate_shard(*shard)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import heapq
+import threading
+import time
+
+import numpy as np
+import brightway2 as bw
+
+from .factorization import factorized_systems
+
+
+EDGE_DTYPE = np.dtype([
+    ('from', np.int32), ('to', np.int32), ('amount', np.float64), ('exc_amount', np.float64),
+    ('impact', np.float64),
+])
+
+
+class PathAnalysis(object):
+    """Best-first traversal of the supply chain of a demand, following the paths of greatest impact.
+
+    Gives the same nodes and edges as ``bw.GraphTraversal``, but uses the factorized system of
+    the project: the cumulative scores of all nodes are computed at once from the memoized unit
+    scores of the system (``FactorizedSystem.unit_scores``), so expanding a node takes no
+    further solves. Nodes are expanded from a priority queue ordered by their absolute
+    cumulative score; inputs with a cumulative score below ``cutoff`` of the total score are
+    left out.
+
+    The traversal is bounded by wall time instead of a number of calculations and can be
+    continued: ``traverse`` returns the edges found in the given time and a later call goes on
+    from where it stopped. ``traverse_from`` continues below a single node, with the cutoff
+    relative to the score of that node, so that parts cut off by the first traversal can be
+    explored on demand. Edges are kept as compact ``EDGE_DTYPE`` arrays, one array of inputs
+    per expanded node (see ``inputs``), which the Sankey diagram and the supply chain tree read
+    incrementally with ``edges``. The functional unit is the node -1.
+    """
+    FUNCTIONAL_UNIT = -1
+
+    def __init__(self, demand, method, cutoff=0.005, skip_coproducts=False):
+        self.demand = demand
+        self.method = method
+        self.cutoff = cutoff
+        self.skip_coproducts = skip_coproducts
+        self.system = factorized_systems.get(demand)
+        self.lca = self.system.lca(demand, method)
+        self.supply = self.lca.solver(self.lca.demand_array)
+        self.direct, self.product_scores = self.system.unit_scores(method)
+        self.score = float(self.direct.dot(self.supply))
+        if self.score == 0:
+            raise ValueError("Zero total LCA score makes traversal impossible")
+        self.technosphere = self.lca.technosphere_matrix.tocsc()
+        self.diagonal = self.technosphere.diagonal()
+        # cumulative score of the total production of every activity
+        self.cumulative = self.supply * self.diagonal * self.product_scores
+        self.reverse_activity_dict, _, _ = self.lca.reverse_dict()
+        self.static_databases = {name for name in bw.databases if bw.databases[name].get('static')}
+
+        self.nodes = {
+            self.FUNCTIONAL_UNIT: {'amount': 1, 'cum': self.score, 'ind': 1e-6 * self.score}}
+        self.inputs = {}
+        self.cutoffs = {}
+        self.chunks = []
+        self.heap = []
+        self.counter = 0
+        self.lock = threading.RLock()
+        indices = np.array([self.lca.activity_dict[key] for key in demand], dtype=int)
+        amounts = np.array([demand[key] for key in demand], dtype=float)
+        self.add_inputs(self.FUNCTIONAL_UNIT, indices, amounts, amounts,
+                        self.cumulative[indices] * amounts / self.supply[indices])
+        self.cutoffs[self.FUNCTIONAL_UNIT] = 0
+
+    @property
+    def done(self):
+        return not self.heap
+
+    @property
+    def edges(self):
+        """All edges found so far as one ``EDGE_DTYPE`` array, in the order they were found."""
+        return self.edges_since(0)[0]
+
+    def edges_since(self, position):
+        """Return the edges found after the first ``position`` arrays of inputs, and the new
+        position."""
+        if len(self.chunks) <= position:
+            return np.zeros(0, dtype=EDGE_DTYPE), position
+        return np.concatenate(self.chunks[position:]), len(self.chunks)
+
+    def add_inputs(self, parent, indices, amounts, exc_amounts, impacts):
+        edges = np.zeros(len(indices), dtype=EDGE_DTYPE)
+        edges['from'], edges['to'] = indices, parent
+        edges['amount'], edges['exc_amount'], edges['impact'] = amounts, exc_amounts, impacts
+        edges = edges[np.argsort(-np.abs(impacts), kind='stable')]
+        if parent in self.inputs:
+            inputs = np.concatenate([self.inputs[parent], edges])
+            self.inputs[parent] = inputs[np.argsort(-np.abs(inputs['impact']), kind='stable')]
+        else:
+            self.inputs[parent] = edges
+        self.chunks.append(edges)
+        for index in edges['from'].tolist():
+            if index not in self.nodes:
+                self.nodes[index] = {
+                    'amount': float(self.diagonal[index] * self.supply[index]),
+                    'cum': float(self.cumulative[index]),
+                    'ind': float(self.direct[index] * self.supply[index]),
+                }
+                heapq.heappush(self.heap, (-abs(self.cumulative[index]), index))
+        return edges
+
+    def expand_node(self, parent, cutoff=None):
+        """Return the inputs of ``parent`` with a cumulative score above ``cutoff`` of the total
+        score.
+
+        Inputs are added when ``parent`` was not expanded yet, or only with a higher cutoff.
+        """
+        cutoff = self.cutoff if cutoff is None else cutoff
+        with self.lock:
+            if parent in self.inputs and self.cutoffs[parent] <= cutoff:
+                return self.inputs[parent]
+            static = self.static_databases and \
+                self.reverse_activity_dict[parent][0] in self.static_databases
+            if not static:
+                self.add_new_inputs(parent, cutoff)
+            elif parent not in self.inputs:
+                self.add_inputs(parent, *([np.zeros(0)] * 4))
+            self.cutoffs[parent] = cutoff
+            return self.inputs[parent]
+
+    def add_new_inputs(self, parent, cutoff):
+        """Add the inputs of ``parent`` above ``cutoff`` that are not among its inputs yet."""
+        scale = self.diagonal[parent]
+        if scale == 0:
+            raise ValueError("Can't rescale activities that produce zero reference product")
+        start, stop = self.technosphere.indptr[parent], self.technosphere.indptr[parent + 1]
+        rows = self.technosphere.indices[start:stop]
+        data = self.technosphere.data[start:stop]
+        keep = rows != parent
+        if self.skip_coproducts:
+            keep &= data < 0
+        if parent in self.inputs:
+            keep &= ~np.isin(rows, self.inputs[parent]['from'])
+        self.counter += int(keep.sum())
+        keep &= np.abs(self.cumulative[rows]) >= abs(self.score * cutoff)
+        rows, data = rows[keep], data[keep]
+        flows = -data * self.supply[parent]
+        self.add_inputs(parent, rows, flows, -data / scale, flows * self.product_scores[rows])
+
+    def traverse(self, time_limit=None):
+        """Expand nodes in order of impact until none are left or ``time_limit`` seconds passed.
+
+        Returns the new edges as ``EDGE_DTYPE`` array.
+        """
+        with self.lock:
+            position = len(self.chunks)
+            deadline = None if time_limit is None else time.perf_counter() + time_limit
+            while self.heap and (deadline is None or time.perf_counter() < deadline):
+                _, parent = heapq.heappop(self.heap)
+                self.expand_node(parent)
+            return self.edges_since(position)[0]
+
+    def traverse_from(self, root, time_limit=None, cutoff=None):
+        """Expand the supply chain below ``root`` in order of impact, for at most ``time_limit``
+        seconds.
+
+        The cutoff is relative to the cumulative score of ``root`` instead of the total score.
+        Returns the new edges as ``EDGE_DTYPE`` array.
+        """
+        cutoff = self.cutoff if cutoff is None else cutoff
+        cutoff *= abs(self.nodes[root]['cum'] / self.score)
+        with self.lock:
+            position = len(self.chunks)
+            deadline = None if time_limit is None else time.perf_counter() + time_limit
+            heap, seen = [(0, root)], {root}
+            while heap and (deadline is None or time.perf_counter() < deadline):
+                _, parent = heapq.heappop(heap)
+                for index in self.expand_node(parent, cutoff)['from'].tolist():
+                    if index not in seen:
+                        seen.add(index)
+                        heapq.heappush(heap, (-abs(self.cumulative[index]), index))
+            return self.edges_since(position)[0]
+
+    def path_score(self, index, amount):
+        """Return the cumulative score of ``amount`` of the product of node ``index``."""
+        if index == self.FUNCTIONAL_UNIT:
+            return self.score * amount
+        return float(amount * self.product_scores[index])
+
+    @staticmethod
+    def edge_dicts(edges):
+        """Return ``EDGE_DTYPE`` edges as dicts in the format of ``bw.GraphTraversal``."""
+        return [dict(zip(EDGE_DTYPE.names, edge)) for edge in edges.tolist()]
+
+    def calculate(self, time_limit=None):
+        """Traverse for at most ``time_limit`` seconds and return the result in the format of
+        ``bw.GraphTraversal.calculate``, with the analysis itself as 'analysis'."""
+        self.traverse(time_limit)
+        return {
+            'nodes': self.nodes,
+            'edges': self.edge_dicts(self.edges),
+            'lca': self.lca,
+            'counter': self.counter,
+            'analysis': self,
+        }
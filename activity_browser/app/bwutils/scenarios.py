@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import brightway2 as bw
+from bw2calc.matrices import TechnosphereBiosphereMatrixBuilder as TBMBuilder
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from .factorization import factorized_systems
+from .montecarlo import SparsePattern
+
+
+KEY_COLUMNS = ['from database', 'from code', 'to database', 'to code']
+
+
+def read_scenarios(filepath):
+    """Read a scenario table from a CSV or Excel file."""
+    if filepath.lower().endswith(('.xls', '.xlsx')):
+        table = pd.read_excel(filepath)
+    else:
+        table = pd.read_csv(filepath)
+    return check_scenarios(table)
+
+
+def check_scenarios(table):
+    """Check the columns of a scenario table and return it with float scenario columns."""
+    missing = [column for column in KEY_COLUMNS if column not in table.columns]
+    if missing:
+        raise ValueError("The scenario table misses the columns: {}".format(', '.join(missing)))
+    scenarios = [column for column in table.columns if column not in KEY_COLUMNS]
+    if not scenarios:
+        raise ValueError("The scenario table contains no scenario columns.")
+    table = table.copy()
+    table[KEY_COLUMNS] = table[KEY_COLUMNS].astype(str)
+    table[scenarios] = table[scenarios].astype(float)
+    return table
+
+
+def parameter_positions(params, rows, cols, shape):
+    """Return the positions in ``params`` of the first entry and of the other entries of every
+    (row, col).
+
+    Raises a ``KeyError`` with the index of the first (row, col) that has no entry.
+    """
+    linear = params['row'].astype(np.int64) * shape[1] + params['col']
+    wanted = np.asarray(rows, dtype=np.int64) * shape[1] + np.asarray(cols, dtype=np.int64)
+    order = np.argsort(linear, kind='stable')
+    start = np.searchsorted(linear[order], wanted, side='left')
+    stop = np.searchsorted(linear[order], wanted, side='right')
+    if np.any(start == stop):
+        raise KeyError(np.where(start == stop)[0][0])
+    return order[start], [order[a + 1:b] for a, b in zip(start, stop)]
+
+
+class ScenarioMLCA(object):
+    """Calculate all functional units and LCIA methods of a calculation setup for many scenarios.
+
+    ``scenarios`` is a table (see ``read_scenarios``) with the ``KEY_COLUMNS``, which identify an
+    existing technosphere or biosphere exchange by its input ('from') and output ('to') activity,
+    and one column of exchange amounts per scenario. Empty cells keep the amount of the database.
+
+    The parameter arrays, matrix indices and sparsity patterns are taken from the project-level
+    ``factorized_systems`` and the characterization factors are stacked once. A scenario only
+    replaces the overridden amounts and fills new matrices with the same structure; the
+    technosphere is factorized again only if the scenario changes technosphere exchanges.
+
+    ``calculate`` returns (and keeps as ``results``) a (scenarios x functional units x methods)
+    array. With ``processes > 1`` the scenarios are calculated in a pool of worker processes.
+    """
+    def __init__(self, cs_name, scenarios):
+        try:
+            cs = bw.calculation_setups[cs_name]
+        except KeyError:
+            raise ValueError(
+                "{} is not a known `calculation_setup`.".format(cs_name)
+            )
+        self.cs_name = cs_name
+        self.func_units = cs['inv']
+        self.methods = cs['ia']
+        self.method_dict = {m: i for i, m in enumerate(self.methods)}
+        self.table = check_scenarios(scenarios)
+        self.scenarios = [column for column in self.table.columns if column not in KEY_COLUMNS]
+        self.results = None
+
+        self.lca = factorized_systems.lca({key: 1 for fu in self.func_units for key in fu})
+        self.tech_params, self.bio_params = self.lca.tech_params, self.lca.bio_params
+        self.tech_pattern = SparsePattern(
+            self.tech_params['row'], self.tech_params['col'], self.lca.technosphere_matrix.shape)
+        self.bio_pattern = SparsePattern(
+            self.bio_params['row'], self.bio_params['col'], self.lca.biosphere_matrix.shape)
+        self.characterization_matrix = self.load_methods()
+        self.demand = np.zeros((len(self.lca.product_dict), len(self.func_units)))
+        for col, func_unit in enumerate(self.func_units):
+            for key, amount in func_unit.items():
+                self.demand[self.lca.product_dict[key], col] = amount
+        self.locate_exchanges()
+
+    def load_methods(self):
+        """Return the characterization factors of all methods stacked as (methods x biosphere)."""
+        factors = []
+        for method in self.methods:
+            self.lca.switch_method(method)
+            factors.append(sparse.csr_matrix(self.lca.characterization_matrix.diagonal()))
+        return sparse.vstack(factors, format='csr')
+
+    def locate_exchanges(self):
+        """Find the parameter positions of the exchanges of the scenario table."""
+        is_tech, rows, cols = [], [], []
+        for exchange in self.table[KEY_COLUMNS].itertuples(index=False):
+            source, target = (exchange[0], exchange[1]), (exchange[2], exchange[3])
+            if target not in self.lca.activity_dict:
+                raise ValueError("{} is not an activity of this calculation setup.".format(target))
+            if source in self.lca.product_dict:
+                is_tech.append(True)
+                rows.append(self.lca.product_dict[source])
+            elif source in self.lca.biosphere_dict:
+                is_tech.append(False)
+                rows.append(self.lca.biosphere_dict[source])
+            else:
+                raise ValueError("{} is not a product or biosphere flow of this calculation "
+                                 "setup.".format(source))
+            cols.append(self.lca.activity_dict[target])
+        self.is_tech = np.array(is_tech, dtype=bool)
+        rows, cols = np.array(rows, dtype=int), np.array(cols, dtype=int)
+        self.positions = {}
+        for kind, mask, params, shape in (
+                ('tech', self.is_tech, self.tech_params, self.lca.technosphere_matrix.shape),
+                ('bio', ~self.is_tech, self.bio_params, self.lca.biosphere_matrix.shape)):
+            try:
+                self.positions[kind] = parameter_positions(params, rows[mask], cols[mask], shape)
+            except KeyError as e:
+                exchange = self.table[KEY_COLUMNS].values[np.where(mask)[0][e.args[0]]]
+                raise ValueError(
+                    "The exchange from {} to {} does not exist; only the amounts of existing "
+                    "exchanges can be changed.".format(tuple(exchange[:2]), tuple(exchange[2:])))
+
+    def parameter_values(self, scenario):
+        """Return the technosphere and biosphere amounts of a scenario, or None if they are
+        unchanged."""
+        values = self.table[self.scenarios[scenario]].values
+        amounts = []
+        for kind, mask, params in (('tech', self.is_tech, self.tech_params),
+                                   ('bio', ~self.is_tech, self.bio_params)):
+            first, others = self.positions[kind]
+            changed = ~np.isnan(values[mask])
+            if not changed.any():
+                amounts.append(None)
+                continue
+            amount = params['amount'].copy()
+            amount[first[changed]] = values[mask][changed]
+            for duplicates in (o for o, c in zip(others, changed) if c and len(o)):
+                amount[duplicates] = 0  # the scenario gives the total amount of the exchange
+            amounts.append(amount)
+        return amounts
+
+    def calculate_scenario(self, scenario):
+        """Return the (functional units x methods) scores of a scenario."""
+        tech_amounts, bio_amounts = self.parameter_values(scenario)
+        if tech_amounts is None:
+            solver = self.lca.solver
+        else:
+            technosphere = self.tech_pattern.matrix(
+                TBMBuilder.fix_supply_use(self.tech_params, tech_amounts))
+            solver = splu(technosphere.tocsc()).solve
+        if bio_amounts is None:
+            biosphere = self.lca.biosphere_matrix
+        else:
+            biosphere = self.bio_pattern.matrix(bio_amounts)
+        supply = solver(self.demand)
+        return np.asarray(self.characterization_matrix * (biosphere * supply)).T
+
+    def calculate(self, processes=1, progress=None):
+        """Calculate all scenarios; ``progress(done, total)`` is called after every scenario."""
+        results = np.zeros((len(self.scenarios), len(self.func_units), len(self.methods)))
+        indices = range(len(self.scenarios))
+        if processes > 1 and len(self.scenarios) > 1:
+            with multiprocessing.Pool(min(processes, len(self.scenarios)), initializer=_init_worker,
+                                      initargs=(bw.projects.current, self.cs_name,
+                                                self.table)) as pool:
+                for i, scores in zip(indices, pool.imap(_calculate_scenario, indices)):
+                    results[i] = scores
+                    if progress is not None:
+                        progress(i + 1, len(self.scenarios))
+        else:
+            for i in indices:
+                results[i] = self.calculate_scenario(i)
+                if progress is not None:
+                    progress(i + 1, len(self.scenarios))
+        self.results = results
+        return results
+
+    def results_frame(self, method):
+        """Return the scores of a method as (functional units x scenarios) DataFrame."""
+        return pd.DataFrame(self.results[:, :, self.method_dict[method]].T,
+                            columns=self.scenarios)
+
+
+_worker_scenarios = None
+
+
+def _init_worker(project, cs_name, table):
+    """Build the sparsity patterns of a calculation setup once per worker process."""
+    global _worker_scenarios
+    if bw.projects.current != project:
+        bw.projects.set_current(project)
+    _worker_scenarios = ScenarioMLCA(cs_name, table)
+
+
+def _calculate_scenario(scenario):
+    return _worker_scenarios.calculate_scenario(scenario)
@@ -12,6 +12,9 @@ from activity_browser.app.ui.wizards.db_import_wizard import (
     DatabaseImportWizard, DefaultBiosphereDialog, CopyDatabaseDialog
 )
 from .bwutils import commontasks as bc
+from .bwutils.factorization import factorized_systems
+from .bwutils.metadata import activity_metadata
+from .ui.web.sankey.worker_threads import traversal_jobs
 from .settings import ab_settings, user_project_settings
 from .signals import signals
 
@@ -42,9 +45,18 @@ class Controller(object):
         signals.change_project_dialog.connect(self.change_project_dialog)
         signals.copy_project.connect(self.copy_project)
         signals.delete_project.connect(self.delete_project)
+        signals.project_selected.connect(factorized_systems.clear)
+        signals.project_selected.connect(activity_metadata.clear)
+        signals.project_selected.connect(traversal_jobs.clear)
         # Database
         signals.add_database.connect(self.add_database)
         signals.delete_database.connect(self.delete_database)
+        signals.database_changed.connect(factorized_systems.invalidate)
+        signals.delete_database.connect(factorized_systems.invalidate)
+        signals.database_changed.connect(activity_metadata.invalidate)
+        signals.delete_database.connect(activity_metadata.invalidate)
+        signals.database_changed.connect(traversal_jobs.clear)
+        signals.delete_database.connect(traversal_jobs.clear)
         signals.copy_database.connect(self.copy_database)
         signals.install_default_data.connect(self.install_default_data)
         signals.import_database.connect(self.import_database_wizard)
@@ -65,6 +65,9 @@ class Signals(QtCore.QObject):
 
     # LCA Calculation
     lca_calculation = QtCore.pyqtSignal(str)
+    lca_calculation_progress = QtCore.pyqtSignal(str, int, int)
+    lca_calculation_finished = QtCore.pyqtSignal(str)
+    cancel_lca_calculation = QtCore.pyqtSignal()
 
     method_selected = QtCore.pyqtSignal(tuple)
     method_tabs_changed = QtCore.pyqtSignal()
@@ -119,15 +119,24 @@ class ProcessContributionPlot(Plot):
     def __init__(self, parent=None, *args):
         super(ProcessContributionPlot, self).__init__(parent, *args)
 
-    def plot(self, mlca, method=None):
+    def plot(self, mlca, method=None, grouping=None):
         self.ax.clear()
         height = 4 + len(mlca.func_units) * 1
         self.figure.set_figheight(height)
 
-        tc = mlca.top_process_contributions(method_name=method, limit=5, relative=True)
+        if grouping:
+            tc = mlca.top_grouped_contributions(
+                grouping, method_name=method, limit=5, relative=True)
+        else:
+            tc = mlca.top_process_contributions(method_name=method, limit=5, relative=True)
         df_tc = pd.DataFrame(tc)
         df_tc.columns = [format_activity_label(a, style='pnl') for a in tc.keys()]
-        df_tc.index = [format_activity_label(a, style='pnl', max_length=30) for a in df_tc.index]
+        if grouping:
+            df_tc.index = [wrap_text(''.join(g) if isinstance(g, tuple) else g, max_length=30)
+                           for g in df_tc.index]
+        else:
+            df_tc.index = [format_activity_label(a, style='pnl', max_length=30)
+                           for a in df_tc.index]
         plot = df_tc.T.plot.barh(
             stacked=True,
             cmap=plt.cm.nipy_spectral_r,
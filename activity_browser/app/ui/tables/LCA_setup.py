@@ -108,7 +108,7 @@ class CSActivityTable(ABTableWidget):
             event.accept()
 
     def dropEvent(self, event):
-        new_keys = [item.key for item in event.source().selectedItems()]
+        new_keys = event.source().selected_keys()
         for key in new_keys:
             act = bw.get_activity(key)
             if act.get('type', 'process') != "process":
@@ -10,6 +10,6 @@ from .inventory import DatabasesTable
 from .activity import ExchangeTable
 from .history import ActivitiesHistoryTable
 from .impact_categories import CFTable, MethodsTable
-from .lca_results import LCAResultsTable
+from .lca_results import LCAResultsTable, MonteCarloTable, ScenarioTable, SensitivityTable
 from .projects import ProjectTable, ProjectListWidget
 from .table import ABTableWidget, ABTableItem
\ No newline at end of file
@@ -79,6 +79,10 @@ class ExchangeTable(ABTableWidget):
             event.accept()
 
     def dropEvent(self, event):
+        if isinstance(event.source(), ActivitiesTable):
+            signals.exchanges_add.emit(event.source().selected_keys(), self.qs._key)
+            event.accept()
+            return
         items = event.source().selectedItems()
         if isinstance(items[0], ABTableItem):
             signals.exchanges_add.emit([x.key for x in items], self.qs._key)
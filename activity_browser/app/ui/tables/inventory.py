@@ -5,13 +5,15 @@ import itertools
 import arrow
 import brightway2 as bw
 import collections
-from PyQt5 import QtGui, QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets
 from bw2data.utils import natural_sort
 from fuzzywuzzy import process
 
 from activity_browser.app.settings import user_project_settings
 from .table import ABTableWidget, ABTableItem
 from ..icons import icons
+from ..style import style_item
+from ...bwutils.metadata import activity_metadata, database_snapshot
 from ...signals import signals
 
 
@@ -153,22 +155,131 @@ class BiosphereFlowsTable(ABTableWidget):
             self.sync(self.database.name, search_result)
 
 
-class ActivitiesTable(ABTableWidget):
-    MAX_LENGTH = 500
-    COLUMNS = {
-        0: "name",
-        1: "reference product",
-        2: "location",
-        3: "unit",
-        4: "key",
-    }
+class ActivitiesModel(QtCore.QAbstractTableModel):
+    """Columnar snapshot of the activities shown in the ``ActivitiesTable``.
+
+    The snapshot keeps one list per column. The view gets the rows in batches of
+    ``BATCH_SIZE`` through ``canFetchMore`` and ``fetchMore`` while it is scrolled, so that
+    databases of any size open quickly and no activities are left out. The units of a database
+    snapshot are loaded per batch from ``activity_metadata``, as they are not part of
+    ``database_snapshot``.
+    """
+    BATCH_SIZE = 500
+    COLUMNS = ["name", "reference product", "location", "unit", "key"]
     HEADERS = ["Name", "Reference Product", "Location", "Unit", "Key"]
 
+    def __init__(self, parent=None):
+        super(ActivitiesModel, self).__init__(parent)
+        self.columns = {column: [] for column in self.COLUMNS}
+        self.fetched = 0
+        self.sort_column, self.sort_order = 0, QtCore.Qt.AscendingOrder
+
+    def set_columns(self, columns):
+        """Replace the snapshot with ``columns``; missing columns are loaded when they are shown."""
+        self.beginResetModel()
+        size = len(columns['key'])
+        self.columns = {column: list(columns.get(column, [None] * size)) for column in self.COLUMNS}
+        self.fetched = 0
+        self.order_rows()
+        self.endResetModel()
+
+    def set_database(self, name):
+        self.set_columns(database_snapshot(name))
+
+    def set_activities(self, activities):
+        columns = {column: [ds.get(column, '') for ds in activities] for column in self.COLUMNS}
+        columns['key'] = [ds.key for ds in activities]
+        self.set_columns(columns)
+
+    def size(self):
+        """Number of activities, including the ones not fetched by the view yet."""
+        return len(self.columns['key'])
+
+    def clear(self):
+        self.set_columns({'key': []})
+
+    def key(self, row):
+        return self.columns['key'][row]
+
+    def load_units(self, start, stop):
+        units, keys = self.columns['unit'], self.columns['key']
+        missing = [row for row in range(start, stop) if units[row] is None]
+        if missing:
+            activity_metadata.load(keys[row] for row in missing)
+            for row in missing:
+                units[row] = activity_metadata.get(keys[row]).get('unit', '')
+
+    def order_rows(self):
+        column = self.COLUMNS[self.sort_column]
+        if column == 'unit':
+            self.load_units(0, self.size())
+        values = self.columns[column]
+        rows = sorted(range(len(values)), key=lambda row: str(values[row]).lower(),
+                      reverse=self.sort_order == QtCore.Qt.DescendingOrder)
+        self.columns = {column: [values[row] for row in rows]
+                        for column, values in self.columns.items()}
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.beginResetModel()
+        self.sort_column, self.sort_order = column, order
+        self.order_rows()
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.fetched
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self.fetched < self.size()
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        stop = min(self.fetched + self.BATCH_SIZE, self.size())
+        self.load_units(self.fetched, stop)
+        self.beginInsertRows(QtCore.QModelIndex(), self.fetched, stop - 1)
+        self.fetched = stop
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = self.COLUMNS[index.column()]
+        if role == QtCore.Qt.DisplayRole:
+            value = self.columns[column][index.row()]
+            return '' if value is None else str(value)
+        if role == QtCore.Qt.ForegroundRole:
+            return style_item.brushes.get(column, style_item.brushes.get("default"))
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsDragEnabled
+
+
+class ActivitiesTable(QtWidgets.QTableView):
+    """Displays the activities of the selected database, or the results of a search in it.
+    The activities are held by an ``ActivitiesModel``, which the view reads in batches as it is
+    scrolled. Activities can be dragged to exchange and calculation setup tables,
+    see ``selected_keys``."""
+
     def __init__(self, parent=None):
         super(ActivitiesTable, self).__init__(parent)
         self.database_name = None
+        self.activities_model = ActivitiesModel(self)
+        self.setModel(self.activities_model)
+        self.activities_model.rowsInserted.connect(self.update_height)
+        self.activities_model.modelReset.connect(self.update_height)
+        self.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+        self.verticalHeader().setVisible(False)
+        self.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
         self.setDragEnabled(True)
-        self.setColumnCount(len(self.HEADERS))
+        self.setSortingEnabled(True)
+        self.sortByColumn(0, QtCore.Qt.AscendingOrder)
         self.db_read_only = user_project_settings.settings.get('read-only-databases', {}).get(self.database_name, True)
         self.setup_context_menu()
         self.connect_signals()
@@ -198,19 +309,19 @@ class ActivitiesTable(ABTableWidget):
         self.addAction(self.duplicate_activity_to_db_action)
 
         self.open_activity_action.triggered.connect(
-            lambda x: signals.open_activity_tab.emit("activities", self.currentItem().key)
+            lambda x: signals.open_activity_tab.emit("activities", self.current_key())
         )
         self.new_activity_action.triggered.connect(
             lambda: signals.new_activity.emit(self.database.name)
         )
         self.duplicate_activity_action.triggered.connect(
-            lambda x: signals.duplicate_activity.emit(self.currentItem().key)
+            lambda x: signals.duplicate_activity.emit(self.current_key())
         )
         self.delete_activity_action.triggered.connect(
-            lambda x: signals.delete_activity.emit(self.currentItem().key)
+            lambda x: signals.delete_activity.emit(self.current_key())
         )
         self.duplicate_activity_to_db_action.triggered.connect(
-            lambda: signals.show_duplicate_to_db_interface.emit(self.currentItem().key)
+            lambda: signals.show_duplicate_to_db_interface.emit(self.current_key())
         )
 
     def update_activity_table_read_only(self, db, db_read_only):
@@ -227,13 +338,22 @@ class ActivitiesTable(ABTableWidget):
         signals.database_changed.connect(self.filter_database_changed)
         signals.database_read_only_changed.connect(self.update_activity_table_read_only)
 
-        self.itemDoubleClicked.connect(
-            lambda x: signals.open_activity_tab.emit("activities", x.key)
+        self.doubleClicked.connect(
+            lambda x: signals.open_activity_tab.emit(
+                "activities", self.activities_model.key(x.row()))
         )
-        self.itemDoubleClicked.connect(
-            lambda x: signals.add_activity_to_history.emit(x.key)
+        self.doubleClicked.connect(
+            lambda x: signals.add_activity_to_history.emit(self.activities_model.key(x.row()))
         )
 
+    def current_key(self):
+        return self.activities_model.key(self.currentIndex().row())
+
+    def selected_keys(self):
+        """Return the keys of the selected activities, in the order of the table."""
+        return [self.activities_model.key(row) for row in
+                sorted({index.row() for index in self.selectionModel().selectedRows()})]
+
     def update_search_index(self):
         if self.database is not self.fuzzy_search_index[0]:
             activity_data = [obj['data'] for obj in self.database._get_queryset().dicts()]
@@ -242,31 +362,48 @@ class ActivitiesTable(ABTableWidget):
                 name_activity_dict[act['name']].append(self.database.get(act['code']))
             self.fuzzy_search_index = (self.database, name_activity_dict)
 
-
-
-    @ABTableWidget.decorated_sync
     def sync(self, name, data=None):
         # fills activity table with data contained in selected database
         self.database_name = name
-        if not data:
+        if data is None:
             self.database = bw.Database(name)
             self.database.order_by = 'name'
             self.database.filters = {'type': 'process'}
-            data = itertools.islice(self.database, 0, self.MAX_LENGTH)
-            self.setRowCount(min(len(self.database), self.MAX_LENGTH))
-        self.setHorizontalHeaderLabels(self.HEADERS)
-        for row, ds in enumerate(data):
-            for col, value in self.COLUMNS.items():
-                if value == "key":
-                    self.setItem(row, col, ABTableItem(str(ds.key), key=ds.key, color=value))
-                elif value == "location":
-                    self.setItem(row, col, ABTableItem(str(ds.get(value, '')), key=ds.key, color=value))
-                else:
-                    self.setItem(row, col, ABTableItem(ds.get(value, ''), key=ds.key, color=value))
-        
+            self.activities_model.set_database(name)
+        else:
+            self.activities_model.set_activities(data)
+        if self.activities_model.canFetchMore():
+            self.activities_model.fetchMore()
+        self.resizeColumnsToContents()
+
         self.db_read_only = user_project_settings.settings.get('read-only-databases', {}).get(self.database_name, True)
         self.update_activity_table_read_only(self.database_name, db_read_only=self.db_read_only)
 
+    def update_height(self):
+        """Let the table grow with the rows fetched so far."""
+        self.setMaximumHeight(self.sizeHint().height())
+
+    def sizeHint(self):
+        rows = self.activities_model.rowCount()
+        if rows > 0:
+            height = self.verticalHeader().defaultSectionSize() * (rows + 1) + \
+                     self.autoScrollMargin()
+            return QtCore.QSize(self.width(), height)
+        else:
+            return QtCore.QSize(self.width(), 50)
+
+    def keyPressEvent(self, e):
+        if e.matches(QtGui.QKeySequence.Copy):
+            rows = sorted({index.row() for index in self.selectedIndexes()})
+            s = "\n".join(
+                "\t".join(self.activities_model.data(self.activities_model.index(row, col))
+                          for col in range(self.activities_model.columnCount()))
+                for row in rows
+            )
+            signals.copy_selection_to_clipboard.emit(s)
+        else:
+            QtWidgets.QTableView.keyPressEvent(self, e)
+
     def filter_database_changed(self, database_name):
         if not hasattr(self, "database") or self.database.name != database_name:
             return
@@ -276,17 +413,18 @@ class ActivitiesTable(ABTableWidget):
         self.sync(self.database.name)
 
     def search(self, search_term):
-        search_result = self.database.search(search_term, limit=self.MAX_LENGTH)
-        self.setRowCount(len(search_result))
-        if search_result or search_term == '':
-            self.sync(self.database.name, search_result)
+        if not search_term:
+            self.reset_search()
+        else:
+            self.sync(self.database.name, self.database.search(search_term, limit=None))
 
     def fuzzy_search(self, search_term):
+        if not search_term:
+            self.reset_search()
+            return
         names = list(self.fuzzy_search_index[1].keys())
         fuzzy_search_result = process.extractBests(search_term, names, score_cutoff=10, limit=50)
         result = list(itertools.chain.from_iterable(
             [self.fuzzy_search_index[1][name] for name, score in fuzzy_search_result]
         ))
-        self.setRowCount(len(result))
-        if result or search_term == '':
-            self.sync(self.database.name, result)
+        self.sync(self.database.name, result)
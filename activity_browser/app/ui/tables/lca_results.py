@@ -11,3 +11,38 @@ class LCAResultsTable(ABDataFrameTable):
         col_labels = [" | ".join(x) for x in lca.methods]
         row_labels = [str(get_activity(list(func_unit.keys())[0])) for func_unit in lca.func_units]
         self.dataframe = pd.DataFrame(lca.results, index=row_labels, columns=col_labels)
+
+
+class MonteCarloTable(ABDataFrameTable):
+    @ABDataFrameTable.decorated_sync
+    def sync(self, lca, statistics, method):
+        row_labels = [str(get_activity(list(func_unit.keys())[0])) for func_unit in lca.func_units]
+        col = lca.method_dict[method]
+        self.dataframe = pd.DataFrame({
+            'mean': statistics.mean[:, col],
+            'std': statistics.std[:, col],
+            'standard error': statistics.standard_error[:, col],
+            'min': statistics.minimum[:, col],
+            'max': statistics.maximum[:, col],
+        }, index=row_labels, columns=['mean', 'std', 'standard error', 'min', 'max'])
+
+
+class ScenarioTable(ABDataFrameTable):
+    @ABDataFrameTable.decorated_sync
+    def sync(self, scenario_lca, method):
+        self.dataframe = scenario_lca.results_frame(method)
+        self.dataframe.index = [
+            str(get_activity(list(func_unit.keys())[0])) for func_unit in scenario_lca.func_units]
+
+
+class SensitivityTable(ABDataFrameTable):
+    @ABDataFrameTable.decorated_sync
+    def sync(self, indices):
+        row_labels = [
+            '{}: {} > {}'.format(
+                kind, get_activity(source),
+                ' | '.join(target) if kind == 'characterization' else get_activity(target))
+            for kind, source, target in zip(indices['type'], indices['input'], indices['output'])]
+        self.dataframe = pd.DataFrame(
+            indices[['amount', 'first order', 'total']].values, index=row_labels,
+            columns=['amount', 'first order', 'total'])
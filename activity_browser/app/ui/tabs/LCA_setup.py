@@ -90,6 +90,10 @@ class LCASetupTab(QtWidgets.QWidget):
         self.delete_cs_button = QtWidgets.QPushButton('Delete')
         self.calculate_button = QtWidgets.QPushButton('Calculate')
         self.sankey_button = QtWidgets.QPushButton('Sankey')
+        self.calculation_progress = QtWidgets.QProgressBar()
+        self.calculation_progress.hide()
+        self.cancel_calculation_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_calculation_button.hide()
 
         name_row = QtWidgets.QHBoxLayout()
         name_row.addWidget(header('Calculation Setups:'))
@@ -102,6 +106,8 @@ class LCASetupTab(QtWidgets.QWidget):
         calc_row = QtWidgets.QHBoxLayout()
         calc_row.addWidget(self.calculate_button)
         calc_row.addWidget(self.sankey_button)
+        calc_row.addWidget(self.calculation_progress)
+        calc_row.addWidget(self.cancel_calculation_button)
         calc_row.addStretch(1)
 
         container = QtWidgets.QVBoxLayout()
@@ -122,6 +128,7 @@ class LCASetupTab(QtWidgets.QWidget):
         # Signals
         self.calculate_button.clicked.connect(self.start_calculation)
         self.sankey_button.clicked.connect(self.open_sankey)
+        self.cancel_calculation_button.clicked.connect(signals.cancel_lca_calculation.emit)
 
         self.new_cs_button.clicked.connect(signals.new_calculation_setup.emit)
         self.delete_cs_button.clicked.connect(
@@ -140,6 +147,8 @@ class LCASetupTab(QtWidgets.QWidget):
         signals.calculation_setup_selected.connect(self.show_details)
         signals.calculation_setup_selected.connect(self.enable_calculations)
         signals.calculation_setup_changed.connect(self.enable_calculations)
+        signals.lca_calculation_progress.connect(self.show_calculation_progress)
+        signals.lca_calculation_finished.connect(self.hide_calculation_progress)
 
     def save_cs_changes(self):
         name = self.list_widget.currentText()
@@ -152,6 +161,17 @@ class LCASetupTab(QtWidgets.QWidget):
     def start_calculation(self):
         signals.lca_calculation.emit(self.list_widget.name)
 
+    def show_calculation_progress(self, name, done, total):
+        self.calculation_progress.setFormat('{}: %p%'.format(name))
+        self.calculation_progress.setMaximum(total)
+        self.calculation_progress.setValue(done)
+        self.calculation_progress.show()
+        self.cancel_calculation_button.show()
+
+    def hide_calculation_progress(self):
+        self.calculation_progress.hide()
+        self.cancel_calculation_button.hide()
+
     def set_default_calculation_setup(self):
         if not len(calculation_setups):
             self.hide_details()
@@ -1,16 +1,24 @@
 # -*- coding: utf-8 -*-
-from PyQt5 import QtWidgets
+import collections
+
+import brightway2 as bw
+from PyQt5 import QtCore, QtWidgets
 
 from ..style import horizontal_line, header
-from ..tables import LCAResultsTable
+from ..tables import LCAResultsTable, MonteCarloTable, ScenarioTable, SensitivityTable
 from ..graphics import (
     CorrelationPlot,
     LCAResultsPlot,
     ProcessContributionPlot,
     ElementaryFlowContributionPlot
 )
+from ...bwutils.cache import result_cache
+from ...bwutils.gsa import SobolGSA
+from ...bwutils.montecarlo import MonteCarloMLCA, RunningStatistics
 from ...bwutils.multilca import MLCA
+from ...bwutils.scenarios import KEY_COLUMNS, ScenarioMLCA, read_scenarios
 from ...bwutils import commontasks as bc
+from ...settings import ab_settings
 from ...signals import signals
 
 
@@ -22,6 +30,8 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
         self.visible = False
 
         self.combo_LCIA_methods = QtWidgets.QComboBox()
+        self.combo_grouping = QtWidgets.QComboBox()
+        self.combo_grouping.addItems(('process',) + MLCA.GROUPINGS)
 
         self.results_plot = LCAResultsPlot(self)
         self.correlation_plot = CorrelationPlot(self)
@@ -33,6 +43,72 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
         self.to_csv_button = QtWidgets.QPushButton('csv')
         self.to_excel_button = QtWidgets.QPushButton('Excel')
 
+        self.monte_carlo_iterations = QtWidgets.QSpinBox()
+        self.monte_carlo_iterations.setRange(10, 1000000)
+        self.monte_carlo_iterations.setSingleStep(100)
+        self.monte_carlo_iterations.setValue(1000)
+        self.monte_carlo_sampling = QtWidgets.QComboBox()
+        self.monte_carlo_sampling.addItems(MonteCarloMLCA.SAMPLING)
+        self.monte_carlo_tolerance = QtWidgets.QDoubleSpinBox()
+        self.monte_carlo_tolerance.setRange(0.0, 100.0)
+        self.monte_carlo_tolerance.setDecimals(2)
+        self.monte_carlo_tolerance.setSuffix(' %')
+        self.monte_carlo_tolerance.setSpecialValueText('off')
+        self.monte_carlo_tolerance.setToolTip(
+            'Stop once the 95% confidence interval of every mean is within this percentage of\n'
+            'the mean')
+        self.monte_carlo_status = QtWidgets.QLabel()
+        self.monte_carlo_button = QtWidgets.QPushButton('Run Monte Carlo')
+        self.cancel_monte_carlo_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_monte_carlo_button.hide()
+        self.monte_carlo_progress = QtWidgets.QProgressBar()
+        self.monte_carlo_progress.setFormat('%v / %m iterations')
+        self.monte_carlo_progress.hide()
+        self.monte_carlo_table = MonteCarloTable()
+        self.monte_carlo_table.hide()
+        self.monte_carlo_statistics = None
+        self.monte_carlo_run = None
+        self.monte_carlo_thread = MonteCarloThread()
+
+        self.scenario_table_label = QtWidgets.QLabel('No scenario table loaded')
+        self.load_scenarios_button = QtWidgets.QPushButton('Load scenario table')
+        self.load_scenarios_button.setToolTip(
+            'CSV or Excel file with the columns "from database", "from code", "to database", '
+            '"to code" and one column of exchange amounts per scenario')
+        self.scenarios_button = QtWidgets.QPushButton('Run scenarios')
+        self.scenarios_button.setEnabled(False)
+        self.cancel_scenarios_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_scenarios_button.hide()
+        self.scenarios_progress = QtWidgets.QProgressBar()
+        self.scenarios_progress.setFormat('%v / %m scenarios')
+        self.scenarios_progress.hide()
+        self.scenario_results_table = ScenarioTable()
+        self.scenario_results_table.hide()
+        self.scenarios = None
+        self.scenario_lca = None
+        self.scenario_thread = ScenarioThread()
+
+        self.sensitivity_func_unit = QtWidgets.QComboBox()
+        self.sensitivity_samples = QtWidgets.QSpinBox()
+        self.sensitivity_samples.setRange(16, 100000)
+        self.sensitivity_samples.setValue(512)
+        self.sensitivity_samples.setToolTip(
+            'Number of base samples N; the model is evaluated N * (parameters + 2) times')
+        self.sensitivity_parameters = QtWidgets.QSpinBox()
+        self.sensitivity_parameters.setRange(1, 1000)
+        self.sensitivity_parameters.setValue(50)
+        self.sensitivity_parameters.setToolTip(
+            'Largest number of uncertain parameters kept by the screening')
+        self.sensitivity_button = QtWidgets.QPushButton('Run sensitivity analysis')
+        self.cancel_sensitivity_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_sensitivity_button.hide()
+        self.sensitivity_progress = QtWidgets.QProgressBar()
+        self.sensitivity_progress.setFormat('%v / %m samples')
+        self.sensitivity_progress.hide()
+        self.sensitivity_table = SensitivityTable()
+        self.sensitivity_table.hide()
+        self.sensitivity_thread = SensitivityThread()
+
         self.scroll_area = QtWidgets.QScrollArea()
         self.scroll_widget = QtWidgets.QWidget()
         self.scroll_widget_layout = QtWidgets.QVBoxLayout()
@@ -41,6 +117,9 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
         self.scroll_area.setWidget(self.scroll_widget)
         self.scroll_area.setWidgetResizable(True)
 
+        self.calculation_queue = collections.deque()
+        self.calculation_thread = LCACalculationThread()
+
         self.layout = QtWidgets.QVBoxLayout()
 
         self.make_layout()
@@ -52,12 +131,40 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
 
     def connect_signals(self):
         signals.project_selected.connect(self.remove_tab)
+        signals.project_selected.connect(self.cancel_calculation)
         signals.lca_calculation.connect(self.calculate)
+        signals.cancel_lca_calculation.connect(self.cancel_calculation)
+        signals.database_changed.connect(result_cache.invalidate_database)
+        signals.delete_database.connect(result_cache.invalidate_database)
+        signals.delete_calculation_setup.connect(result_cache.invalidate_calculation_setup)
+        self.calculation_thread.calculation_finished.connect(self.show_results)
+        self.calculation_thread.finished.connect(self.start_next_calculation)
         self.combo_LCIA_methods.currentTextChanged.connect(
             lambda name: self.get_contribution_analyses(method=name))
+        self.combo_grouping.currentTextChanged.connect(
+            lambda _: self.get_contribution_analyses(method=self.combo_LCIA_methods.currentText()))
         self.to_clipboard_button.clicked.connect(self.results_table.to_clipboard)
         self.to_csv_button.clicked.connect(self.results_table.to_csv)
         self.to_excel_button.clicked.connect(self.results_table.to_excel)
+        self.monte_carlo_button.clicked.connect(self.run_monte_carlo)
+        self.cancel_monte_carlo_button.clicked.connect(self.cancel_monte_carlo)
+        signals.project_selected.connect(self.cancel_monte_carlo)
+        self.monte_carlo_thread.statistics_updated.connect(self.show_monte_carlo_statistics)
+        self.monte_carlo_thread.calculation_failed.connect(self.monte_carlo_failed)
+        self.monte_carlo_thread.finished.connect(self.monte_carlo_finished)
+        self.load_scenarios_button.clicked.connect(self.load_scenarios)
+        self.scenarios_button.clicked.connect(self.run_scenarios)
+        self.cancel_scenarios_button.clicked.connect(self.cancel_scenarios)
+        signals.project_selected.connect(self.cancel_scenarios)
+        self.scenario_thread.progress.connect(self.scenarios_progress_changed)
+        self.scenario_thread.calculation_finished.connect(self.show_scenario_results)
+        self.scenario_thread.finished.connect(self.scenarios_finished)
+        self.sensitivity_button.clicked.connect(self.run_sensitivity_analysis)
+        self.cancel_sensitivity_button.clicked.connect(self.cancel_sensitivity_analysis)
+        signals.project_selected.connect(self.cancel_sensitivity_analysis)
+        self.sensitivity_thread.progress.connect(self.sensitivity_progress_changed)
+        self.sensitivity_thread.calculation_finished.connect(self.show_sensitivity_indices)
+        self.sensitivity_thread.finished.connect(self.sensitivity_analysis_finished)
 
     def make_layout(self):
         # Display the information in the scroll widget
@@ -68,6 +175,11 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
         self.scroll_widget_layout.addWidget(header("Process Contributions:"))
         self.scroll_widget_layout.addWidget(horizontal_line())
         self.scroll_widget_layout.addWidget(self.combo_LCIA_methods)
+        grouping_row = QtWidgets.QHBoxLayout()
+        grouping_row.addWidget(QtWidgets.QLabel('Contributions by:'))
+        grouping_row.addWidget(self.combo_grouping)
+        grouping_row.addStretch()
+        self.scroll_widget_layout.addLayout(grouping_row)
         self.scroll_widget_layout.addWidget(self.process_contribution_plot)
 
         self.scroll_widget_layout.addWidget(header("Elementary Flow Contributions:"))
@@ -89,6 +201,51 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
         self.buttons.addStretch()
         self.scroll_widget_layout.addLayout(self.buttons)
 
+        self.scroll_widget_layout.addWidget(header("Monte Carlo:"))
+        self.scroll_widget_layout.addWidget(horizontal_line())
+        monte_carlo_row = QtWidgets.QHBoxLayout()
+        monte_carlo_row.addWidget(QtWidgets.QLabel('Iterations:'))
+        monte_carlo_row.addWidget(self.monte_carlo_iterations)
+        monte_carlo_row.addWidget(QtWidgets.QLabel('Sampling:'))
+        monte_carlo_row.addWidget(self.monte_carlo_sampling)
+        monte_carlo_row.addWidget(QtWidgets.QLabel('Tolerance:'))
+        monte_carlo_row.addWidget(self.monte_carlo_tolerance)
+        monte_carlo_row.addWidget(self.monte_carlo_button)
+        monte_carlo_row.addWidget(self.monte_carlo_progress)
+        monte_carlo_row.addWidget(self.cancel_monte_carlo_button)
+        monte_carlo_row.addWidget(self.monte_carlo_status)
+        monte_carlo_row.addStretch()
+        self.scroll_widget_layout.addLayout(monte_carlo_row)
+        self.scroll_widget_layout.addWidget(self.monte_carlo_table)
+
+        self.scroll_widget_layout.addWidget(header("Scenarios:"))
+        self.scroll_widget_layout.addWidget(horizontal_line())
+        scenario_row = QtWidgets.QHBoxLayout()
+        scenario_row.addWidget(self.load_scenarios_button)
+        scenario_row.addWidget(self.scenario_table_label)
+        scenario_row.addWidget(self.scenarios_button)
+        scenario_row.addWidget(self.scenarios_progress)
+        scenario_row.addWidget(self.cancel_scenarios_button)
+        scenario_row.addStretch()
+        self.scroll_widget_layout.addLayout(scenario_row)
+        self.scroll_widget_layout.addWidget(self.scenario_results_table)
+
+        self.scroll_widget_layout.addWidget(header("Global Sensitivity Analysis:"))
+        self.scroll_widget_layout.addWidget(horizontal_line())
+        sensitivity_row = QtWidgets.QHBoxLayout()
+        sensitivity_row.addWidget(QtWidgets.QLabel('Functional unit:'))
+        sensitivity_row.addWidget(self.sensitivity_func_unit)
+        sensitivity_row.addWidget(QtWidgets.QLabel('Samples:'))
+        sensitivity_row.addWidget(self.sensitivity_samples)
+        sensitivity_row.addWidget(QtWidgets.QLabel('Parameters:'))
+        sensitivity_row.addWidget(self.sensitivity_parameters)
+        sensitivity_row.addWidget(self.sensitivity_button)
+        sensitivity_row.addWidget(self.sensitivity_progress)
+        sensitivity_row.addWidget(self.cancel_sensitivity_button)
+        sensitivity_row.addStretch()
+        self.scroll_widget_layout.addLayout(sensitivity_row)
+        self.scroll_widget_layout.addWidget(self.sensitivity_table)
+
     def add_tab(self):
         if not self.visible:
             self.visible = True
@@ -101,16 +258,42 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
             self.panel.removeTab(self.panel.indexOf(self))
 
     def calculate(self, name):
+        """Queue the calculation setup; calculations run one after another in a worker thread."""
+        if name not in self.calculation_queue:
+            self.calculation_queue.append(name)
+        self.start_next_calculation()
+
+    def start_next_calculation(self):
+        if self.calculation_queue and not self.calculation_thread.isRunning():
+            self.calculation_thread.update_params(
+                self.calculation_queue.popleft(), ab_settings.settings.get('lca_processes', 1),
+                getattr(self, 'mlca', None))
+            self.calculation_thread.start()
+
+    def cancel_calculation(self):
+        self.calculation_queue.clear()
+        self.calculation_thread.cancel_sentinel = True
+
+    def show_results(self, mlca):
         # LCA Results Analysis: (ideas to implement)
         # - LCA score: Barchart (choice LCIA method)
         # - Contribution Analysis (choice process, LCIA method;
         #   THEN BY process, product, geography, ISIC sector)
         #   ALSO: Type of graph: Barchart, Treemap, Piechart, Worldmap (for geo)
         #   CUTOFF
-        # - Uncertainties: Monte Carlo, Latin-Hypercube
 
-        # Multi-LCA calculation
-        self.mlca = MLCA(name)
+        # Multi-LCA calculation (done in LCACalculationThread)
+        self.mlca = mlca
+        self.cancel_monte_carlo()
+        self.reset_monte_carlo()
+        self.cancel_scenarios()
+        self.scenario_lca = None
+        self.scenario_results_table.hide()
+        self.cancel_sensitivity_analysis()
+        self.sensitivity_table.hide()
+        self.sensitivity_func_unit.clear()
+        self.sensitivity_func_unit.addItems(
+            [str(bw.get_activity(next(iter(func_unit)))) for func_unit in mlca.func_units])
         single_lca = len(self.mlca.func_units) == 1
 
         # update LCIA methods combobox
@@ -138,6 +321,7 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
         self.results_table.sync(self.mlca)
 
         self.add_tab()
+        signals.lca_calculation_finished.emit(self.mlca.cs_name)
 
     def get_contribution_analyses(self, method=None):
         if not method:
@@ -145,5 +329,342 @@ class ImpactAssessmentTab(QtWidgets.QWidget):
         else:
             method = self.dict_LCIA_methods_str_tuples[method]
 
-        self.process_contribution_plot.plot(self.mlca, method=method)
+        grouping = self.combo_grouping.currentText()
+        self.process_contribution_plot.plot(
+            self.mlca, method=method, grouping=None if grouping == 'process' else grouping)
         self.elementary_flow_contribution_plot.plot(self.mlca, method=method)
+        self.update_monte_carlo_table()
+        self.update_scenario_table()
+
+    def run_monte_carlo(self):
+        if self.monte_carlo_thread.isRunning():
+            return
+        self.monte_carlo_thread.update_params(
+            self.mlca.cs_name, self.monte_carlo_iterations.value(),
+            ab_settings.settings.get('lca_processes', 1),
+            self.monte_carlo_sampling.currentText(), self.monte_carlo_tolerance.value() / 100)
+        self.reset_monte_carlo()
+        self.monte_carlo_run = self.monte_carlo_thread.run_id
+        self.monte_carlo_status.clear()
+        self.monte_carlo_progress.setMaximum(self.monte_carlo_iterations.value())
+        self.monte_carlo_progress.setValue(0)
+        self.monte_carlo_progress.show()
+        self.cancel_monte_carlo_button.show()
+        self.monte_carlo_button.setEnabled(False)
+        self.monte_carlo_thread.start()
+
+    def cancel_monte_carlo(self):
+        self.monte_carlo_thread.cancel_sentinel = True
+
+    def reset_monte_carlo(self):
+        """Discard the statistics shown and any that are still emitted by the running analysis."""
+        self.monte_carlo_run = None
+        self.monte_carlo_statistics = None
+        self.monte_carlo_table.hide()
+
+    def monte_carlo_finished(self):
+        self.monte_carlo_progress.hide()
+        self.cancel_monte_carlo_button.hide()
+        self.monte_carlo_button.setEnabled(True)
+        status = [self.monte_carlo_thread.notice] if self.monte_carlo_thread.notice else []
+        if self.monte_carlo_thread.converged and self.monte_carlo_statistics is not None:
+            status.append(
+                'Converged after {} iterations.'.format(self.monte_carlo_statistics.count))
+        if status:
+            self.monte_carlo_status.setText(' '.join(status))
+
+    def monte_carlo_failed(self, run_id, error):
+        if run_id != self.monte_carlo_run:
+            return
+        self.reset_monte_carlo()
+        self.monte_carlo_status.setText('The Monte Carlo analysis failed')
+        QtWidgets.QMessageBox.warning(self, 'Monte Carlo analysis failed', error)
+
+    def show_monte_carlo_statistics(self, run_id, setup, statistics):
+        """Show the statistics of the current run, if it analysed the functional units and methods
+        that are shown."""
+        if run_id != self.monte_carlo_run:
+            return
+        if setup != (self.mlca.func_units, self.mlca.methods):
+            self.cancel_monte_carlo()
+            self.reset_monte_carlo()
+            self.monte_carlo_status.setText('The calculation setup changed, recalculate it first')
+            return
+        self.monte_carlo_statistics = statistics
+        self.monte_carlo_progress.setValue(statistics.count)
+        self.update_monte_carlo_table()
+
+    def update_monte_carlo_table(self):
+        if self.monte_carlo_statistics is None:
+            return
+        method = self.dict_LCIA_methods_str_tuples.get(
+            self.combo_LCIA_methods.currentText(), self.mlca.methods[0])
+        self.monte_carlo_table.sync(self.mlca, self.monte_carlo_statistics, method)
+        self.monte_carlo_table.show()
+
+    def load_scenarios(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, 'Select a scenario table', filter='Scenario tables (*.csv *.xls *.xlsx)')
+        if not path:
+            return
+        try:
+            self.scenarios = read_scenarios(path)
+        except Exception as e:
+            QtWidgets.QMessageBox.warning(self, 'Invalid scenario table', str(e))
+            return
+        self.scenario_table_label.setText('{} ({} exchanges, {} scenarios)'.format(
+            path, len(self.scenarios), len(self.scenarios.columns) - len(KEY_COLUMNS)))
+        self.scenarios_button.setEnabled(True)
+
+    def run_scenarios(self):
+        if self.scenario_thread.isRunning() or self.scenarios is None:
+            return
+        self.scenario_thread.update_params(
+            self.mlca.cs_name, self.scenarios, ab_settings.settings.get('lca_processes', 1))
+        self.scenarios_progress.setValue(0)
+        self.scenarios_progress.show()
+        self.cancel_scenarios_button.show()
+        self.scenarios_button.setEnabled(False)
+        self.scenario_thread.start()
+
+    def cancel_scenarios(self):
+        self.scenario_thread.cancel_sentinel = True
+
+    def scenarios_progress_changed(self, done, total):
+        self.scenarios_progress.setMaximum(total)
+        self.scenarios_progress.setValue(done)
+
+    def scenarios_finished(self):
+        self.scenarios_progress.hide()
+        self.cancel_scenarios_button.hide()
+        self.scenarios_button.setEnabled(True)
+        if self.scenario_thread.error:
+            QtWidgets.QMessageBox.warning(
+                self, 'Scenario calculation failed', self.scenario_thread.error)
+
+    def show_scenario_results(self, scenario_lca):
+        if scenario_lca.cs_name != self.mlca.cs_name:
+            return
+        self.scenario_lca = scenario_lca
+        self.update_scenario_table()
+
+    def update_scenario_table(self):
+        if self.scenario_lca is None:
+            return
+        method = self.dict_LCIA_methods_str_tuples.get(
+            self.combo_LCIA_methods.currentText(), self.mlca.methods[0])
+        self.scenario_results_table.sync(self.scenario_lca, method)
+        self.scenario_results_table.show()
+
+    def run_sensitivity_analysis(self):
+        if self.sensitivity_thread.isRunning():
+            return
+        method = self.dict_LCIA_methods_str_tuples.get(
+            self.combo_LCIA_methods.currentText(), self.mlca.methods[0])
+        self.sensitivity_thread.update_params(
+            self.mlca.cs_name, self.sensitivity_func_unit.currentIndex(), method,
+            self.sensitivity_samples.value(), self.sensitivity_parameters.value(),
+            ab_settings.settings.get('lca_processes', 1))
+        self.sensitivity_progress.setMaximum(self.sensitivity_samples.value())
+        self.sensitivity_progress.setValue(0)
+        self.sensitivity_progress.show()
+        self.cancel_sensitivity_button.show()
+        self.sensitivity_button.setEnabled(False)
+        self.sensitivity_thread.start()
+
+    def cancel_sensitivity_analysis(self):
+        self.sensitivity_thread.cancel_sentinel = True
+
+    def sensitivity_progress_changed(self, done, total):
+        self.sensitivity_progress.setMaximum(total)
+        self.sensitivity_progress.setValue(done)
+
+    def sensitivity_analysis_finished(self):
+        self.sensitivity_progress.hide()
+        self.cancel_sensitivity_button.hide()
+        self.sensitivity_button.setEnabled(True)
+
+    def show_sensitivity_indices(self, cs_name, indices):
+        if cs_name != self.mlca.cs_name:
+            return
+        self.sensitivity_table.sync(indices)
+        self.sensitivity_table.show()
+
+
+class LCACanceledError(Exception):
+    pass
+
+
+class LCACalculationThread(QtCore.QThread):
+    """Calculates the MLCA of a calculation setup without blocking the GUI.
+
+    Results of unchanged calculation setups, databases and methods are loaded from the result cache.
+    If the previous results belong to the same calculation setup, they are updated incrementally.
+    Lazily calculated results are not cached, as they contain no contributions yet.
+    """
+    calculation_finished = QtCore.pyqtSignal(object)
+
+    def update_params(self, cs_name, processes=1, previous=None):
+        self.cs_name = cs_name
+        self.processes = processes
+        self.previous = previous
+        self.cancel_sentinel = False
+        self.storage = {
+            'contribution_dtype': ab_settings.settings.get(
+                'contribution_precision', MLCA.PRECISIONS[0]),
+            'contribution_directory': MLCA.storage_directory(
+                ab_settings.settings.get('contribution_storage', MLCA.STORAGE[0])),
+        }
+        self.lazy = ab_settings.settings.get('lazy_contributions', False)
+        self.contribution_memory = (
+            ab_settings.settings.get('contribution_memory', 0) * 1024 ** 2 or None)
+
+    def can_update(self, mlca):
+        """Whether ``mlca`` belongs to the same calculation setup and uses the current storage
+        settings."""
+        return (mlca is not None and mlca.cs_name == self.cs_name and
+                mlca.contribution_dtype == self.storage['contribution_dtype'] and
+                mlca.contribution_directory == self.storage['contribution_directory'] and
+                mlca.lazy == self.lazy)
+
+    def run(self):
+        try:
+            mlca = result_cache.load(self.cs_name, **self.storage)
+            if mlca is None:
+                if self.can_update(self.previous):
+                    mlca = self.previous.copy()
+                    mlca.progress = self.progress
+                    mlca.processes = self.processes
+                    mlca.contribution_memory = self.contribution_memory
+                    mlca.update()
+                else:
+                    mlca = MLCA(self.cs_name, processes=self.processes, progress=self.progress,
+                                lazy=self.lazy, contribution_memory=self.contribution_memory,
+                                **self.storage)
+                if not mlca.lazy:
+                    result_cache.save(mlca)
+        except LCACanceledError:
+            print('LCA calculation of {} canceled.'.format(self.cs_name))
+            signals.lca_calculation_finished.emit(self.cs_name)
+        except Exception:
+            signals.lca_calculation_finished.emit(self.cs_name)
+            raise
+        else:
+            self.calculation_finished.emit(mlca)
+
+    def progress(self, done, total):
+        if self.cancel_sentinel:
+            raise LCACanceledError
+        signals.lca_calculation_progress.emit(self.cs_name, done, total)
+
+
+class MonteCarloThread(QtCore.QThread):
+    """Runs a Monte Carlo analysis of a calculation setup; the running statistics are emitted
+    after every chunk.
+
+    Every run gets a new ``run_id``, which is emitted with the functional units and methods that
+    were analysed, so statistics of an earlier run or another setup can be told apart. If the
+    analysis fails, ``calculation_failed`` is emitted with the ``run_id`` and the error message.
+    """
+    statistics_updated = QtCore.pyqtSignal(int, object, object)
+    calculation_failed = QtCore.pyqtSignal(int, str)
+    cancel_sentinel = False
+    converged = False
+    notice = None
+    run_id = 0
+
+    def update_params(self, cs_name, iterations, processes=1, sampling='random', tolerance=None):
+        self.run_id += 1
+        self.cs_name = cs_name
+        self.iterations = iterations
+        self.processes = processes
+        self.sampling = sampling
+        self.tolerance = tolerance
+        self.cancel_sentinel = False
+        self.converged = False
+        self.notice = None
+
+    def run(self):
+        try:
+            monte_carlo = MonteCarloMLCA(self.cs_name, self.sampling)
+            self.notice = monte_carlo.notice
+            statistics = RunningStatistics(monte_carlo.shape)
+            setup = (monte_carlo.func_units, monte_carlo.methods)
+            chunks = monte_carlo.chunks(self.iterations, processes=self.processes)
+            try:
+                for samples in chunks:
+                    if self.cancel_sentinel:
+                        print('Monte Carlo analysis of {} canceled.'.format(self.cs_name))
+                        break
+                    statistics.update(samples)
+                    self.statistics_updated.emit(self.run_id, setup, statistics.copy())
+                    if self.tolerance and statistics.converged(self.tolerance):
+                        self.converged = True
+                        break
+            finally:
+                chunks.close()  # stops the worker processes
+        except Exception as e:
+            self.calculation_failed.emit(self.run_id, '{}: {}'.format(type(e).__name__, e))
+
+
+class ScenarioThread(QtCore.QThread):
+    """Calculates the scenarios of a scenario table for a calculation setup."""
+    progress = QtCore.pyqtSignal(int, int)
+    calculation_finished = QtCore.pyqtSignal(object)
+    cancel_sentinel = False
+    error = None
+
+    def update_params(self, cs_name, scenarios, processes=1):
+        self.cs_name = cs_name
+        self.scenarios = scenarios
+        self.processes = processes
+        self.cancel_sentinel = False
+        self.error = None
+
+    def run(self):
+        try:
+            scenario_lca = ScenarioMLCA(self.cs_name, self.scenarios)
+            scenario_lca.calculate(self.processes, progress=self.report_progress)
+        except LCACanceledError:
+            print('Scenario calculation of {} canceled.'.format(self.cs_name))
+        except ValueError as e:
+            self.error = str(e)
+        else:
+            self.calculation_finished.emit(scenario_lca)
+
+    def report_progress(self, done, total):
+        if self.cancel_sentinel:
+            raise LCACanceledError
+        self.progress.emit(done, total)
+
+
+class SensitivityThread(QtCore.QThread):
+    """Estimates the Sobol indices of the uncertain parameters of one functional unit and method."""
+    progress = QtCore.pyqtSignal(int, int)
+    calculation_finished = QtCore.pyqtSignal(str, object)
+    cancel_sentinel = False
+
+    def update_params(self, cs_name, func_unit, method, samples, max_parameters=50, processes=1):
+        self.cs_name = cs_name
+        self.func_unit = func_unit
+        self.method = method
+        self.samples = samples
+        self.max_parameters = max_parameters
+        self.processes = processes
+        self.cancel_sentinel = False
+
+    def run(self):
+        try:
+            gsa = SobolGSA(self.cs_name, self.func_unit, self.method,
+                           max_parameters=self.max_parameters)
+            indices = gsa.calculate(self.samples, processes=self.processes,
+                                    progress=self.report_progress)
+        except LCACanceledError:
+            print('Sensitivity analysis of {} canceled.'.format(self.cs_name))
+        else:
+            self.calculation_finished.emit(self.cs_name, indices)
+
+    def report_progress(self, done, total):
+        if self.cancel_sentinel:
+            raise LCACanceledError
+        self.progress.emit(done, total)
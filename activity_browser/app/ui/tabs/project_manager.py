@@ -50,7 +50,7 @@ class ProjectTab(QtWidgets.QWidget):
         signals.database_selected.connect(self.update_widgets)
 
     def change_project(self):
-        self.activities_widget.table.setRowCount(0)
+        self.activities_widget.table.activities_model.clear()
         self.flows_widget.table.setRowCount(0)
         self.update_widgets()
 
@@ -58,7 +58,7 @@ class ProjectTab(QtWidgets.QWidget):
         """Update widgets when a new database has been selected or the project has been changed.
         Hide empty widgets (e.g. Biosphere Flows table when an inventory database is selected)."""
         no_databases = self.databases_widget.table.rowCount() == 0
-        no_activities = self.activities_widget.table.rowCount() == 0
+        no_activities = self.activities_widget.table.activities_model.size() == 0
         no_biosphere_flows = self.flows_widget.table.rowCount() == 0
 
         self.databases_widget.update_widget()
@@ -33,33 +33,58 @@ function style(d) {
     return (d.data || {}).style;
 }
 
-function update_sankey(json_data){
+// the diagram as shown, with nodes and links in the order they were added, so that the
+// layout only changes where the diagram changed
+var graph = {nodes: [], links: []};
+
+function apply_delta(delta_json){
+    var delta = JSON.parse(delta_json);
+    if (delta.reset) {
+        graph = {nodes: [], links: []};
+    }
+    var removed_links = {}, removed_nodes = {}, colors = {};
+    delta.remove_links.forEach(function(id) { removed_links[id] = true; });
+    delta.remove_nodes.forEach(function(id) { removed_nodes[id] = true; });
+    delta.colors.forEach(function(pair) { colors[pair[0]] = pair[1]; });
+    graph.links = graph.links.filter(function(l) { return !removed_links[l.id]; });
+    graph.nodes = graph.nodes.filter(function(n) { return !removed_nodes[n.id]; });
+    graph.links.forEach(function(l) {
+        if (l.id in colors) { l.color = colors[l.id]; }
+    });
+    graph.nodes = graph.nodes.concat(delta.add_nodes);
+    graph.links = graph.links.concat(delta.add_links);
+    update_sankey();
+};
+
+function update_sankey(){
     diagram.width(windowSize()[0]).height(windowSize()[1]);
-    var json_data = JSON.parse(json_data)
     // update sankey with new data
     var sankey = d3.select('#sankey')
-        .data([json_data])
+        .data([graph])
         .call(diagram)
         .select('svg')
             .attr("width", '100%')
             .attr("height", '100%')
             .attr('viewBox','0 0 '+windowSize()[0]+' '+windowSize()[1])
             .attr('preserveAspectRatio','none')
-    // move mouseover element to front and display tooltip 
+    // move mouseover element to front and display tooltip, fetched from python on hover
     sankey.selectAll('.link')
         .on('mouseover', function(d) {
             d3.select(this).moveToFront();
-            div.transition()		
-                .duration(200)		
-                .style("opacity", .9);		
-            div	.html(d.data.tooltip)	
-                .style("left", (d3.event.pageX) + "px")		
-                .style("top", (d3.event.pageY - 28) + "px");	
+            var x = d3.event.pageX, y = d3.event.pageY;
+            window.bridge.link_tooltip(d.data.id, function(tooltip) {
+                div.transition()
+                    .duration(200)
+                    .style("opacity", .9);
+                div	.html(tooltip)
+                    .style("left", x + "px")
+                    .style("top", (y - 28) + "px");
+            });
         })
-        .on("mouseout", function(d) {		
-            div.transition()		
-                .duration(500)		
-                .style("opacity", 0);	
+        .on("mouseout", function(d) {
+            div.transition()
+                .duration(500)
+                .style("opacity", 0);
         });
     // brute force removal of link titles that show up as svg tooltips
     sankey.selectAll('title').remove()
@@ -72,17 +97,13 @@ function update_sankey(json_data){
 
 new QWebChannel(qt.webChannelTransport, function (channel) {
     window.bridge = channel.objects.bridge;
-    window.bridge.sankey_ready.connect(update_sankey);
+    window.bridge.sankey_delta.connect(apply_delta);
     window.bridge.viewer_ready();
 });
 
 
 diagram.on("selectLink", function(link){
     if (link != null){
-        new QWebChannel(qt.webChannelTransport, function (channel) {
-            window.bridge = channel.objects.bridge;
-            window.bridge.lca_calc_finished.connect(update_sankey);
-            window.bridge.link_selected(String(link.id));
-            });
+        window.bridge.link_selected(String(link.id));
     }
 });
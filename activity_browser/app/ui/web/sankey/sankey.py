@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
 import os
 import json
+import itertools
 import collections
+from html import escape
 
 import numpy as np
 import brightway2 as bw
 import matplotlib.pyplot as plt
 from PyQt5 import QtWidgets, QtCore, QtWebEngineWidgets, QtWebChannel
 
+from ....bwutils.factorization import factorized_systems
+from ....bwutils.metadata import activity_metadata
+from ...widgets import SupplyChainTree
 from .signals import sankeysignals
-from .worker_threads import gt_worker_thread
+from .worker_threads import traversal_jobs
 
 
 class SankeyWidget(QtWidgets.QWidget):
@@ -51,11 +56,18 @@ class SankeyWidget(QtWidgets.QWidget):
         self.cutoff_sb.setValue(0.005)
         self.cutoff_sb.setKeyboardTracking(False)
         self.grid_lay.addWidget(self.cutoff_sb, 1, 3)
+        self.prefetch_cb = QtWidgets.QCheckBox('prefetch other diagrams')
+        self.prefetch_cb.setToolTip(
+            'Traverse the other functional units and methods in the background after the\n'
+            'diagram is drawn, so that switching to them is instant.')
+        self.prefetch_cb.setChecked(True)
+        self.grid_lay.addWidget(self.prefetch_cb, 2, 2, 1, 2)
         self.hlay = QtWidgets.QHBoxLayout()
         self.hlay.addLayout(self.grid_lay)
 
         # qt js interaction
         self.bridge = Bridge()
+        self.bridge.tooltip = self.link_tooltip
         self.bridge.viewer_waiting.connect(self.send_json)
         self.bridge.link_clicked.connect(self.expand_sankey)
 
@@ -72,24 +84,35 @@ class SankeyWidget(QtWidgets.QWidget):
         self.view.load(self.wait_url)
         self.vlay = QtWidgets.QVBoxLayout()
         self.vlay.addLayout(self.hlay)
-        self.vlay.addWidget(self.view)
+        self.tree = SupplyChainTree()
+        self.splitter = QtWidgets.QSplitter()
+        self.splitter.addWidget(self.tree)
+        self.splitter.addWidget(self.view)
+        self.splitter.setStretchFactor(1, 2)
+        self.vlay.addWidget(self.splitter)
         self.setLayout(self.vlay)
 
-        # sankey
+        # sankey: the graph traversals share the factorized system of the calculation setup
         demand_all = dict(collections.ChainMap(*self.func_units))
-        self.lca = bw.LCA(demand_all, bw.methods.random())
-        self.lca.lci()
-        self.lca.lcia()
+        self.system = factorized_systems.get(demand_all)
+        self.job = None
+        self.expansion_job = None
+        self.prefetch_jobs = set()
+        self.prefetch_cutoff = None
         self.new_sankey()
 
         self.func_unit_cb.currentIndexChanged.connect(self.new_sankey)
         self.method_cb.currentIndexChanged.connect(self.new_sankey)
         self.color_attr_cb.currentIndexChanged.connect(self.update_colors)
         self.cutoff_sb.valueChanged.connect(self.new_sankey)
+        self.prefetch_cb.toggled.connect(self.toggle_prefetch)
 
         # connections
         sankeysignals.calculating_gt.connect(self.busy_indicator)
         sankeysignals.initial_sankey_ready.connect(self.draw_sankey)
+        traversal_jobs.traversal_finished.connect(self.traversal_ready)
+        traversal_jobs.expansion_finished.connect(self.expansion_ready)
+        traversal_jobs.traversal_failed.connect(self.traversal_failed)
 
     def new_sankey(self):
         sankeysignals.calculating_gt.emit()
@@ -97,26 +120,110 @@ class SankeyWidget(QtWidgets.QWidget):
         method = self.methods[self.method_cb.currentIndex()]
         color_attr = self.color_attr_cb.currentText()
         cutoff = self.cutoff_sb.value()
+        if cutoff != self.prefetch_cutoff:
+            self.cancel_prefetch()
+        for job in (self.job, self.expansion_job):
+            if job is not None:
+                traversal_jobs.cancel(job)
+        self.expansion_job = None
         self.sankey = SankeyGraphTraversal(demand, method, cutoff, color_attr)
+        self.job = traversal_jobs.submit(
+            self.sankey.demand, method, cutoff, SankeyGraphTraversal.TIME_LIMIT)
+
+    def traversal_ready(self, job, gt):
+        self.prefetch_jobs.discard(job)
+        if job != self.job:
+            return  # a result of an earlier request, or a prefetch
+        self.job = None
+        self.sankey.init_graph(gt)
+        self.prefetch()
+
+    def traversal_failed(self, job, error):
+        self.prefetch_jobs.discard(job)
+        if job == self.job:
+            self.job = None
+            self.view.setHtml('<p>The supply chain could not be traversed: {}</p>'.format(
+                escape(error)))
+        elif job == self.expansion_job:
+            self.expansion_job = None
+            QtWidgets.QMessageBox.warning(
+                self, 'Expansion failed', 'The node could not be expanded: {}'.format(error))
+
+    def prefetch(self):
+        """Traverse the other functional units and methods at the current cutoff in the background.
+
+        The other methods of the current functional unit come first. No more diagrams are
+        prefetched than the traversal cache keeps.
+        """
+        cutoff = self.cutoff_sb.value()
+        if not self.prefetch_cb.isChecked() or cutoff == self.prefetch_cutoff:
+            return
+        self.prefetch_cutoff = cutoff
+        current = (self.func_unit_cb.currentIndex(), self.method_cb.currentIndex())
+        combinations = sorted(
+            itertools.product(range(len(self.func_units)), range(len(self.methods))),
+            key=lambda c: (c[0] != current[0], c[1] != current[1], c))
+        combinations.remove(current)
+        for fu, method in combinations[:traversal_jobs.CACHE_SIZE - 1]:
+            job = traversal_jobs.prefetch(self.func_units[fu], self.methods[method], cutoff,
+                                          SankeyGraphTraversal.TIME_LIMIT)
+            if job is not None:
+                self.prefetch_jobs.add(job)
+
+    def cancel_prefetch(self):
+        for job in self.prefetch_jobs:
+            if job != self.job:
+                traversal_jobs.cancel(job)
+        self.prefetch_jobs = set()
+        self.prefetch_cutoff = None
+
+    def toggle_prefetch(self, checked):
+        if not checked:
+            self.cancel_prefetch()
+        elif self.job is None:
+            self.prefetch()
 
     def update_colors(self):
         self.sankey.color_attr = self.color_attr_cb.currentText()
         self.sankey.colors()
-        self.sankey.to_json()
-        self.bridge.lca_calc_finished.emit(self.sankey.json_data)
+        self.bridge.sankey_delta.emit(self.sankey.delta())
 
     def draw_sankey(self):
         self.view.load(self.url)
+        self.tree.sync(self.sankey.analysis)
 
     def busy_indicator(self):
         self.view.load(self.wait_url)
 
     def expand_sankey(self, target_key):
+        if self.expansion_job is not None:
+            return
+        if self.sankey.needs_traversal(target_key):
+            self.expansion_job = traversal_jobs.expand(
+                self.sankey.analysis, target_key, self.sankey.EXPANSION_TIME_LIMIT)
+            return
+        self.sankey.merge_edges()
         self.sankey.expand(target_key)
-        self.bridge.lca_calc_finished.emit(self.sankey.json_data)
+        self.bridge.sankey_delta.emit(self.sankey.delta())
+
+    def expansion_ready(self, job, target_key):
+        if job != self.expansion_job:
+            return  # the diagram was replaced during the traversal
+        self.expansion_job = None
+        self.sankey.traversed.add(target_key)
+        self.sankey.merge_edges()
+        if target_key in self.sankey.expanded_nodes:
+            self.sankey.update()
+        else:
+            self.sankey.expand(target_key)
+        self.bridge.sankey_delta.emit(self.sankey.delta())
 
     def send_json(self):
-        self.bridge.sankey_ready.emit(self.sankey.json_data)
+        """Send the whole diagram to a viewer that was (re)loaded."""
+        self.bridge.sankey_delta.emit(self.sankey.delta(reset=True))
+
+    def link_tooltip(self, edge):
+        return self.sankey.link_tooltip(edge)
 
     def switch_to_main(self):
         window = self.window()
@@ -124,10 +231,22 @@ class SankeyWidget(QtWidgets.QWidget):
 
 
 class Bridge(QtCore.QObject):
+    """Connects the Sankey viewer with Python over the QWebChannel.
+
+    The viewer keeps the diagram and receives its changes with ``sankey_delta``, see
+    ``SankeyGraphTraversal.delta``. Tooltips are requested by the viewer when a link is hovered.
+    """
     link_clicked = QtCore.pyqtSignal(int)
-    lca_calc_finished = QtCore.pyqtSignal(str)
     viewer_waiting = QtCore.pyqtSignal()
-    sankey_ready = QtCore.pyqtSignal(str)
+    sankey_delta = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tooltip = lambda edge: ''
+
+    @QtCore.pyqtSlot(int, result=str)
+    def link_tooltip(self, edge):
+        return self.tooltip(edge)
 
     @QtCore.pyqtSlot(str)
     def link_selected(self, link):
@@ -142,58 +261,138 @@ class Bridge(QtCore.QObject):
 
 
 class SankeyGraphTraversal:
+    TIME_LIMIT = 0.25  # seconds of traversal before the diagram is drawn
+    EXPANSION_TIME_LIMIT = 0.25  # seconds of traversal below a clicked node
+
     def __init__(self, demand, method, cutoff=0.005, color_attr='flow'):
-        demand = {k: float(v) for k, v in demand.items()}
-        gt_worker_thread.update_params(demand, method, cutoff, max_calc=500)
+        self.demand = {k: float(v) for k, v in demand.items()}
+        self.method = method
+        self.cutoff = cutoff
         self.color_attr = color_attr
-        sankeysignals.gt_ready.connect(self.init_graph)
-        gt_worker_thread.start()
 
     def init_graph(self, gt):
         self.nodes = []
-        self.reverse_activity_dict = {v: k for k, v in
-                                      gt['lca'].activity_dict.items()}
-        self.edges = gt['edges']
+        self.analysis = gt['analysis']
+        self.reverse_activity_dict = self.analysis.reverse_activity_dict
         self.root_score = gt['nodes'][-1]['cum']
+        self.edges = []
+        self.inputs = collections.defaultdict(list)  # node: indices of the edges into it
+        self.references = collections.Counter()  # node: number of displayed links from it
+        self.displayed = {}  # edge index: link, in the order the links were displayed
+        self.link_cache = {}
+        self.tooltips = {}
+        self.sent_links = {}  # edge index: colour of the links the viewer has
+        self.sent_nodes = set()
         self.expanded_nodes = set()
+        self.position = 0
+        self.traversed = set()
+        self.merge_edges()
         self.expand(-1)
         if len(self.links) == 1:
             self.expand(self.links[0]['target'])
         sankeysignals.initial_sankey_ready.emit()
 
     def expand(self, ind):
+        """Show the inputs of node ``ind``, or hide them if they are shown."""
         if ind in self.expanded_nodes:
-            self.expanded_nodes.remove(ind)
-            self.remove_dangling_nodes()
+            self.collapse(ind)
         else:
             self.expanded_nodes.add(ind)
-        displayed_edges = [e for e in self.edges if
-                           e['to'] in self.expanded_nodes]
-        self.links = [{'source': e['to'],
-                       'target': e['from'],
-                       'value': e['impact'],
-                       'tooltip': self.tooltip(e)} for e in displayed_edges]
-        self.nodes_set = {li['source'] for li in self.links}.union(
-            {li['target'] for li in self.links})
+            for edge in self.inputs[ind]:
+                self.show_edge(edge)
+        self.update()
+
+    def collapse(self, ind):
+        """Hide the inputs of node ``ind`` and of the expanded nodes that are no longer
+        displayed."""
+        todo = [ind]
+        while todo:
+            node = todo.pop()
+            self.expanded_nodes.discard(node)
+            for edge in self.inputs[node]:
+                if self.displayed.pop(edge, None) is None:
+                    continue
+                source = self.edges[edge]['from']
+                self.references[source] -= 1
+                if not self.references[source]:
+                    del self.references[source]
+                    if source in self.expanded_nodes:
+                        todo.append(source)
+
+    def show_edge(self, edge):
+        if edge in self.displayed:
+            return
+        if edge not in self.link_cache:
+            e = self.edges[edge]
+            self.link_cache[edge] = {'id': edge,
+                                     'source': e['to'],
+                                     'target': e['from'],
+                                     'value': e['impact']}
+        self.displayed[edge] = self.link_cache[edge]
+        self.references[self.edges[edge]['from']] += 1
+
+    def update(self):
+        self.links = list(self.displayed.values())
+        self.nodes_set = set(self.references)
+        if self.links:
+            self.nodes_set.add(-1)
         self.nodes = [{'id': n, 'style': 'process'} for n in self.nodes_set]
         self.colors()
-        self.to_json()
-
-    def to_json(self):
-        sankey_dict = {'links': self.links, 'nodes': self.nodes}
-        self.json_data = json.dumps(sankey_dict)
-
-    def remove_dangling_nodes(self):
-        while True:
-            displayed_edges = [e for e in self.edges if
-                               e['to'] in self.expanded_nodes]
-            to = {e['to'] for e in displayed_edges}
-            from_ = {e['from'] for e in displayed_edges}
-            dangling = to.difference(from_)
-            dangling.remove(-1)
-            if not dangling:
-                break
-            self.expanded_nodes = self.expanded_nodes.difference(dangling)
+
+    def delta(self, reset=False):
+        """Return the changes of the diagram since the last delta as JSON.
+
+        The viewer removes the links and nodes in 'remove_links' and 'remove_nodes', appends
+        the ones in 'add_links' and 'add_nodes' and recolours the links in 'colors', so that
+        existing elements keep their order and the layout stays stable. With ``reset`` the delta
+        contains the whole diagram, for a viewer that starts empty. Links have the index of
+        their edge as 'id' and no tooltip, see ``link_tooltip``.
+        """
+        if reset:
+            self.sent_links, self.sent_nodes = {}, set()
+        new_nodes = []
+        for link in self.links:
+            for node in (link['source'], link['target']):
+                if node not in self.sent_nodes and node not in new_nodes:
+                    new_nodes.append(node)
+        delta = {
+            'reset': reset,
+            'remove_links': [edge for edge in self.sent_links if edge not in self.displayed],
+            'remove_nodes': [node for node in self.sent_nodes if node not in self.nodes_set],
+            'add_nodes': [{'id': node, 'style': 'process'} for node in new_nodes],
+            'add_links': [link for edge, link in self.displayed.items()
+                          if edge not in self.sent_links],
+            'colors': [[edge, link['color']] for edge, link in self.displayed.items()
+                       if edge in self.sent_links and self.sent_links[edge] != link['color']],
+        }
+        self.sent_links = {edge: link['color'] for edge, link in self.displayed.items()}
+        self.sent_nodes = set(self.nodes_set)
+        return json.dumps(delta)
+
+    def link_tooltip(self, edge):
+        """Return the tooltip of the link of edge ``edge``, built when it is first hovered."""
+        if edge not in self.tooltips:
+            self.tooltips[edge] = self.tooltip(self.edges[edge])
+        return self.tooltips[edge]
+
+    def needs_traversal(self, ind):
+        """Whether node ``ind`` has no inputs yet and was not traversed on demand before."""
+        if ind == -1 or ind in self.traversed:
+            return False
+        return not len(self.analysis.inputs.get(ind, ()))
+
+    def merge_edges(self):
+        """Add the edges the analysis found since the last merge, e.g. below clicked nodes.
+
+        New inputs of expanded nodes are displayed right away.
+        """
+        edges, self.position = self.analysis.edges_since(self.position)
+        activity_metadata.load(self.reverse_activity_dict[i] for i in edges['from'].tolist())
+        for edge in self.analysis.edge_dicts(edges):
+            self.inputs[edge['to']].append(len(self.edges))
+            self.edges.append(edge)
+            if edge['to'] in self.expanded_nodes:
+                self.show_edge(len(self.edges) - 1)
 
     def tooltip(self, edge):
         producer = self.get_bw_activity_by_index(edge['from'])
@@ -215,25 +414,18 @@ class SankeyGraphTraversal:
         if ind == -1:
             return {'name': 'Functional Unit', 'location': ''}
         key = self.reverse_activity_dict[ind]
-        return bw.get_activity(key)
+        return activity_metadata.get(key)
+
+    def color_label(self, ind):
+        activity = self.get_bw_activity_by_index(ind)
+        return activity.get(self.color_attr, activity.get('name', ''))
 
     def colors(self):
-        options = sorted(
-            {self.get_bw_activity_by_index(n).get(
-                self.color_attr,
-                self.get_bw_activity_by_index(n).get('name')
-            ) for n in self.nodes_set.difference({-1})
-            }
-        )
+        options = sorted({self.color_label(n) for n in self.nodes_set.difference({-1})})
         color_dict = {o: self.viridis_r_hex(v) for o, v in
                       zip(options, np.linspace(0, 1, len(options)))}
         for link in self.links:
-            link['color'] = color_dict[
-                self.get_bw_activity_by_index(link['target']).get(
-                    self.color_attr,
-                    self.get_bw_activity_by_index(link['target']).get('name', '')
-                )
-            ]
+            link['color'] = color_dict[self.color_label(link['target'])]
 
     @staticmethod
     def viridis_r_hex(v):
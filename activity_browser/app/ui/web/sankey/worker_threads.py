@@ -1,20 +1,238 @@
 # -*- coding: utf-8 -*-
-import brightway2 as bw
+import collections
+import itertools
+import threading
+import time
+import traceback
+
 from PyQt5 import QtCore
 
-from .signals import sankeysignals
+from ....bwutils.metadata import activity_metadata
+from ....bwutils.pathanalysis import PathAnalysis
+
 
+def load_metadata(analysis):
+    """Load the metadata of all traversed activities, so that drawing the diagram needs no
+    queries."""
+    activity_metadata.load(
+        analysis.reverse_activity_dict[index] for index in list(analysis.nodes) if index != -1)
 
-class GraphTraversalThread(QtCore.QThread):
-    def update_params(self, demand, method, cutoff, max_calc):
-        self.demand = demand
-        self.method = method
-        self.cutoff = cutoff
-        self.max_calc = max_calc
+
+class Job(QtCore.QRunnable):
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
 
     def run(self):
-        res = bw.GraphTraversal().calculate(self.demand, self.method, self.cutoff, self.max_calc)
-        sankeysignals.gt_ready.emit(res)
+        try:
+            self.function(*self.args)
+        except Exception:
+            traceback.print_exc()
+
+
+class TraversalJobs(QtCore.QObject):
+    """Runs Sankey traversals in a thread pool and keeps the latest ones.
+
+    Every request gets a job id, which is emitted with its result, so that a receiver can
+    ignore the results of requests it no longer waits for; ``cancel`` stops a job that is
+    queued or still traversing, and is ignored for jobs that finished. Finished traversals are
+    kept in an LRU cache keyed by (demand, method, cutoff), so that switching back to an earlier
+    diagram needs no traversal. The traversals of a cached ``PathAnalysis`` continue where they
+    stopped, e.g. below nodes that were expanded on demand.
+
+    ``prefetch`` traverses diagrams that may be requested later in a pool of a single thread.
+    The traversals hold the GIL most of the time, so a prefetch pauses between its slices while
+    requested traversals or expansions are running, instead of slowing them down. A request for
+    a diagram that is being prefetched takes over the prefetch job instead of traversing again.
+
+    A traversal that raises an exception emits ``traversal_failed`` with its job id and the error
+    message instead of a result.
+    """
+    traversal_finished = QtCore.pyqtSignal(int, object)
+    expansion_finished = QtCore.pyqtSignal(int, int)
+    traversal_failed = QtCore.pyqtSignal(int, str)
+    CACHE_SIZE = 16
+    SLICE = 0.05  # seconds of traversal between checks for cancellation
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool()
+        self.prefetch_pool = QtCore.QThreadPool()
+        self.prefetch_pool.setMaxThreadCount(1)
+        self.prefetching = {}  # key: (job id, runnable) of queued or running prefetches
+        self.background = set()  # ids of the prefetch jobs that were not requested yet
+        self.requests = 0  # requested traversals and expansions that are queued or running
+        self.cache = collections.OrderedDict()
+        self.pending = set()  # ids of the jobs that did not finish yet
+        self.cancelled = set()  # ids of pending jobs that were cancelled
+        self.lock = threading.Lock()
+        self.requests_done = threading.Condition(self.lock)
+        self.ids = itertools.count(1)
+
+    @staticmethod
+    def key(demand, method, cutoff):
+        return (tuple(sorted((tuple(getattr(key, 'key', key)), float(amount))
+                             for key, amount in demand.items())),
+                tuple(method), float(cutoff))
+
+    def cached(self, demand, method, cutoff):
+        """Return the cached traversal of (demand, method, cutoff), or None."""
+        key = self.key(demand, method, cutoff)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+    def submit(self, demand, method, cutoff, time_limit):
+        """Start a traversal and return its job id; ``traversal_finished`` is emitted with the id
+        and the result, right away for cached traversals."""
+        result = self.cached(demand, method, cutoff)
+        if result is not None:
+            job = next(self.ids)
+            with self.lock:
+                self.pending.add(job)
+            QtCore.QTimer.singleShot(0, lambda: self.finish_traversal(job, result))
+            return job
+        with self.lock:
+            job, runnable = self.prefetching.get(self.key(demand, method, cutoff), (None, None))
+            if job is not None and job not in self.cancelled:
+                self.background.discard(job)
+                self.requests += 1
+                if self.prefetch_pool.tryTake(runnable):
+                    # still queued behind other prefetches
+                    del self.prefetching[self.key(demand, method, cutoff)]
+                    self.pool.start(runnable)
+                return job
+            self.requests += 1
+            job = next(self.ids)
+            self.pending.add(job)
+        self.pool.start(Job(self.traverse, job, demand, method, cutoff, time_limit))
+        return job
+
+    def prefetch(self, demand, method, cutoff, time_limit):
+        """Start a traversal in the background and return its job id, or None if the traversal
+        is cached or prefetched already."""
+        key = self.key(demand, method, cutoff)
+        with self.lock:
+            if key in self.cache or key in self.prefetching:
+                return None
+            job = next(self.ids)
+            runnable = Job(self.traverse, job, demand, method, cutoff, time_limit)
+            self.prefetching[key] = (job, runnable)
+            self.background.add(job)
+            self.pending.add(job)
+        self.prefetch_pool.start(runnable)
+        return job
+
+    def expand(self, analysis, index, time_limit):
+        """Start a traversal below node ``index`` of ``analysis`` and return its job id."""
+        job = next(self.ids)
+        with self.lock:
+            self.requests += 1
+            self.pending.add(job)
+        self.pool.start(Job(self.traverse_from, job, analysis, index, time_limit))
+        return job
+
+    def cancel(self, job):
+        with self.lock:
+            if job in self.pending:
+                self.cancelled.add(job)
+
+    def is_cancelled(self, job):
+        with self.lock:
+            return job in self.cancelled
+
+    def finish(self, job):
+        """Forget a finished job and return whether it was cancelled."""
+        with self.lock:
+            cancelled = job in self.cancelled
+            self.pending.discard(job)
+            self.cancelled.discard(job)
+            return cancelled
+
+    def release(self, job):
+        """Count a requested job as done, so that paused prefetches can continue."""
+        with self.lock:
+            if job in self.background:
+                self.background.discard(job)
+                return
+            self.requests -= 1
+            if not self.requests:
+                self.requests_done.notify_all()
+
+    def wait_for_requests(self, job):
+        """Pause a prefetch while requested jobs are running; return the seconds it waited."""
+        start = time.perf_counter()
+        with self.lock:
+            while self.requests and job in self.background and job not in self.cancelled:
+                self.requests_done.wait(self.SLICE)
+        return time.perf_counter() - start
+
+    def finish_traversal(self, job, result):
+        if not self.finish(job):
+            self.traversal_finished.emit(job, result)
+
+    def fail(self, job, error):
+        traceback.print_exc()
+        if not self.finish(job):
+            self.traversal_failed.emit(job, str(error) or type(error).__name__)
+
+    def traverse(self, job, demand, method, cutoff, time_limit):
+        key = self.key(demand, method, cutoff)
+        result = None
+        try:
+            result = self.traverse_slices(job, demand, method, cutoff, time_limit)
+        except Exception as error:
+            self.fail(job, error)
+            return
+        finally:
+            with self.lock:
+                if self.prefetching.get(key, (None,))[0] == job:
+                    del self.prefetching[key]
+                if result is not None:
+                    self.cache[key] = result
+                    while len(self.cache) > self.CACHE_SIZE:
+                        self.cache.popitem(last=False)
+            self.release(job)
+        if result is None:
+            self.finish(job)
+        else:
+            self.finish_traversal(job, result)
+
+    def traverse_slices(self, job, demand, method, cutoff, time_limit):
+        """Return the traversal, or None if the job was cancelled before it finished."""
+        self.wait_for_requests(job)
+        if self.is_cancelled(job):
+            return
+        analysis = PathAnalysis(demand, method, cutoff)
+        deadline = time.perf_counter() + time_limit
+        while not analysis.done and time.perf_counter() < deadline:
+            deadline += self.wait_for_requests(job)  # a pause does not shorten the traversal
+            if self.is_cancelled(job):
+                return
+            analysis.traverse(min(self.SLICE, deadline - time.perf_counter()))
+        load_metadata(analysis)
+        return analysis.calculate(0)
+
+    def traverse_from(self, job, analysis, index, time_limit):
+        try:
+            analysis.traverse_from(index, time_limit)
+            load_metadata(analysis)
+        except Exception as error:
+            self.fail(job, error)
+            return
+        finally:
+            self.release(job)
+        if not self.finish(job):
+            self.expansion_finished.emit(job, index)
+
+    def clear(self, name=None):
+        """Remove all cached traversals and cancel the prefetches, e.g. when a database changed."""
+        with self.lock:
+            self.cache.clear()
+            self.cancelled.update(job for job, _ in self.prefetching.values())
+            self.prefetching.clear()
 
 
-gt_worker_thread = GraphTraversalThread()
+traversal_jobs = TraversalJobs()
@@ -1,2 +1,3 @@
 # -*- coding: utf-8 -*-
 from .activity import ActivityDataGrid, DetailsGroupBox
+from .supply_chain import SupplyChainTree
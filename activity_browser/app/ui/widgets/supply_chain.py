@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from PyQt5 import QtCore, QtWidgets
+
+from ...bwutils.metadata import activity_metadata
+
+
+class SupplyChainTree(QtWidgets.QTreeWidget):
+    """Supply chain of a ``PathAnalysis`` as a tree of paths from the functional unit.
+
+    Every item is one path: its amount is the amount of the product needed along that path for
+    the functional unit and its score the cumulative score of that amount. Children are added
+    when an item is expanded, expanding nodes of the analysis that were not traversed yet.
+    """
+    HEADERS = ['Activity', 'Location', 'Amount', 'Unit', 'Score', 'Contribution (%)']
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.analysis = None
+        self.setHeaderLabels(self.HEADERS)
+        self.setAlternatingRowColors(True)
+        self.itemExpanded.connect(self.add_children)
+
+    def sync(self, analysis):
+        self.clear()
+        self.analysis = analysis
+        self.load_metadata(analysis.inputs[analysis.FUNCTIONAL_UNIT])
+        for edge in analysis.inputs[analysis.FUNCTIONAL_UNIT]:
+            self.add_item(self, int(edge['from']), float(edge['exc_amount']))
+        self.resizeColumnToContents(0)
+
+    def add_item(self, parent, index, amount):
+        activity = activity_metadata.get(self.analysis.reverse_activity_dict[index])
+        score = self.analysis.path_score(index, amount)
+        item = QtWidgets.QTreeWidgetItem(parent, [
+            activity.get('name', ''), activity.get('location', ''), '{:.4g}'.format(amount),
+            activity.get('unit', ''), '{:.4g}'.format(score),
+            '{:.2f}'.format(100 * score / self.analysis.score),
+        ])
+        item.setData(0, QtCore.Qt.UserRole, (index, amount))
+        item.setChildIndicatorPolicy(QtWidgets.QTreeWidgetItem.ShowIndicator)
+        return item
+
+    def add_children(self, item):
+        if item.childCount():
+            return
+        index, amount = item.data(0, QtCore.Qt.UserRole)
+        inputs = self.analysis.expand_node(index)
+        self.load_metadata(inputs)
+        for edge in inputs:
+            self.add_item(item, int(edge['from']), amount * float(edge['exc_amount']))
+        if not len(inputs):
+            item.setChildIndicatorPolicy(QtWidgets.QTreeWidgetItem.DontShowIndicator)
+
+    def load_metadata(self, edges):
+        activity_metadata.load(self.analysis.reverse_activity_dict[index]
+                               for index in edges['from'].tolist())
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import brightway2 as bw
 from PyQt5 import QtWidgets, QtGui
+import multiprocessing
 import os
 
 from activity_browser.app.bwutils import commontasks as bc
+from activity_browser.app.bwutils.multilca import MLCA
 from activity_browser.app.signals import signals
 from activity_browser.app.settings import ab_settings
 
@@ -37,6 +39,26 @@ class SettingsWizard(QtWidgets.QWizard):
             ab_settings.settings['startup_project'] = new_startup_project
             print("Saved startup project as: ", new_startup_project)
 
+        # lca calculation
+        if self.field('lca_processes') != ab_settings.settings.get('lca_processes', 1):
+            ab_settings.settings['lca_processes'] = self.field('lca_processes')
+            print("Saved number of LCA calculation processes as: ", self.field('lca_processes'))
+        if self.field('contribution_precision') != ab_settings.settings.get(
+                'contribution_precision', MLCA.PRECISIONS[0]):
+            ab_settings.settings['contribution_precision'] = self.field('contribution_precision')
+            print("Saved precision of contributions as: ", self.field('contribution_precision'))
+        if self.field('contribution_storage') != ab_settings.settings.get(
+                'contribution_storage', MLCA.STORAGE[0]):
+            ab_settings.settings['contribution_storage'] = self.field('contribution_storage')
+            print("Saved storage of contributions as: ", self.field('contribution_storage'))
+        if self.field('lazy_contributions') != ab_settings.settings.get(
+                'lazy_contributions', False):
+            ab_settings.settings['lazy_contributions'] = self.field('lazy_contributions')
+            print("Saved lazy contributions as: ", self.field('lazy_contributions'))
+        if self.field('contribution_memory') != ab_settings.settings.get('contribution_memory', 0):
+            ab_settings.settings['contribution_memory'] = self.field('contribution_memory')
+            print("Saved contribution memory limit (MB) as: ", self.field('contribution_memory'))
+
         ab_settings.write_settings()
 
     def cancel(self):
@@ -63,6 +85,49 @@ class SettingsPage(QtWidgets.QWizardPage):
         self.registerField('custom_bw_dir', self.bwdir_edit)
         self.bwdir_browse_button = QtWidgets.QPushButton('Browse')
 
+        self.processes_spinbox = QtWidgets.QSpinBox()
+        self.processes_spinbox.setRange(1, multiprocessing.cpu_count())
+        self.processes_spinbox.setValue(ab_settings.settings.get('lca_processes', 1))
+        self.processes_spinbox.setToolTip(
+            'Number of processes over which the functional units of an LCA calculation are split')
+        self.registerField('lca_processes', self.processes_spinbox)
+
+        self.precision_combobox = QtWidgets.QComboBox()
+        self.precision_combobox.addItems(MLCA.PRECISIONS)
+        self.precision_combobox.setCurrentText(
+            ab_settings.settings.get('contribution_precision', MLCA.PRECISIONS[0]))
+        self.precision_combobox.setToolTip(
+            'Precision in which process and elementary flow contributions are stored; '
+            'float32 halves their memory')
+        self.registerField('contribution_precision', self.precision_combobox, 'currentText')
+
+        self.storage_combobox = QtWidgets.QComboBox()
+        self.storage_combobox.addItems(MLCA.STORAGE)
+        self.storage_combobox.setCurrentText(
+            ab_settings.settings.get('contribution_storage', MLCA.STORAGE[0]))
+        self.storage_combobox.setToolTip(
+            'Keep contributions in memory, or in memory-mapped files in a temporary directory '
+            'or the project directory')
+        self.registerField('contribution_storage', self.storage_combobox, 'currentText')
+
+        self.lazy_checkbox = QtWidgets.QCheckBox('Compute contributions per method when shown')
+        self.lazy_checkbox.setChecked(ab_settings.settings.get('lazy_contributions', False))
+        self.lazy_checkbox.setToolTip(
+            'Calculate only the scores up front; contributions of a method are computed the first '
+            'time they are shown')
+        self.registerField('lazy_contributions', self.lazy_checkbox)
+
+        self.memory_spinbox = QtWidgets.QSpinBox()
+        self.memory_spinbox.setRange(0, 1024 * 1024)
+        self.memory_spinbox.setSuffix(' MB')
+        self.memory_spinbox.setSpecialValueText('unlimited')
+        self.memory_spinbox.setValue(ab_settings.settings.get('contribution_memory', 0))
+        self.memory_spinbox.setToolTip(
+            'Memory for the contributions of lazily computed methods; '
+            'the least recently shown methods are removed beyond it')
+        self.memory_spinbox.setEnabled(self.lazy_checkbox.isChecked())
+        self.registerField('contribution_memory', self.memory_spinbox)
+
         self.restore_defaults_button = QtWidgets.QPushButton('Restore defaults')
 
         # Startup options
@@ -76,8 +141,23 @@ class SettingsPage(QtWidgets.QWizardPage):
 
         self.startup_groupbox.setLayout(self.startup_layout)
 
+        # LCA calculation options
+        self.calculation_groupbox = QtWidgets.QGroupBox('LCA Calculation Options')
+        self.calculation_layout = QtWidgets.QGridLayout()
+        self.calculation_layout.addWidget(QtWidgets.QLabel('Parallel processes: '), 0, 0)
+        self.calculation_layout.addWidget(self.processes_spinbox, 0, 1)
+        self.calculation_layout.addWidget(QtWidgets.QLabel('Contribution precision: '), 1, 0)
+        self.calculation_layout.addWidget(self.precision_combobox, 1, 1)
+        self.calculation_layout.addWidget(QtWidgets.QLabel('Contribution storage: '), 2, 0)
+        self.calculation_layout.addWidget(self.storage_combobox, 2, 1)
+        self.calculation_layout.addWidget(self.lazy_checkbox, 3, 0, 1, 2)
+        self.calculation_layout.addWidget(QtWidgets.QLabel('Contribution memory: '), 4, 0)
+        self.calculation_layout.addWidget(self.memory_spinbox, 4, 1)
+        self.calculation_groupbox.setLayout(self.calculation_layout)
+
         self.layout = QtWidgets.QVBoxLayout()
         self.layout.addWidget(self.startup_groupbox)
+        self.layout.addWidget(self.calculation_groupbox)
         self.layout.addStretch()
         self.layout.addWidget(self.restore_defaults_button)
         self.setLayout(self.layout)
@@ -89,11 +169,22 @@ class SettingsPage(QtWidgets.QWizardPage):
         self.startup_project_combobox.currentIndexChanged.connect(self.changed)
         self.bwdir_browse_button.clicked.connect(self.bwdir_browse)
         self.bwdir_edit.textChanged.connect(self.changed)
+        self.processes_spinbox.valueChanged.connect(self.changed)
+        self.precision_combobox.currentIndexChanged.connect(self.changed)
+        self.storage_combobox.currentIndexChanged.connect(self.changed)
+        self.lazy_checkbox.stateChanged.connect(self.changed)
+        self.lazy_checkbox.toggled.connect(self.memory_spinbox.setEnabled)
+        self.memory_spinbox.valueChanged.connect(self.changed)
         self.restore_defaults_button.clicked.connect(self.restore_defaults)
 
     def restore_defaults(self):
         self.change_bw_dir(bc.get_default_bw_dir())
         self.startup_project_combobox.setCurrentText(bc.get_default_project_name())
+        self.processes_spinbox.setValue(1)
+        self.precision_combobox.setCurrentText(MLCA.PRECISIONS[0])
+        self.storage_combobox.setCurrentText(MLCA.STORAGE[0])
+        self.lazy_checkbox.setChecked(False)
+        self.memory_spinbox.setValue(0)
 
     def bwdir_browse(self):
         path = QtWidgets.QFileDialog().getExistingDirectory(
@@ -2,4 +2,5 @@
 from activity_browser import run_activity_browser
 
 
-run_activity_browser()
+if __name__ == '__main__':
+    run_activity_browser()
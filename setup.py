@@ -30,6 +30,7 @@ setup(
     entry_points={
         'console_scripts': [
             'activity-browser = activity_browser.app:run_activity_browser',
+            'activity-browser-batch = activity_browser.app.bwutils.batch:main',
         ]
     },
     classifiers=[
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 import pytest
 
 import brightway2 as bw
 from activity_browser import Application
+from activity_browser.app.bwutils.factorization import factorized_systems
 
 
 @pytest.fixture(scope='session')
@@ -12,3 +14,63 @@ def ab_app():
     application = Application()
     application.show()
     return application
+
+
+def build_lca_project(n=30, seed=0):
+    """Write a random inventory database with uncertain exchanges, four LCIA methods and the
+    calculation setup 'cs' to the current project."""
+    rng = np.random.RandomState(seed)
+    bw.Database('bio').write({
+        ('bio', 'e{}'.format(i)): {'name': 'emission {}'.format(i), 'type': 'emission',
+                                   'unit': 'kg', 'categories': ('air',)}
+        for i in range(8)
+    })
+    tech = {}
+    for i in range(n):
+        exchanges = [{'input': ('tech', 'a{}'.format(i)), 'amount': 1, 'type': 'production'}]
+        for j in rng.choice(n, 4, replace=False):
+            if j != i:
+                amount = float(rng.rand() * 0.2)
+                exchanges.append({
+                    'input': ('tech', 'a{}'.format(j)), 'amount': amount, 'type': 'technosphere',
+                    'uncertainty type': 2, 'loc': float(np.log(amount + 1e-3)), 'scale': 0.1,
+                })
+        for k in rng.choice(8, 3, replace=False):
+            amount = float(rng.rand())
+            exchanges.append({
+                'input': ('bio', 'e{}'.format(k)), 'amount': amount, 'type': 'biosphere',
+                'uncertainty type': 2, 'loc': float(np.log(amount + 1e-3)), 'scale': 0.2,
+            })
+        tech[('tech', 'a{}'.format(i))] = {
+            'name': 'act {}'.format(i), 'unit': 'kg', 'location': ['CH', 'DE', 'GLO'][i % 3],
+            'reference product': 'prod {}'.format(i % 7), 'type': 'process',
+            'exchanges': exchanges,
+        }
+    bw.Database('tech').write(tech)
+    for m in range(4):
+        method = bw.Method(('pytest', str(m)))
+        method.register()
+        method.write([(('bio', 'e{}'.format(k)), float(rng.rand() * (m + 1)))
+                      for k in range(8) if (k + m) % 3])
+    bw.calculation_setups['cs'] = {
+        'inv': [{('tech', 'a{}'.format(i)): float(i + 1)} for i in range(0, n, 3)],
+        'ia': [('pytest', str(m)) for m in range(4)],
+    }
+
+
+@pytest.fixture(scope='module')
+def lca_project():
+    """A new project with the database of ``build_lca_project`` for the tests of a module.
+
+    The previous project is selected again afterwards, so the GUI tests keep their project.
+    """
+    previous = bw.projects.current
+    if 'pytest_lca' in bw.projects:
+        bw.projects.delete_project('pytest_lca', delete_dir=True)
+    bw.projects.set_current('pytest_lca')
+    factorized_systems.clear()
+    build_lca_project()
+    yield 'pytest_lca'
+    factorized_systems.clear()
+    bw.projects.set_current(previous)
+    bw.projects.delete_project('pytest_lca', delete_dir=True)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import brightway2 as bw
+from PyQt5 import QtCore
+
+from activity_browser.app.bwutils.metadata import activity_metadata, database_snapshot
+from activity_browser.app.ui.tables.inventory import ActivitiesModel
+
+
+def test_database_snapshot(lca_project):
+    snapshot = database_snapshot('tech')
+    activities = sorted(bw.Database('tech'), key=lambda activity: activity['name'])
+    assert snapshot['key'] == [activity.key for activity in activities]
+    assert snapshot['name'] == [activity['name'] for activity in activities]
+    assert snapshot['reference product'] == [
+        activity['reference product'] for activity in activities]
+    assert snapshot['location'] == [activity['location'] for activity in activities]
+    assert database_snapshot('tech', kind='emission')['key'] == []
+    assert len(database_snapshot('bio', kind='emission')['key']) == 8
+
+
+def test_rows_are_fetched_in_batches(qtbot, lca_project):
+    activity_metadata.clear()
+    model = ActivitiesModel()
+    model.BATCH_SIZE = 12
+    model.set_database('tech')
+    assert model.size() == 30 and model.rowCount() == 0
+    fetched = []
+    while model.canFetchMore():
+        model.fetchMore()
+        fetched.append(model.rowCount())
+    assert fetched == [12, 24, 30]
+    unit = model.COLUMNS.index('unit')
+    assert all(model.data(model.index(row, unit)) == 'kg' for row in range(model.rowCount()))
+    assert model.key(0) == database_snapshot('tech')['key'][0]
+
+    model.clear()
+    assert model.size() == 0 and not model.canFetchMore()
+
+
+def test_sort_orders_the_whole_snapshot(qtbot, lca_project):
+    model = ActivitiesModel()
+    model.BATCH_SIZE = 5
+    model.set_database('tech')
+    model.sort(model.COLUMNS.index('location'), QtCore.Qt.DescendingOrder)
+    assert model.rowCount() == 0  # the view fetches the rows again after the reset
+    model.fetchMore()
+    locations = [bw.get_activity(model.key(row))['location'] for row in range(model.size())]
+    assert locations == sorted(locations, reverse=True)
+    assert [model.data(model.index(row, 2)) for row in range(5)] == locations[:5]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import time
+
+import numpy as np
+import brightway2 as bw
+
+from activity_browser.app.bwutils.cache import ResultCache
+from activity_browser.app.bwutils.multilca import MLCA
+
+
+def test_save_and_load(lca_project):
+    cache = ResultCache()
+    cache.clear()
+    mlca = MLCA('cs', contribution_limit=5)
+    assert cache.load('cs', contribution_limit=5) is None
+    cache.save(mlca)
+    cached = cache.load('cs', contribution_limit=5)
+    assert cached is not None
+    assert np.array_equal(cached.results, mlca.results)
+    assert cached.func_units == mlca.func_units and cached.methods == mlca.methods
+    assert cached.rev_activity_dict == mlca.rev_activity_dict
+    assert cached.rev_biosphere_dict == mlca.rev_biosphere_dict
+    for method in range(len(mlca.methods)):
+        for store in ('process_contributions', 'elementary_flow_contributions'):
+            assert np.array_equal(getattr(cached, store).to_dense(method),
+                                  getattr(mlca, store).to_dense(method))
+            assert np.array_equal(getattr(cached, store).totals(method),
+                                  getattr(mlca, store).totals(method))
+    assert cached.top_process_contributions(mlca.methods[1]) == \
+        mlca.top_process_contributions(mlca.methods[1])
+
+
+def test_key_changes_with_options_and_setup(lca_project):
+    cache = ResultCache()
+    cache.clear()
+    cache.save(MLCA('cs'))
+    assert cache.load('cs') is not None
+    assert cache.load('cs', contribution_limit=3) is None
+    assert cache.load('cs', contribution_dtype=np.float32) is None
+    assert cache.load('unknown setup') is None
+
+    cs = bw.calculation_setups['cs']
+    bw.calculation_setups['cs'] = dict(cs, ia=cs['ia'][::-1])
+    try:
+        assert cache.load('cs') is None
+    finally:
+        bw.calculation_setups['cs'] = cs
+    assert cache.load('cs') is not None
+
+    cache.invalidate_calculation_setup('cs')
+    assert cache.load('cs') is None
+    assert cache.load_index() == {}
+
+
+def test_changed_data_invalidates_entries(lca_project):
+    cache = ResultCache()
+    cache.clear()
+    cache.save(MLCA('cs'))
+
+    method = bw.Method(bw.calculation_setups['cs']['ia'][0])
+    time.sleep(0.01)
+    method.write(method.load())
+    assert cache.load('cs') is None
+    cache.save(MLCA('cs'))
+    assert cache.load('cs') is not None
+    assert len(cache.load_index()) == 1  # the outdated entry of the setup was replaced
+
+    activity = bw.get_activity(('tech', 'a0'))
+    activity['name'] = 'changed'
+    activity.save()
+    assert cache.load('cs') is None
+
+    cache.save(MLCA('cs'))
+    cache.invalidate_database('bio')  # 'tech' depends on 'bio'
+    assert cache.load_index() == {}
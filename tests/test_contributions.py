@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import gc
+import os
+
+import numpy as np
+from scipy import sparse
+
+from activity_browser.app.bwutils.contributions import ContributionStore
+
+
+def random_rows(rows=6, size=20, seed=0):
+    rng = np.random.RandomState(seed)
+    dense = rng.randn(rows, size)
+    dense[rng.rand(rows, size) < 0.5] = 0
+    return dense
+
+
+def test_append_keeps_rows_and_totals():
+    dense = random_rows()
+    store = ContributionStore(2, dense.shape[1], cutoff=None)
+    store.append(0, dense[0])
+    store.append(0, dense[1:4])
+    store.append(0, sparse.csr_matrix(dense[4:]))
+    store.append(1, -dense)
+    assert np.array_equal(store.to_dense(0), dense)
+    assert np.array_equal(store.to_dense(1), -dense)
+    assert np.allclose(store.totals(0), dense.sum(axis=1))
+    assert store.matrix(0).nnz == np.count_nonzero(dense)
+
+
+def test_reduced_rows_keep_their_totals():
+    dense = random_rows()
+    store = ContributionStore(1, dense.shape[1], limit=2, cutoff=None)
+    store.append(0, dense)
+    matrix = store.matrix(0)
+    assert np.all(np.diff(matrix.indptr) <= 2)
+    for row, reduced in zip(dense, store.to_dense(0)):
+        largest = np.sort(np.abs(row))[-2:]
+        assert np.allclose(np.sort(np.abs(reduced[reduced != 0])), largest[largest != 0])
+    assert np.allclose(store.totals(0), dense.sum(axis=1))
+
+    store = ContributionStore(1, dense.shape[1], cutoff=0.1)
+    store.append(0, dense)
+    kept = store.to_dense(0)
+    threshold = 0.1 * np.abs(dense).sum(axis=1, keepdims=True)
+    assert np.array_equal(kept, np.where(np.abs(dense) >= threshold, dense, 0))
+
+
+def test_append_checks_the_row_length():
+    store = ContributionStore(1, 5)
+    try:
+        store.append(0, np.ones(4))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("rows of the wrong length were accepted")
+
+
+def test_insert_takes_reduced_rows():
+    dense = random_rows()
+    matrix = sparse.csr_matrix(dense)
+    totals = np.arange(len(dense), dtype=float)
+    store = ContributionStore(1, dense.shape[1])
+    store.insert(0, (matrix.data, matrix.indices, matrix.indptr), totals)
+    assert np.array_equal(store.to_dense(0), dense)
+    assert np.array_equal(store.totals(0), totals)
+
+
+def test_take_selects_rows_and_methods():
+    dense = random_rows()
+    store = ContributionStore(3, dense.shape[1], cutoff=None)
+    for method in range(3):
+        store.append(method, dense * (method + 1))
+    taken = store.take([4, 0, 2], [2, 0])
+    assert len(taken) == 2
+    assert np.array_equal(taken.to_dense(0), dense[[4, 0, 2]] * 3)
+    assert np.array_equal(taken.to_dense(1), dense[[4, 0, 2]])
+    assert np.allclose(taken.totals(0), 3 * dense[[4, 0, 2]].sum(axis=1))
+
+
+def test_memory_mapped_store(tmpdir):
+    dense = random_rows()
+    store = ContributionStore(2, dense.shape[1], cutoff=None, dtype=np.float32,
+                              directory=str(tmpdir))
+    store.append(0, dense[:3])
+    store.append(0, dense[3:])
+    path = store.path
+    assert os.path.isdir(path) and os.listdir(path)
+    matrix = store.matrix(0)
+    base = matrix.data
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert base is not None  # the data is backed by the file
+    assert np.allclose(store.to_dense(0), dense.astype(np.float32))
+    assert store.to_dense(1).shape == (0, dense.shape[1])
+
+    store.clear(0)
+    store.append(0, 2 * dense)
+    assert np.allclose(store.to_dense(0), 2 * dense.astype(np.float32))
+
+    del store, matrix, base
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_top_array_equals_sorting_every_row():
+    dense = random_rows(rows=8, size=30, seed=3)
+    dense[2] = 0
+    dense[5, 3:] = 0  # fewer stored entries than the limit
+    store = ContributionStore(1, dense.shape[1], cutoff=None)
+    store.append(0, dense)
+    top = store.top_array(0, limit=4)
+    assert len(top) == len(dense)
+    for row, record in zip(dense, top):
+        order = np.argsort(-np.abs(row), kind='stable')[:4]
+        order = order[row[order] != 0]
+        padding = 4 - len(order)
+        assert list(record['index']) == list(order) + [-1] * padding
+        assert np.array_equal(record['value'], np.append(row[order], np.zeros(padding)))
+        assert np.isclose(record['rest'], row.sum() - row[order].sum())
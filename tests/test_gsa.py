@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import brightway2 as bw
+from bw2calc.matrices import TechnosphereBiosphereMatrixBuilder as TBMBuilder
+from scipy.sparse.linalg import splu
+
+from activity_browser.app.bwutils.gsa import SobolGSA
+
+
+def full_score(gsa, values, sample):
+    """The score of one sample, with the technosphere of that sample factorized again."""
+    params = gsa.params
+    signed = TBMBuilder.fix_supply_use(params['technosphere'],
+                                       values['technosphere'][:, sample].copy())
+    technosphere = gsa.tech_pattern.matrix(signed)
+    biosphere = gsa.bio_pattern.matrix(values['biosphere'][:, sample])
+    factors = np.bincount(params['characterization']['row'],
+                          weights=values['characterization'][:, sample], minlength=gsa.n_bio)
+    return factors.dot(biosphere * splu(technosphere.tocsc()).solve(gsa.lca.demand_array))
+
+
+def test_evaluate_equals_brute_force(lca_project):
+    cs = bw.calculation_setups['cs']
+    gsa = SobolGSA('cs', 1, cs['ia'][1], screening=0.999, max_parameters=30)
+    assert gsa.dimensions and len(gsa.parameters['technosphere'])
+    a, b = gsa.design(4, seed=1)
+    scores_a, scores_b, scores_ab = gsa.evaluate(a, b)
+    values_a, values_b = gsa.values(a), gsa.values(b)
+    for sample in range(a.shape[1]):
+        assert np.isclose(scores_a[sample], full_score(gsa, values_a, sample), rtol=1e-10)
+        assert np.isclose(scores_b[sample], full_score(gsa, values_b, sample), rtol=1e-10)
+        for parameter in range(gsa.dimensions):
+            ab = a.copy()
+            ab[parameter] = b[parameter]
+            assert np.isclose(scores_ab[parameter, sample],
+                              full_score(gsa, gsa.values(ab), sample), rtol=1e-9)
+
+
+def test_parallel_indices_equal_serial_indices(lca_project):
+    gsa = SobolGSA('cs', 2, max_parameters=10)
+    serial = gsa.calculate(64, seed=0)
+    pd.testing.assert_frame_equal(gsa.calculate(64, seed=0, processes=2), serial)
+    assert len(serial) == gsa.dimensions
+    assert serial['total'].is_monotonic_decreasing
+
+
+def additive_model(x):
+    return x[0] + 2 * x[1]
+
+
+def test_indices_of_an_additive_model():
+    rng = np.random.default_rng(0)
+    a, b = rng.random((2, 20000)), rng.random((2, 20000))
+    model = additive_model
+    scores_ab = np.array([model(np.where(np.arange(2)[:, None] == i, b, a)) for i in range(2)])
+    first, total = SobolGSA.sobol_indices(model(a), model(b), scores_ab)
+    assert np.allclose(first, [0.2, 0.8], atol=0.03)
+    assert np.allclose(total, [0.2, 0.8], atol=0.03)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import sys
+
+import numpy as np
+import pytest
+import scipy.stats
+
+from activity_browser.app.bwutils import montecarlo
+from activity_browser.app.bwutils.montecarlo import MonteCarloMLCA, RunningStatistics
+from activity_browser.app.bwutils.multilca import MLCA
+
+
+def test_running_statistics_equal_numpy():
+    rng = np.random.RandomState(1)
+    samples = rng.lognormal(size=(257, 3, 4))
+    statistics = RunningStatistics((3, 4))
+    for start, stop in ((0, 1), (1, 50), (50, 50), (50, 200), (200, 257)):
+        statistics.update(samples[start:stop])
+    assert statistics.count == len(samples)
+    assert np.allclose(statistics.mean, samples.mean(axis=0))
+    assert np.allclose(statistics.variance, samples.var(axis=0, ddof=1))
+    assert np.array_equal(statistics.minimum, samples.min(axis=0))
+    assert np.array_equal(statistics.maximum, samples.max(axis=0))
+    assert np.allclose(statistics.standard_error,
+                       samples.std(axis=0, ddof=1) / np.sqrt(len(samples)))
+
+
+def test_running_statistics_copy_and_convergence():
+    statistics = RunningStatistics((2,))
+    assert np.all(np.isnan(statistics.variance))
+    assert not statistics.converged(0.1)
+    statistics.update(np.array([[1., 10.], [1.1, 10.]]))
+    copy = statistics.copy()
+    statistics.update(np.array([[100., -5.]]))
+    assert copy.count == 2 and np.allclose(copy.mean, [1.05, 10.])
+    assert not statistics.converged(0.01)
+    constant = RunningStatistics((2,))
+    constant.update(np.ones((5, 2)))
+    assert constant.converged(0.01)
+
+
+def test_sobol_falls_back_to_latin_hypercube_above_its_dimensions(lca_project, monkeypatch):
+    dimensions = MonteCarloMLCA('cs', 'sobol').dimensions
+    assert dimensions
+    monkeypatch.setattr(montecarlo, 'SOBOL_MAX_DIMENSIONS', dimensions - 1)
+    with pytest.raises(ValueError):
+        montecarlo.sobol(dimensions, 4, np.random.default_rng(0))
+    with pytest.warns(UserWarning):
+        monte_carlo = MonteCarloMLCA('cs', 'sobol')
+    assert monte_carlo.sampling == 'latin hypercube' and monte_carlo.notice
+    assert monte_carlo.calculate(20, seed=1).count == 20
+
+
+def test_latin_hypercube_has_one_point_per_stratum_over_all_chunks(lca_project):
+    monte_carlo = MonteCarloMLCA('cs', 'latin hypercube')
+    sizes = [64, 64, 22]
+    designs = monte_carlo.designs(sizes, np.random.SeedSequence(1))
+    rng = np.random.default_rng(2)
+    percentiles = np.hstack([design.percentiles(rng) for design in designs])
+    assert percentiles.shape == (monte_carlo.dimensions, sum(sizes))
+    strata = np.sort(np.floor(percentiles * sum(sizes)), axis=1)
+    assert np.array_equal(strata, np.tile(np.arange(sum(sizes)), (monte_carlo.dimensions, 1)))
+
+
+def test_sobol_chunks_are_consecutive_points_of_one_sequence():
+    percentiles = montecarlo.sobol(5, 256, np.random.default_rng(1))
+    assert percentiles.shape == (5, 256)
+    strata = np.sort(np.floor(percentiles * 256), axis=1)
+    assert np.array_equal(strata, np.tile(np.arange(256), (5, 1)))
+    chunks = [montecarlo.sobol(5, 64, np.random.default_rng(1), start)
+              for start in range(0, 256, 64)]
+    assert np.array_equal(np.hstack(chunks), percentiles)
+
+
+@pytest.mark.parametrize('sampling', ['latin hypercube', 'sobol'])
+def test_sampling_means_are_close_to_random_sampling(lca_project, sampling):
+    random = MonteCarloMLCA('cs', 'random').calculate(512, seed=1)
+    statistics = MonteCarloMLCA('cs', sampling).calculate(512, seed=1)
+    assert statistics.count == 512 and statistics.mean.shape == random.mean.shape
+    assert np.all(np.isfinite(statistics.mean)) and np.all(statistics.std > 0)
+    error = np.sqrt(random.standard_error ** 2 + statistics.standard_error ** 2)
+    assert np.all(np.abs(statistics.mean - random.mean) < 4 * error)
+
+
+def test_sobol_without_qmc_raises_a_clear_error(monkeypatch):
+    monkeypatch.delattr(scipy.stats, 'qmc')
+    monkeypatch.setitem(sys.modules, 'scipy.stats.qmc', None)
+    with pytest.raises(ImportError, match='scipy 1.7'):
+        montecarlo.sobol(2, 4, np.random.default_rng(0))
+
+
+def test_without_uncertainty_the_scores_equal_mlca(lca_project):
+    monte_carlo = MonteCarloMLCA('cs')
+    for params in monte_carlo.params:
+        params['uncertainty_type'] = 0
+        params['loc'] = params['amount']
+    samples = np.vstack(list(monte_carlo.chunks(3, seed=1)))
+    mlca = MLCA('cs')
+    assert samples.shape == (3,) + mlca.results.shape
+    for scores in samples:
+        assert np.allclose(scores, mlca.results, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('sampling', MonteCarloMLCA.SAMPLING)
+def test_parallel_samples_equal_serial_samples(lca_project, sampling):
+    monte_carlo = MonteCarloMLCA('cs', sampling)
+    serial = np.vstack(list(monte_carlo.chunks(150, seed=3, chunk_size=32)))
+    parallel = np.vstack(list(monte_carlo.chunks(150, seed=3, processes=2, chunk_size=32)))
+    assert serial.shape == (150,) + monte_carlo.shape
+    assert np.array_equal(parallel, serial)
+    assert not np.array_equal(monte_carlo.calculate(150, seed=4).mean, serial.mean(axis=0))
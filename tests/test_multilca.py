@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import brightway2 as bw
+
+from activity_browser.app.bwutils.multilca import MLCA
+
+
+def baseline(func_units, methods):
+    """Scores and process contributions of every functional unit and method with ``bw.LCA``."""
+    scores = np.zeros((len(func_units), len(methods)))
+    contributions = {}
+    for row, func_unit in enumerate(func_units):
+        lca = bw.LCA(func_unit, methods[0])
+        lca.lci()
+        for col, method in enumerate(methods):
+            lca.switch_method(method)
+            lca.lcia()
+            scores[row, col] = lca.score
+            contributions[row, col] = np.asarray(lca.characterized_inventory.sum(axis=0)).ravel()
+    return scores, contributions
+
+
+def test_scores_and_contributions_match_lca(lca_project):
+    cs = bw.calculation_setups['cs']
+    mlca = MLCA('cs', batch_size=3, contribution_cutoff=None)
+    scores, contributions = baseline(cs['inv'], cs['ia'])
+    assert mlca.results.shape == (len(cs['inv']), len(cs['ia']))
+    assert np.allclose(mlca.results, scores, rtol=1e-10)
+    for (row, col), expected in contributions.items():
+        stored = mlca.process_contributions.to_dense(col)[row]
+        assert np.allclose(stored, expected, rtol=1e-10, atol=1e-14)
+        assert np.isclose(mlca.process_contributions.totals(col)[row], scores[row, col])
+        assert np.isclose(mlca.elementary_flow_contributions.totals(col)[row], scores[row, col])
+
+
+def test_parallel_results_equal_serial_results(lca_project):
+    serial = MLCA('cs', batch_size=2)
+    parallel = MLCA('cs', batch_size=2, processes=2)
+    assert np.array_equal(parallel.results, serial.results)
+    for method in range(len(serial.methods)):
+        for store in ('process_contributions', 'elementary_flow_contributions'):
+            assert np.array_equal(getattr(parallel, store).to_dense(method),
+                                  getattr(serial, store).to_dense(method))
+
+
+def assert_same_results(updated, fresh):
+    assert updated.func_units == fresh.func_units and updated.methods == fresh.methods
+    assert np.allclose(updated.results, fresh.results, rtol=1e-10)
+    for method in range(len(fresh.methods)):
+        for store in ('process_contributions', 'elementary_flow_contributions'):
+            assert np.allclose(getattr(updated, store).to_dense(method),
+                               getattr(fresh, store).to_dense(method), rtol=1e-10, atol=1e-14)
+
+
+def test_update_after_adding_func_units_and_methods(lca_project):
+    cs = bw.calculation_setups['cs']
+    bw.calculation_setups['cs'] = dict(cs, inv=cs['inv'][1:-1], ia=cs['ia'][:2])
+    try:
+        mlca = MLCA('cs', batch_size=3)
+    finally:
+        bw.calculation_setups['cs'] = cs
+    system = mlca.system
+    mlca.update()
+    assert mlca.system is system  # updated incrementally
+    assert_same_results(mlca, MLCA('cs', batch_size=3))
+
+    bw.calculation_setups['cs'] = dict(cs, inv=cs['inv'][::-1], ia=cs['ia'][1:])
+    try:
+        mlca.update()
+        assert_same_results(mlca, MLCA('cs', batch_size=3))
+    finally:
+        bw.calculation_setups['cs'] = cs
+
+
+def test_update_after_changed_data_uses_the_processes(lca_project, monkeypatch):
+    mlca = MLCA('cs', batch_size=2, processes=2)
+    assert mlca.processes == 2
+    exchange = next(iter(bw.get_activity(('tech', 'a1')).technosphere()))
+    exchange['amount'] *= 2
+    exchange.save()
+    calls = []
+    calculate_parallel = MLCA.calculate_parallel
+
+    def spy(self, processes):
+        calls.append(processes)
+        calculate_parallel(self, processes)
+    monkeypatch.setattr(MLCA, 'calculate_parallel', spy)
+    try:
+        mlca.update()
+        assert calls == [2]
+        assert_same_results(mlca, MLCA('cs', batch_size=2))
+    finally:
+        exchange['amount'] /= 2
+        exchange.save()
+
+
+def test_update_after_new_activity_rebuilds_the_group_matrices(lca_project):
+    mlca = MLCA('cs', batch_size=3)
+    mlca.top_grouped_contributions('location')
+    activity = bw.Database('tech').new_activity('new', name='new', unit='kg', location='NEW')
+    activity.save()
+    activity.new_exchange(input=activity.key, amount=1, type='production').save()
+    activity.new_exchange(input=('tech', 'a0'), amount=1, type='technosphere').save()
+    try:
+        mlca.update()
+        assert len(mlca.rev_activity_dict) == 31
+        assert_same_results(mlca, MLCA('cs', batch_size=3))
+        fresh = MLCA('cs', batch_size=3).top_grouped_contributions('location')
+        assert mlca.top_grouped_contributions('location') == fresh
+    finally:
+        activity.delete()
+
+
+def test_updating_a_copy_leaves_the_original_unchanged(lca_project):
+    cs = bw.calculation_setups['cs']
+    bw.calculation_setups['cs'] = dict(cs, inv=cs['inv'][:-1], ia=cs['ia'][:2])
+    try:
+        mlca = MLCA('cs', batch_size=3)
+        expected = MLCA('cs', batch_size=3)
+    finally:
+        bw.calculation_setups['cs'] = cs
+    mlca.top_grouped_contributions('location')
+    copied = mlca.copy()
+    assert copied.process_contributions is not mlca.process_contributions
+    copied.update()
+    copied.top_grouped_contributions('product')
+    assert_same_results(copied, MLCA('cs', batch_size=3))
+    assert_same_results(mlca, expected)
+    assert set(mlca.group_matrices) == {'location'}
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import brightway2 as bw
+
+from activity_browser.app.bwutils.pathanalysis import PathAnalysis
+
+
+def edge_set(edges):
+    return sorted((e['to'], e['from'], round(e['impact'], 8), round(e['amount'], 8),
+                   round(e['exc_amount'], 8)) for e in edges)
+
+
+def test_calculate_equals_graph_traversal(lca_project):
+    cs = bw.calculation_setups['cs']
+    for func_unit in cs['inv'][:3]:
+        for method in cs['ia'][:2]:
+            expected = bw.GraphTraversal().calculate(func_unit, method, cutoff=0.005, max_calc=1e6)
+            result = PathAnalysis(func_unit, method, cutoff=0.005).calculate()
+            assert set(result['nodes']) == set(expected['nodes'])
+            for node, values in expected['nodes'].items():
+                for field in ('amount', 'cum', 'ind'):
+                    assert np.isclose(result['nodes'][node][field], values[field],
+                                      rtol=1e-8, atol=1e-12)
+            assert edge_set(result['edges']) == edge_set(expected['edges'])
+
+
+def test_continued_traversal_equals_calculate(lca_project):
+    cs = bw.calculation_setups['cs']
+    analysis = PathAnalysis(cs['inv'][0], cs['ia'][0], cutoff=0.001)
+    found = len(analysis.edges)  # the inputs of the functional unit
+    while not analysis.done:
+        found += len(analysis.traverse(0.001))
+    assert found == len(analysis.edges)
+    expected = PathAnalysis(cs['inv'][0], cs['ia'][0], cutoff=0.001).calculate()
+    assert edge_set(analysis.calculate()['edges']) == edge_set(expected['edges'])
+
+
+def test_traverse_from_adds_no_duplicate_edges(lca_project):
+    cs = bw.calculation_setups['cs']
+    analysis = PathAnalysis(cs['inv'][0], cs['ia'][0], cutoff=0.005)
+    root = int(analysis.inputs[analysis.FUNCTIONAL_UNIT]['from'][0])
+    before = len(analysis.edges)
+    new = analysis.traverse_from(root, 1.0)
+    edges = analysis.edges
+    assert len(edges) == before + len(new)
+    pairs = list(zip(edges['to'].tolist(), edges['from'].tolist()))
+    assert len(pairs) == len(set(pairs))
+    analysis.expand_node(root, 0.0)
+    pairs = list(zip(analysis.edges['to'].tolist(), analysis.edges['from'].tolist()))
+    assert len(pairs) == len(set(pairs))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import brightway2 as bw
+
+from activity_browser.app.bwutils.factorization import factorized_systems
+from activity_browser.app.bwutils.multilca import MLCA
+from activity_browser.app.bwutils.scenarios import KEY_COLUMNS, ScenarioMLCA, read_scenarios
+
+
+def edited_results(changes):
+    """The MLCA results after writing the ``changes`` (exchange, amount) to the database."""
+    amounts = [(exchange, exchange['amount']) for exchange, _ in changes]
+    try:
+        for exchange, amount in changes:
+            exchange['amount'] = amount
+            exchange.save()
+        factorized_systems.clear()
+        return MLCA('cs').results
+    finally:
+        for exchange, amount in amounts:
+            exchange['amount'] = amount
+            exchange.save()
+        factorized_systems.clear()
+
+
+def test_scenarios_equal_edited_databases(lca_project, tmpdir):
+    activity = bw.get_activity(('tech', 'a3'))
+    technosphere = next(iter(activity.technosphere()))
+    biosphere = next(iter(activity.biosphere()))
+    table = pd.DataFrame([
+        [technosphere.input.key[0], technosphere.input.key[1], 'tech', 'a3',
+         technosphere['amount'] * 2, np.nan, technosphere['amount'] * 3, np.nan],
+        [biosphere.input.key[0], biosphere.input.key[1], 'tech', 'a3',
+         np.nan, biosphere['amount'] * 5, biosphere['amount'] * 0.5, np.nan],
+    ], columns=KEY_COLUMNS + ['tech x2', 'bio x5', 'both', 'base'])
+    path = str(tmpdir.join('scenarios.csv'))
+    table.to_csv(path, index=False)
+
+    scenario_lca = ScenarioMLCA('cs', read_scenarios(path))
+    results = scenario_lca.calculate()
+    assert results.shape == (4, len(scenario_lca.func_units), len(scenario_lca.methods))
+    assert np.allclose(results[3], MLCA('cs').results, rtol=1e-12)
+    expected = [
+        [(technosphere, technosphere['amount'] * 2)],
+        [(biosphere, biosphere['amount'] * 5)],
+        [(technosphere, technosphere['amount'] * 3), (biosphere, biosphere['amount'] * 0.5)],
+    ]
+    for scenario, changes in enumerate(expected):
+        assert not np.allclose(results[scenario], results[3])
+        assert np.allclose(results[scenario], edited_results(changes), rtol=1e-10)
+    assert np.array_equal(ScenarioMLCA('cs', table).calculate(processes=2), results)
+
+
+def test_unknown_exchanges_are_rejected(lca_project):
+    supplied = bw.get_activity(('tech', 'a0'))
+    consumer = next(activity for activity in bw.Database('tech') if activity != supplied and
+                    all(exchange.input != supplied for exchange in activity.technosphere()))
+    table = pd.DataFrame([['tech', 'a0', 'tech', consumer['code'], 2.]],
+                         columns=KEY_COLUMNS + ['s'])
+    try:
+        ScenarioMLCA('cs', table)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a scenario of an exchange that does not exist was accepted")